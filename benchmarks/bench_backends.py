@@ -0,0 +1,114 @@
+# Requests/sec and latency percentiles of a single node, for each serving backend.
+#
+#   PYTHONPATH=src python benchmarks/bench_backends.py --requests 5000 --concurrency 16
+#
+# Each backend is started as its own process ('python -m zerocache'), and driven over pooled
+# keep-alive connections, for GET hits, GET misses and PUTs. Backends whose package is not
+# installed (waitress, cheroot) are skipped.
+import argparse
+import importlib.util
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+import requests
+from requests.adapters import HTTPAdapter
+
+BACKEND_PACKAGES = {'paste': 'paste', 'waitress': 'waitress', 'cheroot': 'cheroot'}
+
+def start_node(backend, port, workers):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, ['src', env.get('PYTHONPATH')]))
+    node = subprocess.Popen(
+        [sys.executable, '-m', 'zerocache', '127.0.0.1', 'bench', '--port', str(port), '--server-backend', backend, '--workers', str(workers)]
+        , env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/ping', timeout=0.5)
+            return node
+        except requests.RequestException:
+            time.sleep(0.1)
+    stop_node(node)
+    raise RuntimeError(f'{backend} did not start')
+
+def stop_node(node):
+    node.send_signal(signal.SIGINT)
+    try:
+        node.wait(timeout=3)
+    except subprocess.TimeoutExpired:
+        node.kill()
+
+def new_session(concurrency):
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_maxsize=concurrency))
+    return session
+
+def drive(session, method, urls, value, concurrency):
+    def one(url):
+        t0 = time.perf_counter()
+        session.request(method, url, data=value, timeout=5)
+        return time.perf_counter() - t0
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(one, urls))
+    elapsed = time.perf_counter() - t0
+    cuts = quantiles(latencies, n=100)
+    return {
+        'requests': len(latencies)
+        , 'rps': round(len(latencies) / elapsed, 1)
+        , 'p50_ms': round(cuts[49] * 1000, 3)
+        , 'p99_ms': round(cuts[98] * 1000, 3)
+    }
+
+def bench_backend(backend, args):
+    node = start_node(backend, args.port, args.workers)
+    try:
+        base = f'http://127.0.0.1:{args.port}/bench'
+        session = new_session(args.concurrency)
+        value = os.urandom(args.value_size)
+        keys = [f'key-{i}' for i in range(min(args.requests, 1000))]
+        put_urls = [f'{base}/{keys[i % len(keys)]}?expiry=600' for i in range(args.requests)]
+        hit_urls = [f'{base}/{keys[i % len(keys)]}' for i in range(args.requests)]
+        miss_urls = [f'{base}/missing-{i}' for i in range(args.requests)]
+        results = {}
+        results['put'] = drive(session, 'PUT', put_urls, value, args.concurrency)
+        results['get_hit'] = drive(session, 'GET', hit_urls, None, args.concurrency)
+        results['get_miss'] = drive(session, 'GET', miss_urls, None, args.concurrency)
+        return results
+    finally:
+        stop_node(node)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', nargs='+', default=list(BACKEND_PACKAGES))
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--value-size', type=int, default=512)
+    parser.add_argument('--port', type=int, default=16789)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    report = {}
+    for backend in args.backends:
+        if importlib.util.find_spec(BACKEND_PACKAGES.get(backend, backend)) is None:
+            print(f'skipping {backend}, not installed', file=sys.stderr)
+            continue
+        report[backend] = bench_backend(backend, args)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{'backend':<10} {'operation':<10} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10}")
+    for backend, results in report.items():
+        for operation, result in results.items():
+            print(f"{backend:<10} {operation:<10} {result['rps']:>10} {result['p50_ms']:>10} {result['p99_ms']:>10}")
+
+if __name__ == '__main__':
+    main()
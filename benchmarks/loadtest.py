@@ -0,0 +1,262 @@
+# Load test of a whole simulated cluster, through ZerocacheClient.
+#
+#   PYTHONPATH=src python benchmarks/loadtest.py --regions local:2 faraway:1 elsewhere:1 --operations 5000 --concurrency 16
+#   PYTHONPATH=src python benchmarks/loadtest.py --output after.json --compare before.json --tolerance 0.2
+#
+# Each node is a ZerocacheTestServer process ('python -m zerocache --test-server'), so every request it
+# serves is delayed by the simulated latency of its region; --extra-latency REGION=SECONDS slows a region
+# down further (its nodes' /extra_latency). The client lives in the first region. Keys are picked with
+# Zipfian popularity (--zipf 0 for uniform), values sizes from a weighted distribution, and the run is
+# reproducible for a given --seed, up to the timing of the threads.
+#
+# Reported: throughput, p50/p99/p999 latency per operation, the share of reads answered by each fallback
+# tier (client.stats()), and replication lag: the seconds from a PUT's response until a GET on another
+# node returns the new value, one GET round trip included. With --compare, the run fails (exit code 1)
+# when throughput dropped, or a p99 grew, by more than --tolerance of the baseline.
+import argparse
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+import requests
+from zerocache import ZerocacheClient
+
+def start_node(region, port, args):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, ['src', env.get('PYTHONPATH')]))
+    command = [sys.executable, '-m', 'zerocache', '127.0.0.1', region, '--port', str(port), '--test-server'
+        , '--workers', str(args.workers), '--compression', args.compression]
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def wait_for_node(port, deadline):
+    while time.time() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/ping', timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f'node on port {port} did not start')
+
+def stop_node(node):
+    node.send_signal(signal.SIGINT)
+    try:
+        node.wait(timeout=3)
+    except subprocess.TimeoutExpired:
+        node.kill()
+
+def parse_regions(specs):
+    # MEMO: 'name:count', the first region is the client's
+    regions = []
+    for spec in specs:
+        (name, _, count) = spec.partition(':')
+        regions.append((name, int(count or 1)))
+    return regions
+
+def parse_sizes(spec):
+    # MEMO: 'size:weight,size:weight', sizes in bytes
+    sizes = []
+    weights = []
+    for part in spec.split(','):
+        (size, _, weight) = part.partition(':')
+        sizes.append(int(size))
+        weights.append(float(weight or 1))
+    return (sizes, weights)
+
+def zipf_weights(count, exponent):
+    # MEMO: the key of rank r is picked with a weight of 1/r^exponent, exponent 0 is uniform
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, count + 1)))
+
+def percentiles(samples):
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+    return {
+        'count': len(ordered)
+        , 'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3)
+        , 'p50_ms': at(0.5)
+        , 'p99_ms': at(0.99)
+        , 'p999_ms': at(0.999)
+    }
+
+class Workload:
+    def __init__(self, args):
+        self.args = args
+        self.keys = [f'bench-{rank}' for rank in range(1, args.keys + 1)]
+        self.cum_weights = zipf_weights(args.keys, args.zipf)
+        (self.sizes, self.size_weights) = parse_sizes(args.value_sizes)
+        # MEMO: one random blob per size, reused by every write of that size
+        blob_rng = random.Random(args.seed)
+        self.blobs = {size: blob_rng.randbytes(size) for size in self.sizes}
+
+    def operations(self, worker):
+        # MEMO: each worker draws from its own seeded generator
+        rng = random.Random(self.args.seed * 1000 + worker)
+        count = self.args.operations // self.args.concurrency + (worker < self.args.operations % self.args.concurrency)
+        for _ in range(count):
+            key = rng.choices(self.keys, cum_weights=self.cum_weights)[0]
+            if rng.random() < self.args.read_ratio:
+                yield ('get', key, None)
+            else:
+                yield ('put', key, self.blobs[rng.choices(self.sizes, weights=self.size_weights)[0]])
+
+def run_worker(client, workload, worker):
+    latencies = {'get': [], 'put': []}
+    hits = 0
+    for (operation, key, value) in workload.operations(worker):
+        t0 = time.perf_counter()
+        if operation == 'get':
+            (ok, _) = client.get(key)
+            hits += ok
+        else:
+            client.put(key, value, workload.args.expiry)
+        latencies[operation].append(time.perf_counter() - t0)
+    return (latencies, hits)
+
+def measure_lag(ports, stop, samples, timeout=5.0):
+    # MEMO: written on the first node of the client's region, read back from each of the other nodes
+    (source, peers) = (ports[0], ports[1:])
+    lags = {region: [] for (region, _) in peers}
+    for index in itertools.count():
+        if stop.is_set() or not peers:
+            return lags
+        token = os.urandom(8).hex().encode()
+        key = f'lag-{index}'
+        requests.put(f'http://127.0.0.1:{source[1]}/{source[0]}/{key}?expiry=60', data=token, timeout=timeout)
+        written = time.perf_counter()
+        for (region, port) in peers:
+            while time.perf_counter() - written < timeout:
+                response = requests.get(f'http://127.0.0.1:{port}/{source[0]}/{key}', timeout=timeout)
+                if response.status_code == 200 and response.content == token:
+                    lags[region].append(time.perf_counter() - written)
+                    break
+        stop.wait(samples)
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    if report['throughput_ops'] < baseline['throughput_ops'] * (1 - tolerance):
+        regressions.append(f"throughput {baseline['throughput_ops']} -> {report['throughput_ops']} ops/s")
+    for (operation, result) in report['latency'].items():
+        before = baseline['latency'].get(operation, {}).get('p99_ms')
+        if before and result.get('p99_ms', 0) > before * (1 + tolerance):
+            regressions.append(f"{operation} p99 {before} -> {result['p99_ms']} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--regions', nargs='+', default=['local:2', 'faraway:1', 'elsewhere:1'], help='name:nodes, the client is in the first region')
+    parser.add_argument('--operations', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--read-ratio', type=float, default=0.9)
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--zipf', type=float, default=1.1, help='exponent of the key popularity, 0 for uniform')
+    parser.add_argument('--value-sizes', default='128:0.7,4096:0.25,65536:0.05', help='size:weight,... in bytes')
+    parser.add_argument('--preload', type=float, default=0.8, help='share of the keys written before the run')
+    parser.add_argument('--expiry', type=int, default=600)
+    parser.add_argument('--hedged', action='store_true')
+    parser.add_argument('--compression', default='deflate')
+    parser.add_argument('--extra-latency', nargs='*', default=[], help='REGION=SECONDS added to every request of the region')
+    parser.add_argument('--lag-interval', type=float, default=0.5, help='seconds between replication lag samples, 0 disables them')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--port', type=int, default=16800, help='port of the first node, the others follow')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    parser.add_argument('--output', help='also write the machine-readable results to this file')
+    parser.add_argument('--compare', help='results of an earlier run to check this one against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    regions = parse_regions(args.regions)
+    names = [region for (region, count) in regions for _ in range(count)]
+    ports = [(region, args.port + index) for (index, region) in enumerate(names)]
+    nodes = [start_node(region, port, args) for (region, port) in ports]
+    client = None
+    try:
+        deadline = time.time() + 30
+        for (_, port) in ports:
+            wait_for_node(port, deadline)
+        for spec in args.extra_latency:
+            (region, _, seconds) = spec.partition('=')
+            for (node_region, port) in ports:
+                if node_region == region:
+                    requests.post(f'http://127.0.0.1:{port}/extra_latency?seconds={seconds}')
+        client = ZerocacheClient(regions[0][0], hedged=args.hedged, compression=None if args.compression == 'none' else args.compression)
+        while sum(len(services) for services in list(client.services.values())) < len(ports) and time.time() < deadline:
+            time.sleep(0.25)
+        # MEMO: the client ranks the regions once it heard back from every node
+        time.sleep(1)
+
+        workload = Workload(args)
+        preload_rng = random.Random(args.seed)
+        preloaded = workload.keys[:int(len(workload.keys) * args.preload)]
+        for start in range(0, len(preloaded), 100):
+            items = {key: workload.blobs[preload_rng.choices(workload.sizes, weights=workload.size_weights)[0]] for key in preloaded[start:start + 100]}
+            client.put_many(items, args.expiry)
+        time.sleep(1)
+        baseline_stats = client.stats()['tiers']
+
+        stop = Event()
+        lags = {}
+        if args.lag_interval:
+            lag_thread = Thread(target=lambda: lags.update(measure_lag(ports, stop, args.lag_interval)), daemon=True)
+            lag_thread.start()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(lambda worker: run_worker(client, workload, worker), range(args.concurrency)))
+        elapsed = time.perf_counter() - t0
+        stop.set()
+        if args.lag_interval:
+            lag_thread.join()
+    finally:
+        if client is not None:
+            client.stop_probing()
+        for node in nodes:
+            stop_node(node)
+
+    latencies = {'get': [], 'put': []}
+    for (worker_latencies, _) in results:
+        for (operation, samples) in worker_latencies.items():
+            latencies[operation].extend(samples)
+    tiers = {tier: count - baseline_stats.get(tier, 0) for (tier, count) in client.stats()['tiers'].items()}
+    reads = sum(tiers.values())
+    report = {
+        'config': {key: value for (key, value) in vars(args).items() if key not in ('json', 'output', 'compare', 'tolerance')}
+        , 'elapsed_s': round(elapsed, 3)
+        , 'throughput_ops': round(args.operations / elapsed, 1)
+        , 'latency': {operation: percentiles(samples) for (operation, samples) in latencies.items()}
+        , 'hit_rate': round(sum(hits for (_, hits) in results) / len(latencies['get']), 4) if latencies['get'] else None
+        , 'tiers': {tier: {'reads': count, 'rate': round(count / reads, 4) if reads else None} for (tier, count) in tiers.items()}
+        , 'replication_lag': {region: percentiles(samples) for (region, samples) in lags.items()}
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    regressions = []
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        report['regressions'] = regressions
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['throughput_ops']} ops/s over {report['elapsed_s']} s, hit rate {report['hit_rate']}")
+        print(f"{'operation':<12} {'count':>8} {'p50 ms':>10} {'p99 ms':>10} {'p999 ms':>10}")
+        for (name, result) in list(report['latency'].items()) + [(f'lag {region}', result) for (region, result) in report['replication_lag'].items()]:
+            if result['count']:
+                print(f"{name:<12} {result['count']:>8} {result['p50_ms']:>10} {result['p99_ms']:>10} {result['p999_ms']:>10}")
+        print('reads per tier: ' + ', '.join(f"{tier} {result['rate']}" for (tier, result) in report['tiers'].items()))
+        for regression in regressions:
+            print(f'regression: {regression}')
+    if regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
 from .listener import ZerocacheListener
+from .nearcache import ZerocacheNearCache
 from .client import ZerocacheClient
+from .async_client import AsyncZerocacheClient
 from .server import ZerocacheServer, ZerocacheTestServer
 from .decorators import auto_zerocache
+from .memory import ZerocacheMemoryNetwork
 
 __all__ = [
-    "ZerocacheListener", "ZerocacheClient", "ZerocacheServer", "ZerocacheTestServer", "auto_zerocache"
+    "ZerocacheListener", "ZerocacheNearCache", "ZerocacheClient", "AsyncZerocacheClient", "ZerocacheServer", "ZerocacheTestServer", "auto_zerocache", "ZerocacheMemoryNetwork"
 ]
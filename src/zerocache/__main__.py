@@ -0,0 +1,61 @@
+import argparse
+import logging
+from .server import ZerocacheServer, ZerocacheTestServer, SERVER_BACKENDS
+from .store import SIZE_MODES
+from .replication import ACK_MODES
+from .compression import CODECS
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='zerocache', description='Run a zerocache server node')
+    parser.add_argument('address', help='announced address, must be reachable by the rest of the cluster')
+    parser.add_argument('region')
+    parser.add_argument('--port', type=int, default=6789)
+    parser.add_argument('--local-maxsize', type=int, help='capacity of the cache of this region (1024 entries), required in bytes')
+    parser.add_argument('--remote-maxsize', type=int, help='capacity of the cache of other regions (4096 entries), required in bytes')
+    parser.add_argument('--size-mode', choices=SIZE_MODES, default='entries', help="capacities count entries, or bytes of values")
+    parser.add_argument('--cache-shards', type=int, default=16, help='number of independently locked parts of each cache')
+    parser.add_argument('--partitioned', action='store_true', help='spread keys over the region with consistent hashing, instead of copying them to every node')
+    parser.add_argument('--replicas', type=int, default=2, help='copies of each key in a partitioned region')
+    parser.add_argument('--compression', choices=(*CODECS, 'none'), default='deflate', help='coding of the values stored compressed')
+    parser.add_argument('--compression-threshold', type=int, default=1024, help='values of this many bytes or more are compressed')
+    parser.add_argument('--max-value-size', type=int, default=64 * 1024 * 1024, help='largest value accepted, in bytes as sent, 0 for no limit')
+    parser.add_argument('--snapshot-path', help='file the caches are saved to on shutdown, and restored from on start')
+    parser.add_argument('--snapshot-interval', type=float, help='also save the snapshot every this many seconds')
+    parser.add_argument('--bootstrap', action='store_true', help='on start, copy the caches of a peer of the region')
+    parser.add_argument('--anti-entropy-interval', type=float, default=30.0, help='seconds between the repairs of diverged replicas, 0 disables them')
+    parser.add_argument('--replication-ack', choices=ACK_MODES, default='local')
+    parser.add_argument('--server-backend', choices=SERVER_BACKENDS, default='paste')
+    parser.add_argument('--workers', type=int, default=32, help='size of the pool of threads serving requests')
+    parser.add_argument('--log-level', default='WARNING', help='DEBUG logs every request')
+    parser.add_argument('--test-server', action='store_true', help='run a ZerocacheTestServer, with simulated latency')
+    args = parser.parse_args(argv)
+    if args.size_mode == 'bytes' and (args.local_maxsize is None or args.remote_maxsize is None):
+        parser.error('--size-mode bytes needs --local-maxsize and --remote-maxsize, in bytes')
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    server_class = ZerocacheTestServer if args.test_server else ZerocacheServer
+    server = server_class(
+        args.address
+        , port=args.port
+        , region=args.region
+        , local_maxsize=args.local_maxsize
+        , remote_maxsize=args.remote_maxsize
+        , size_mode=args.size_mode
+        , cache_shards=args.cache_shards
+        , replication_ack=args.replication_ack
+        , partitioned=args.partitioned
+        , replicas=args.replicas
+        , compression=None if args.compression == 'none' else args.compression
+        , compression_threshold=args.compression_threshold
+        , max_value_size=args.max_value_size or None
+        , snapshot_path=args.snapshot_path
+        , snapshot_interval=args.snapshot_interval
+        , bootstrap=args.bootstrap
+        , anti_entropy_interval=args.anti_entropy_interval
+        , server_backend=args.server_backend
+        , threadpool_workers=args.workers
+    )
+    server.start()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import json
+import logging
+import math
+import random
+import time
+from threading import Event, Lock, Thread
+from .batch import pack_records, unpack_records
+from .merkle import ZerocacheMerkleTree
+
+logger = logging.getLogger(__name__)
+
+# MEMO: trees are built from a snapshot of the caches, a peer walking down one reuses it for a little while
+TREE_REUSE = 2.0
+
+# MEMO: replication is sent once, a dropped message leaves replicas apart until the key expires. Every interval
+#       (jittered), a node compares the hash trees of its caches with those of one peer of its region, and the
+#       representative of each region (the node with the lowest name) compares its own region's entries with a
+#       node of every other region. Versions that differ are settled by their stamp, the latest write (or delete)
+#       wins: newer entries are pulled or pushed, newer deletes applied on either side.
+#       In partitioned regions, two nodes only compare the keys they both own, see scope_versions().
+class ZerocacheAntiEntropy:
+    def __init__(self, node, interval=30.0, jitter=0.2, timeout=2.0):
+        self.node = node
+        self.interval = interval
+        self.jitter = jitter
+        self.timeout = timeout
+        self.stop_event = Event()
+        self.trees = {}
+        self.lock = Lock()
+        self.rounds = 0
+        self.syncs = 0
+        self.failures = 0
+        self.pulled = 0
+        self.pushed = 0
+        self.deleted = 0
+
+    def start(self):
+        if self.interval:
+            Thread(target=self._loop, name='zerocache-anti-entropy', daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)):
+            self.run_round()
+
+    def run_round(self):
+        for (peer, scope) in self.node.anti_entropy_targets():
+            try:
+                self.sync(peer, scope)
+            except:
+                logger.warning('anti-entropy of %s with %s failed', scope, peer.name)
+                with self.lock:
+                    self.failures += 1
+        with self.lock:
+            self.rounds += 1
+
+    def tree(self, scope, peer=None) -> ZerocacheMerkleTree:
+        now = time.monotonic()
+        with self.lock:
+            cached = self.trees.get((scope, peer))
+            if cached is not None and now - cached[0] < TREE_REUSE:
+                return cached[1]
+        tree = ZerocacheMerkleTree(self.node.scope_versions(scope, peer))
+        with self.lock:
+            self.trees[(scope, peer)] = (now, tree)
+        return tree
+
+    def post(self, peer, uri, body):
+        url = self.node.service_base_url(peer, uri)
+        response = self.node.session_for(peer).post(url, data=json.dumps(body), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def sync(self, peer, scope):
+        tree = ZerocacheMerkleTree(self.node.scope_versions(scope, peer.name))
+        indexes = [0]
+        for level in range(tree.depth + 1):
+            theirs = self.post(peer, f'/_sync/{scope}/tree', {'level': level, 'indexes': indexes, 'peer': self.node.svcname})['hashes']
+            differing = [index for (index, digest) in zip(indexes, theirs) if digest != tree.levels[level][index].hex()]
+            if not differing:
+                with self.lock:
+                    self.syncs += 1
+                return 0
+            indexes = differing if level == tree.depth else tree.children(differing)
+        query = {'leaves': indexes, 'peer': self.node.svcname}
+        theirs = {version[0]: version for version in self.post(peer, f'/_sync/{scope}/versions', query)['versions']}
+        mine = {version[0]: version for version in tree.versions(indexes)}
+        pull = {}
+        push = {}
+        push_deletes = {}
+        settled = 0
+        for key in set(mine) | set(theirs):
+            (my_version, their_version) = (mine.get(key), theirs.get(key))
+            if their_version is not None and (my_version is None or their_version[1] > my_version[1]):
+                if their_version[2]:
+                    self.node.evict(their_version[3], key, their_version[1])
+                    settled += 1
+                    with self.lock:
+                        self.deleted += 1
+                else:
+                    pull.setdefault(their_version[3], []).append(key)
+            elif my_version is not None and (their_version is None or my_version[1] > their_version[1]):
+                (push_deletes if my_version[2] else push).setdefault(my_version[3], []).append(my_version)
+        for (region, keys) in pull.items():
+            settled += self.pull(peer, region, keys)
+        for (region, versions) in push.items():
+            settled += self.push(peer, region, versions)
+        for (region, versions) in push_deletes.items():
+            body = pack_records([({'key': version[0], 'stamp': version[1]}, None) for version in versions])
+            self.send(peer, 'DELETE', region, body)
+            settled += len(versions)
+        with self.lock:
+            self.syncs += 1
+        logger.info('anti-entropy of %s with %s: %s keys pulled, pushed or deleted', scope, peer.name, settled)
+        return settled
+
+    def send(self, peer, method, region, body):
+        url = self.node.service_base_url(peer, f'/_batch/{region}?recurse=0')
+        response = self.node.session_for(peer).request(method, url, data=body, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def pull(self, peer, region, keys):
+        response = self.send(peer, 'POST', region, pack_records([({'key': key}, None) for key in keys]))
+        pulled = 0
+        for (meta, value) in unpack_records(response.content):
+            # MEMO: keys this node doesn't own (a peer with another view of the ring) are left to their owners
+            if meta.get('ttl', 0) > 0 and self.node.owns(meta['key']):
+                self.node.store(region, meta['key'], value, meta['ttl'], meta.get('delta'), meta.get('coding'), meta.get('stamp'), meta.get('tags'))
+                pulled += 1
+        with self.lock:
+            self.pulled += pulled
+        return pulled
+
+    def push(self, peer, region, versions):
+        now = time.monotonic()
+        records = []
+        for (key, stamp, _, _) in versions:
+            entry = self.node.lookup_entry(region, key)
+            if entry is None or entry.stamp != stamp:
+                continue
+            meta = {'key': key, 'expiry': max(1, math.ceil(entry.expires - now)), 'stamp': stamp}
+            if entry.delta is not None:
+                meta['delta'] = entry.delta
+            if entry.coding is not None:
+                meta['coding'] = entry.coding
+            if entry.tags:
+                meta['tags'] = list(entry.tags)
+            records.append((meta, entry.value))
+        if records:
+            self.send(peer, 'PUT', region, pack_records(records))
+            with self.lock:
+                self.pushed += len(records)
+        return len(records)
+
+    def info(self):
+        with self.lock:
+            return {
+                "interval": self.interval
+                , "rounds": self.rounds
+                , "syncs": self.syncs
+                , "failures": self.failures
+                , "pulled": self.pulled
+                , "pushed": self.pushed
+                , "deleted": self.deleted
+            }
@@ -0,0 +1,434 @@
+import asyncio
+import random
+from time import perf_counter
+from zeroconf import ServiceInfo, ServiceStateChange
+from zeroconf.asyncio import AsyncServiceBrowser, AsyncServiceInfo, AsyncZeroconf
+from .batch import pack_records
+from .client import ZerocacheClient, entry_meta, batch_hits, node_failed, succeeded
+from .compression import ACCEPT_ENCODING, compress, decoded_response
+from .listener import SERVICE_TYPE
+
+# MEMO: optional dependency, 'pip install zerocache[async]'
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+def node_timeout(seconds):
+    # MEMO: only the node's own answer is timed, not the wait for a free pooled connection, which would
+    #       otherwise count as a failure of the node under a burst of lookups
+    return aiohttp.ClientTimeout(total=None, sock_connect=seconds, sock_read=seconds)
+
+async def on_request_headers_sent(session, context, params):
+    # MEMO: same reason, latency samples start once the request is on its way to the node
+    if context.trace_request_ctx is not None:
+        context.trace_request_ctx['sent'] = perf_counter()
+
+# MEMO: the asyncio counterpart of ZerocacheClient. Node selection, fallback order, rings, breakers and the near
+#       cache are inherited, only the I/O differs: zeroconf's async browser and one pooled aiohttp session.
+#       Discovery and probing start with `await client.start()` (or `async with`), from inside the event loop.
+class AsyncZerocacheClient(ZerocacheClient):
+    _instances = {}
+
+    @staticmethod
+    async def get_instance(region):
+        if region not in AsyncZerocacheClient._instances:
+            AsyncZerocacheClient._instances[region] = AsyncZerocacheClient(region)
+        client = AsyncZerocacheClient._instances[region]
+        await client.start()
+        return client
+
+    @staticmethod
+    async def clear_instance(region):
+        if region in AsyncZerocacheClient._instances:
+            client = AsyncZerocacheClient._instances.pop(region)
+            await client.aclose()
+
+    def __init__(self, region=None, pool_maxsize=16, **kwargs):
+        self.aiozc = None
+        self.async_browser = None
+        self.session = None
+        self.probe_task = None
+        self.tasks = set()
+        # MEMO: pool_maxsize is the number of connections per node, to stay well under its worker threads (32 by
+        #       default), which its peers use too. Thousands of lookups can be awaited at once, they queue for a
+        #       free connection.
+        super().__init__(region, pool_maxsize=pool_maxsize, **kwargs)
+
+    def _start_discovery(self):
+        pass
+
+    async def start(self):
+        if self.session is not None:
+            return
+        if aiohttp is None:
+            raise RuntimeError("AsyncZerocacheClient needs aiohttp, 'pip install zerocache[async]'")
+        trace = aiohttp.TraceConfig()
+        trace.on_request_headers_sent.append(on_request_headers_sent)
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0, limit_per_host=self.pool.maxsize), trace_configs=[trace])
+        self.aiozc = AsyncZeroconf()
+        self.async_browser = AsyncServiceBrowser(self.aiozc.zeroconf, SERVICE_TYPE, handlers=[self.on_service_state_change])
+        if self.probe_interval:
+            self.probe_task = asyncio.create_task(self._async_probe())
+
+    async def aclose(self):
+        self.stop_probing()
+        for task in list(self.tasks):
+            task.cancel()
+        if self.async_browser is not None:
+            await self.async_browser.async_cancel()
+        if self.aiozc is not None:
+            await self.aiozc.async_close()
+        if self.session is not None:
+            await self.session.close()
+        self.session = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.aclose()
+
+    def stop_probing(self):
+        super().stop_probing()
+        if self.probe_task is not None:
+            self.probe_task.cancel()
+
+    def spawn(self, coroutine):
+        # MEMO: keeps a reference, asyncio only holds weak ones to its tasks
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def on_service_state_change(self, zeroconf, service_type, name, state_change):
+        if state_change is ServiceStateChange.Added:
+            self.spawn(self.async_add_service(zeroconf, service_type, name))
+        elif state_change is ServiceStateChange.Removed:
+            self.remove_service(zeroconf, service_type, name)
+
+    async def async_add_service(self, zeroconf, service_type, name):
+        info = AsyncServiceInfo(service_type, name)
+        if not await info.async_request(zeroconf, 3000):
+            return
+        self.log(f"(AsyncZerocacheClient) Service \"{name}\" added, service info: {info}")
+        self.service_added(info)
+        await self.async_ping(info)
+
+    async def async_ping(self, info: ServiceInfo, rerank=True):
+        try:
+            t0 = perf_counter()
+            async with self.session.get(self.service_base_url(info, '/ping'), timeout=node_timeout(0.5)) as response:
+                await response.read()
+            self.observe_latency(info, perf_counter() - t0)
+        except asyncio.CancelledError:
+            raise
+        except:
+            self.observe_failure(info)
+        if rerank:
+            self.rerank()
+
+    async def _async_probe(self):
+        while True:
+            await asyncio.sleep(self.probe_interval * random.uniform(1 - self.probe_jitter, 1 + self.probe_jitter))
+            # MEMO: unlike the thread of the blocking listener, every node is probed at once
+            await asyncio.gather(*[self.async_ping(info, rerank=False) for services in list(self.services.values()) for info in services])
+            self.rerank()
+
+    async def async_send(self, service: ServiceInfo, method, url, data=None, timeout=0.5, headers=None):
+        # MEMO: as in ZerocacheClient.send, a node whose breaker refuses the request is skipped
+        if not self.breaker(service).acquire_trial():
+            raise aiohttp.ClientConnectionError(f'circuit breaker open: {service.name}')
+        with self.inflight_lock:
+            self.inflight[service.name] = self.inflight.get(service.name, 0) + 1
+        trace = {'sent': perf_counter()}
+        try:
+            async with self.session.request(method, url, data=data, headers=headers, timeout=node_timeout(timeout), trace_request_ctx=trace) as response:
+                content = await response.read()
+        except asyncio.CancelledError:
+            # MEMO: the loser of a hedged race, not a failure of its node
+            raise
+        except:
+            self.observe_failure(service)
+            self.observe_request(service, method)
+            raise
+        finally:
+            with self.inflight_lock:
+                self.inflight[service.name] -= 1
+        seconds = perf_counter() - trace['sent']
+        if node_failed(response.status):
+            self.observe_failure(service)
+            self.observe_request(service, method)
+        elif response.status >= 500:
+            self.breaker(service).success()
+            self.observe_request(service, method, seconds)
+        else:
+            self.observe_latency(service, seconds)
+            self.observe_request(service, method, seconds)
+        return (response.status, content, seconds, response.headers)
+
+    async def fetch(self, service: ServiceInfo, key, timeout):
+        get_url = self.service_base_url(service, f'/{self.region}/{key}')
+        self.action_counter += 1
+        try:
+            (status, content, seconds, headers) = await self.async_send(service, 'GET', get_url, timeout=timeout, headers={'Accept-Encoding': ACCEPT_ENCODING})
+        except asyncio.TimeoutError:
+            # MEMO: as in ZerocacheClient, a read cut off by its timeout is a sample at that timeout
+            self.get_latencies.append(timeout)
+            raise
+        self.get_latencies.append(seconds)
+        if status != 200:
+            return (False, content, get_url, None)
+        return (True, decoded_response(headers, content), get_url, entry_meta(headers))
+
+    async def get(self, key):
+        (ok, value, _) = await self.get_entry(key)
+        return (ok, value)
+
+    async def get_entry(self, key):
+        if self.near_cache is not None:
+            value = self.near_cache.get(key)
+            if value is not None:
+                self.cache_hit = True
+                self.latest_action = 'GET: near cache'
+                self.observe_tier(tier='near')
+                return (True, value, None)
+        if self.hedged:
+            (ok, value, meta) = await self.hedged_get_entry(key)
+        else:
+            (ok, value, meta) = await self.fallback_get_entry(key)
+        if ok and self.near_cache is not None:
+            self.near_cache.put(key, value, meta and meta['ttl'])
+        return (ok, value, meta)
+
+    async def fallback_get(self, key):
+        (ok, value, _) = await self.fallback_get_entry(key)
+        return (ok, value)
+
+    async def fallback_get_entry(self, key):
+        self.cache_hit = False
+        for (service, timeout) in self.fallback_services(key):
+            try:
+                self.log('get ->', service.name)
+                (ok, content, get_url, meta) = await self.fetch(service, key, timeout)
+                self.latest_action = f"GET: {get_url}"
+                if ok:
+                    self.cache_hit = True
+                    self.observe_tier(service)
+                    return (True, content, meta)
+            except asyncio.CancelledError:
+                raise
+            except:
+                pass
+        self.observe_tier(tier='miss')
+        return (False, None, None)
+
+    async def hedged_get(self, key):
+        (ok, value, _) = await self.hedged_get_entry(key)
+        return (ok, value)
+
+    async def hedged_get_entry(self, key):
+        self.cache_hit = False
+        # MEMO: same race as ZerocacheClient.hedged_get, but the losers are really cancelled
+        contenders = [(service, timeout, timeout) for (service, timeout) in self.fallback_services(key)]
+        if contenders:
+            (service, timeout, _) = contenders[0]
+            contenders[0] = (service, timeout, self.current_hedge_delay())
+        pending = set()
+        racers = {}
+        try:
+            while pending or contenders:
+                wait_for = None
+                if contenders:
+                    (service, timeout, delay) = contenders.pop(0)
+                    task = asyncio.ensure_future(self.fetch(service, key, timeout))
+                    racers[task] = service
+                    pending.add(task)
+                    wait_for = delay
+                (done, pending) = await asyncio.wait(pending, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        continue
+                    (ok, content, get_url, meta) = task.result()
+                    if ok:
+                        self.latest_action = f"GET: {get_url}"
+                        self.cache_hit = True
+                        self.observe_tier(racers[task])
+                        return (True, content, meta)
+            self.observe_tier(tier='miss')
+            return (False, None, None)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def put(self, key, value, expiry, delta=None, tags=None):
+        if self.near_cache is not None:
+            self.near_cache.invalidate(key)
+        ok = await self.fallback_put(key, value, expiry, delta, tags)
+        if ok and self.near_cache is not None:
+            self.near_cache.put(key, value, expiry)
+        return ok
+
+    async def fallback_put(self, key, value, expiry, delta=None, tags=None):
+        query = self.put_query(expiry, delta, tags)
+        (data, coding) = compress(value, self.codec, self.compression_threshold)
+        headers = None if coding is None else {'Content-Encoding': coding}
+        for (service, timeout) in self.fallback_services(key):
+            put_url = self.service_base_url(service, f'/{self.region}/{key}?{query}')
+            self.latest_action = f"PUT: {put_url}"
+            self.action_counter += 1
+            try:
+                (status, _, _, _) = await self.async_send(service, 'PUT', put_url, data, timeout, headers)
+                return succeeded(status)
+            except asyncio.CancelledError:
+                raise
+            except:
+                pass
+        return False
+
+    async def delete(self, key=None):
+        if self.near_cache is not None:
+            self.near_cache.invalidate(key)
+        return await self.fallback_delete(key)
+
+    async def fallback_delete(self, key=None):
+        for (service, timeout) in self.fallback_services(key):
+            delete_url = self.service_base_url(service, f'/{self.region}/{key}')
+            self.latest_action = f"DELETE: {delete_url}"
+            self.action_counter += 1
+            try:
+                await self.async_send(service, 'DELETE', delete_url, timeout=timeout)
+                return True
+            except asyncio.CancelledError:
+                raise
+            except:
+                pass
+        return False
+
+    async def invalidate(self, tags=None, prefixes=None):
+        body = self.invalidate_body(tags, prefixes)
+        for (service, timeout) in self.fallback_services():
+            invalidate_url = self.service_base_url(service, f'/_invalidate/{self.region}')
+            self.latest_action = f"INVALIDATE: {invalidate_url}"
+            self.action_counter += 1
+            try:
+                (status, _, _, _) = await self.async_send(service, 'POST', invalidate_url, body, timeout)
+                return status == 200
+            except asyncio.CancelledError:
+                raise
+            except:
+                pass
+        return False
+
+    async def acquire_lease(self, key, ttl=10.0):
+        (service, url) = self.lease_url(key, ttl)
+        if service is None:
+            return True
+        try:
+            (status, _, _, _) = await self.async_send(service, 'POST', url, timeout=0.5)
+            return status != 409
+        except asyncio.CancelledError:
+            raise
+        except:
+            return True
+
+    async def release_lease(self, key):
+        (service, url) = self.lease_url(key)
+        if service is None:
+            return False
+        try:
+            (status, _, _, _) = await self.async_send(service, 'DELETE', url, timeout=0.5)
+            return status == 200
+        except asyncio.CancelledError:
+            raise
+        except:
+            return False
+
+    async def get_many_from(self, service: ServiceInfo, keys, timeout):
+        batch_url = self.service_base_url(service, f'/_batch/{self.region}')
+        self.latest_action = f"GET MANY: {batch_url}"
+        self.action_counter += 1
+        body = pack_records([({'key': key}, None) for key in keys])
+        try:
+            (status, content, _, _) = await self.async_send(service, 'POST', batch_url, body, timeout, {'Accept-Encoding': ACCEPT_ENCODING})
+        except asyncio.CancelledError:
+            raise
+        except:
+            return {}
+        if status != 200:
+            return {}
+        return batch_hits(content)
+
+    async def get_many(self, keys):
+        found = {}
+        remaining = list(dict.fromkeys(keys))
+        if self.near_cache is not None:
+            for key in remaining:
+                value = self.near_cache.get(key)
+                if value is not None:
+                    found[key] = value
+            remaining = [key for key in remaining if key not in found]
+            self.observe_tier(tier='near', count=len(found))
+        plan = self.fallback_plan(remaining)
+        depth = 0
+        while remaining:
+            groups = self.plan_groups(plan, remaining, depth)
+            if not groups:
+                break
+            # MEMO: the batches of one tier go out concurrently
+            batches = await asyncio.gather(*[self.get_many_from(service, group_keys, timeout) for (service, timeout, group_keys) in groups])
+            for ((service, _, _), hits) in zip(groups, batches):
+                found.update(hits)
+                self.observe_tier(service, count=len(hits))
+                if self.near_cache is not None:
+                    for key, value in hits.items():
+                        self.near_cache.put(key, value)
+            remaining = [key for key in remaining if key not in found]
+            depth += 1
+        self.observe_tier(tier='miss', count=len(remaining))
+        self.cache_hit = len(remaining) == 0
+        return found
+
+    async def send_batch(self, method, plan, group_keys, body):
+        for (service, timeout) in plan[group_keys[0]]:
+            batch_url = self.service_base_url(service, f'/_batch/{self.region}')
+            self.latest_action = f"{method} MANY: {batch_url}"
+            self.action_counter += 1
+            try:
+                (status, _, _, _) = await self.async_send(service, method, batch_url, body, timeout)
+                return succeeded(status)
+            except asyncio.CancelledError:
+                raise
+            except:
+                pass
+        return False
+
+    # MEMO: items maps key -> value, or key -> (value, expiry) for keys with their own expiry; tags apply to all
+    async def put_many(self, items, expiry=60, tags=None):
+        records = {}
+        for key, item in items.items():
+            (value, item_expiry) = item if isinstance(item, tuple) else (item, expiry)
+            records[key] = self.put_record(key, value, item_expiry, tags)
+            if self.near_cache is not None:
+                self.near_cache.invalidate(key)
+        plan = self.fallback_plan(list(records))
+        groups = self.plan_groups(plan, list(records), 0)
+        results = await asyncio.gather(*[
+            self.send_batch('PUT', plan, group_keys, pack_records([records[key] for key in group_keys]))
+            for (_, _, group_keys) in groups
+        ])
+        return len(groups) > 0 and all(results)
+
+    async def delete_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        if self.near_cache is not None:
+            for key in keys:
+                self.near_cache.invalidate(key)
+        plan = self.fallback_plan(keys)
+        groups = self.plan_groups(plan, keys, 0)
+        results = await asyncio.gather(*[
+            self.send_batch('DELETE', plan, group_keys, pack_records([({'key': key}, None) for key in group_keys]))
+            for (_, _, group_keys) in groups
+        ])
+        return len(groups) > 0 and all(results)
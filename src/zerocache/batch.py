@@ -0,0 +1,61 @@
+import json
+import struct
+
+# MEMO: a batch body is a 4-byte manifest length, a JSON manifest (one dict per record, "size" being
+#       the length of its value, -1 for none), followed by all of the raw values back to back.
+#       Values stay binary, no base64 inflation, and the manifest is parsed in a single pass.
+HEADER = struct.Struct('>I')
+
+def record_chunks(records):
+    # MEMO: the parts of a batch body, for writing or streaming it without joining the values into one copy
+    manifest = []
+    values = []
+    for (meta, value) in records:
+        entry = dict(meta)
+        if value is None:
+            entry['size'] = -1
+        else:
+            entry['size'] = len(value)
+            values.append(value)
+        manifest.append(entry)
+    head = json.dumps(manifest, separators=(',', ':')).encode('utf-8')
+    return [HEADER.pack(len(head)), head, *values]
+
+def pack_records(records):
+    return b''.join(record_chunks(records))
+
+def unpack_records(body):
+    view = memoryview(body)
+    if len(view) < HEADER.size:
+        raise ValueError('truncated batch body')
+    (head_size,) = HEADER.unpack_from(view, 0)
+    offset = HEADER.size + head_size
+    manifest = json.loads(bytes(view[HEADER.size:offset]))
+    records = []
+    for meta in manifest:
+        size = meta.pop('size', -1)
+        if size < 0:
+            records.append((meta, None))
+            continue
+        if offset + size > len(view):
+            raise ValueError('truncated batch body')
+        records.append((meta, bytes(view[offset:offset + size])))
+        offset += size
+    return records
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    while len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            raise ValueError('truncated batch body')
+        data += more
+    return data
+
+def read_records(stream):
+    # MEMO: yields the records of a batch body read from a file-like stream, one value at a time
+    (head_size,) = HEADER.unpack(read_exactly(stream, HEADER.size))
+    manifest = json.loads(read_exactly(stream, head_size))
+    for meta in manifest:
+        size = meta.pop('size', -1)
+        yield (meta, None if size < 0 else read_exactly(stream, size))
@@ -1,7 +1,41 @@
 from zeroconf import ServiceInfo
 from zerocache import ZerocacheListener
-import requests
+from .batch import pack_records, unpack_records
+from .compression import ACCEPT_ENCODING, STREAM_ACCEPT_ENCODING, codec_for, compress, decompress, decoded_response
+from .metrics import ZerocacheMetrics, render
+from .nearcache import ZerocacheNearCache
+from .selection import ZerocacheCircuitBreaker, selection_strategy
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from collections import deque
+from statistics import quantiles
+from threading import Lock, Semaphore, Thread
+from time import perf_counter
+from urllib.parse import urlencode
+import json
 import random
+import requests
+
+def entry_meta(headers):
+    # MEMO: nodes older than these headers send none of them
+    if 'X-Zerocache-TTL' not in headers:
+        return None
+    meta = {'ttl': float(headers['X-Zerocache-TTL']), 'age': float(headers.get('Age', 0))}
+    if 'X-Zerocache-Delta' in headers:
+        meta['delta'] = float(headers['X-Zerocache-Delta'])
+    return meta
+
+def succeeded(status_code):
+    # MEMO: a 413 (too large), 415 (unknown coding) or 504 (not replicated in time) is not a successful write
+    return 200 <= status_code < 300
+
+def node_failed(status_code):
+    # MEMO: a 504 is the node saying its peers didn't acknowledge a write in time (replication_ack 'quorum' or
+    #       'all'), the node itself answered; it doesn't count against the node's breaker
+    return status_code >= 500 and status_code != 504
+
+def batch_hits(body):
+    # MEMO: compressed values of a batch come with their coding in the manifest
+    return {meta['key']: decompress(value, meta.get('coding')) for (meta, value) in unpack_records(body)}
 
 class ZerocacheClient(ZerocacheListener):
     _instances = {}
@@ -15,70 +49,208 @@ class ZerocacheClient(ZerocacheListener):
     @staticmethod
     def clear_instance(region):
         if region in ZerocacheClient._instances:
+            ZerocacheClient._instances[region].stop_probing()
             del ZerocacheClient._instances[region]
 
-    def __init__(self, region=None):
-        super().__init__(region)
-        self.local_index = 0
+    def __init__(self, region=None, pool_maxsize=8, pool_idle_timeout=30.0, hedged=False, hedge_delay=None, hedge_workers=16
+            , near_cache: ZerocacheNearCache = None, partitioned=False, replicas=2, ring_vnodes=64
+            , local_order='round_robin', probe_interval=5.0, breaker_threshold=3, breaker_backoff=1.0, breaker_max_backoff=30.0
+            , compression='deflate', compression_threshold=1024, network=None):
+        # MEMO: local_order is the name of a strategy of zerocache.selection, or a strategy object
+        self.selection = selection_strategy(local_order)
+        # MEMO: set before the listener starts, the first pings already report to the breakers
+        self.breaker_options = {'threshold': breaker_threshold, 'backoff': breaker_backoff, 'max_backoff': breaker_max_backoff}
+        self.breakers = {}
+        self.inflight = {}
+        self.inflight_lock = Lock()
+        # MEMO: latency per node of the real traffic, and which fallback tier answered each read, see stats()
+        self.metrics = ZerocacheMetrics()
+        super().__init__(region, pool_maxsize=pool_maxsize, pool_idle_timeout=pool_idle_timeout, ring_vnodes=ring_vnodes
+            , probe_interval=probe_interval, network=network)
         self.latest_action = 'n/a'
         self.cache_hit = False
         self.action_counter = 0
+        self.hedged = hedged
+        self.hedge_delay = hedge_delay
+        self.hedge_workers = hedge_workers
+        self.hedge_slots = Semaphore(hedge_workers)
+        self.get_latencies = deque(maxlen=256)
+        self.near_cache = near_cache
+        self.partitioned = partitioned
+        self.replicas = replicas
+        # MEMO: values of compression_threshold bytes or more are sent (and stored) compressed, None disables it
+        self.codec = codec_for(compression)
+        self.compression_threshold = compression_threshold
+        # MEMO: identifies the leases of this client, shared by all of its threads
+        self.lease_owner = random.randbytes(8).hex()
         self.log(f'Client Initialized: region = {region}')
 
+    def breaker(self, info: ServiceInfo) -> ZerocacheCircuitBreaker:
+        breaker = self.breakers.get(info.name)
+        if breaker is None:
+            breaker = self.breakers.setdefault(info.name, ZerocacheCircuitBreaker(**self.breaker_options))
+        return breaker
+
+    def observe_latency(self, info: ServiceInfo, seconds):
+        super().observe_latency(info, seconds)
+        self.breaker(info).success()
+
+    def observe_request(self, info: ServiceInfo, method, seconds=None):
+        # MEMO: seconds is None for a failure
+        labels = (('node', info.name), ('region', self.service_region(info)), ('method', method))
+        if seconds is None:
+            self.metrics.inc('zerocache_client_request_failures_total', labels)
+        else:
+            self.metrics.observe('zerocache_client_request_duration_seconds', labels, seconds)
+
+    def observe_tier(self, info: ServiceInfo = None, tier=None, count=1):
+        # MEMO: a read answered by the node info, or by the given tier ('near', 'miss')
+        if tier is None:
+            tier = 'local' if self.service_region(info) == self.region else 'remote'
+        self.metrics.inc('zerocache_client_gets_total', (('tier', tier),), count)
+
+    def observe_failure(self, info: ServiceInfo):
+        super().observe_failure(info)
+        self.breaker(info).failure()
+
+    def inflight_requests(self, info: ServiceInfo):
+        return self.inflight.get(info.name, 0)
+
+    def node_latency(self, info: ServiceInfo):
+        # MEMO: nodes not measured yet are assumed to be as fast as the rest of their region
+        node = self.registry.snapshot.by_name.get(info.name)
+        if node is not None and node.stats.ewma is not None:
+            return node.stats.ewma
+        region = self.service_region(info)
+        return self.latencies.ewma(region, info.name) or self.latencies.region_score(region) or 1.0
+
+    def available_services(self, services):
+        # MEMO: nodes with an open breaker are skipped, unless every node's breaker is open; send() then still
+        #       refuses the ones whose backoff hasn't elapsed
+        available = [info for info in services if self.breaker(info).is_available()]
+        return available or list(services)
+
     def next_local_service(self):
-        self.log('next_local_service...')
-        self.log(self.region, self.services.keys())
-        self.cluster_info()
-        self.log('.......')
-        if self.region in self.services:
-            service = self.services[self.region][self.local_index]
-            self.local_index = self.local_index + 1
-            if self.local_index >= len(self.services[self.region]):
-                self.local_index = 0
-            return service
-        return None
+        return next(self.local_services(), None)
 
-    def random_remote_service(self, rank):
-        other_regions = list(self.ranked_neighbours.keys())
+    def local_services(self):
+        # MEMO: lazily yields the (up to) two local nodes to try, in the order of the selection strategy
+        self.log('local_services...', self.region, self.services.keys())
+        services = self.services.get(self.region)
+        if services:
+            for service in self.selection.order(self.available_services(list(services)), self)[:2]:
+                yield service
+
+    def random_remote_service(self, rank, other_regions=None):
+        if other_regions is None:
+            other_regions = self.ranked_regions
         self.log('random_remote_service', rank)
         if rank >= 0 and rank < len(other_regions):
             self.log('select a ranked region...')
             self.log(other_regions)
-            region = other_regions[rank]
-            service = self.services[region][random.randint(0, len(self.services[region])-1)]
-            self.log('returning a remote service...')
-            return service
+            services = self.services.get(other_regions[rank])
+            if services:
+                services = self.available_services(services)
+                service = services[random.randint(0, len(services)-1)]
+                self.log('returning a remote service...')
+                return service
         self.log('no remote service to provide...')
         return None
     
+    def __fetch(self, service: ServiceInfo, key, timeout):
+        get_url = self.service_base_url(service, f'/{self.region}/{key}')
+        self.log('getting...', get_url)
+        self.action_counter += 1
+        t0 = perf_counter()
+        try:
+            response = self.send(service, 'GET', get_url, timeout=timeout, headers={'Accept-Encoding': ACCEPT_ENCODING})
+        except requests.Timeout:
+            # MEMO: a read cut off by its timeout took at least that long, without a sample the p95 (and the hedge
+            #       delay) would stay below the latency of the nodes once it rises
+            self.get_latencies.append(timeout)
+            raise
+        self.get_latencies.append(perf_counter() - t0)
+        if response.status_code != 200:
+            return (False, response.content, get_url, None)
+        return (True, decoded_response(response.headers, response.content), get_url, entry_meta(response.headers))
+
+    def __open(self, service: ServiceInfo, key, timeout):
+        get_url = self.service_base_url(service, f'/{self.region}/{key}')
+        self.latest_action = f"GET: {get_url}"
+        self.action_counter += 1
+        response = self.send(service, 'GET', get_url, timeout=timeout, stream=True, headers={'Accept-Encoding': STREAM_ACCEPT_ENCODING})
+        if response.status_code != 200:
+            response.close()
+            return None
+        response.raw.decode_content = True
+        return response.raw
+
+    def send(self, service: ServiceInfo, method, url, **kwargs):
+        # MEMO: every request doubles as a latency sample of its node, failures included. A half-open node's trial
+        #       is taken here, filtering and ordering the nodes leaves it to the request actually sent. Without it
+        #       (another request holds the trial, or the breaker opened since the node was picked) nothing is sent,
+        #       the caller moves on to its next node as it would on a connection error
+        if not self.breaker(service).acquire_trial():
+            raise requests.ConnectionError(f'circuit breaker open: {service.name}')
+        with self.inflight_lock:
+            self.inflight[service.name] = self.inflight.get(service.name, 0) + 1
+        t0 = perf_counter()
+        try:
+            response = self.session_for(service).request(method, url, **kwargs)
+        except:
+            self.observe_failure(service)
+            self.observe_request(service, method)
+            raise
+        finally:
+            with self.inflight_lock:
+                self.inflight[service.name] -= 1
+        seconds = perf_counter() - t0
+        if node_failed(response.status_code):
+            self.observe_failure(service)
+            self.observe_request(service, method)
+        elif response.status_code >= 500:
+            # MEMO: the time went waiting on the peers, not a latency sample of the node
+            self.breaker(service).success()
+            self.observe_request(service, method, seconds)
+        else:
+            self.observe_latency(service, seconds)
+            self.observe_request(service, method, seconds)
+        return response
+
     def __get(self, service: ServiceInfo, key, timeout):
         self.cache_hit = False
         self.log('__get() invoked')
         if service is not None:
             self.log('service was given')
-            get_url = self.service_base_url(service, f'/{self.region}/{key}')
-            self.latest_action = f"GET: {get_url}"
-            self.log('getting...', get_url)
-            self.action_counter += 1
-            response = requests.get(get_url, timeout=timeout)
-            if response.status_code == 200:
+            self.latest_action = f"GET: {self.service_base_url(service, f'/{self.region}/{key}')}"
+            (ok, content, _, meta) = self.__fetch(service, key, timeout)
+            if ok:
                 self.log('GET... hit')
                 self.cache_hit = True
-                return (True, response.content)
+                return (True, content, meta)
             else:
                 self.log('GET... miss')
         else:
             self.log('service was not given')
-        return (False, None)
+        return (False, None, None)
+
+    def put_query(self, expiry_seconds, delta=None, tags=None):
+        query = {'expiry': expiry_seconds} if delta is None else {'expiry': expiry_seconds, 'delta': round(delta, 3)}
+        if tags:
+            # MEMO: tags are sent comma separated, they can't contain commas themselves
+            query['tags'] = ','.join(tags)
+        return urlencode(query)
 
-    def __put(self, service: ServiceInfo, key, value, expiry_seconds, timeout):
+    def __put(self, service: ServiceInfo, key, value, expiry_seconds, timeout, delta=None, tags=None):
         if service is not None:
-            put_url = self.service_base_url(service, f'/{self.region}/{key}?expiry={expiry_seconds}')
+            query = self.put_query(expiry_seconds, delta, tags)
+            put_url = self.service_base_url(service, f'/{self.region}/{key}?{query}')
             self.latest_action = f"PUT: {put_url}"
             self.log('putting...', put_url)
             self.action_counter += 1
-            requests.put(put_url, data=value, timeout=timeout)
-            return True
+            (data, coding) = compress(value, self.codec, self.compression_threshold)
+            headers = None if coding is None else {'Content-Encoding': coding}
+            return succeeded(self.send(service, 'PUT', put_url, data=data, headers=headers, timeout=timeout).status_code)
         return False
 
     def __delete(self, service: ServiceInfo, key, timeout):
@@ -86,102 +258,419 @@ class ZerocacheClient(ZerocacheListener):
             delete_url = self.service_base_url(service, f'/{self.region}/{key}')
             self.latest_action = f"DELETE: {delete_url}"
             self.action_counter += 1
-            requests.delete(delete_url, timeout=timeout)
+            self.send(service, 'DELETE', delete_url, timeout=timeout)
             return True
         return False
 
-    def get(self, key):
-        try:
-            first_service = self.next_local_service()
-            if first_service:
-                self.log('get 1st local')
-                (ok, value) = self.__get(first_service, key, 0.5)
-                if ok:
-                    return (ok, value)
-        except:
-            pass
-        try:
-            second_service = self.next_local_service()
-            if first_service != second_service:
-                self.log('get 2nd local')
-                (ok, value) = self.__get(second_service, key, 0.5)
-                if ok:
-                    self.log('get 2nd local - ok')
-                    return (ok, value)
-        except:
-            pass
-        try:
-            first_remote_service = self.random_remote_service(rank=0)
-            self.log('first_remote_service', first_remote_service)
+    def remote_owner_service(self, rank, key, other_regions=None):
+        if other_regions is None:
+            other_regions = self.ranked_regions
+        if rank >= 0 and rank < len(other_regions):
+            owners = self.ring_owners(other_regions[rank], key, 1)
+            if owners:
+                return owners[0]
+        return None
+
+    def fallback_services(self, key=None):
+        # MEMO: lazily yields (service, timeout) in fallback order, the rotation only advances when a tier is needed.
+        #       The ranking is read once, a probe reranking the regions in between could otherwise yield the
+        #       same remote region twice (and skip the other one).
+        other_regions = self.ranked_regions
+        if self.partitioned and key is not None:
+            # MEMO: partitioned regions only hold a key on its ring owners, go straight to them
+            owners = self.ring_owners(self.region, key, self.replicas)
+            # MEMO: owners behind an open breaker are tried last
+            owners.sort(key=lambda info: not self.breaker(info).is_available())
+            for service in owners[:2]:
+                yield (service, 0.5)
+            first_remote_service = self.remote_owner_service(0, key, other_regions)
             if first_remote_service:
-                self.log('get 1st remote')
-                (ok, value) = self.__get(first_remote_service, key, 0.5)
-                if ok:
-                    return (ok, value)
-        except:
-            pass
-        try:
-            second_remote_service = self.random_remote_service(rank=1)
-            self.log('first_remote_service', second_remote_service)
+                yield (first_remote_service, 0.75)
+            second_remote_service = self.remote_owner_service(1, key, other_regions)
             if second_remote_service:
-                self.log('get 2nd remote')
-                (ok, value) = self.__get(second_remote_service, key, 0.5)
-                if ok:
-                    return (ok, value)
-        except:
-            pass
-        return (False, None)
+                yield (second_remote_service, 1.0)
+            return
+        for service in self.local_services():
+            yield (service, 0.5)
+        first_remote_service = self.random_remote_service(rank=0, other_regions=other_regions)
+        if first_remote_service:
+            yield (first_remote_service, 0.75)
+        second_remote_service = self.random_remote_service(rank=1, other_regions=other_regions)
+        if second_remote_service:
+            yield (second_remote_service, 1.0)
 
-    def put(self, key, value, expiry):
-        try:
-            first_service = self.next_local_service()
-            if first_service:
-                return self.__put(first_service, key, value, expiry, 0.5)
-        except:
-            pass
-        try:
-            second_service = self.next_local_service()
-            if first_service != second_service:
-                return self.__put(second_service, key, value, expiry, 0.5)
-        except:
-            pass
+    def __get_many(self, service: ServiceInfo, keys, timeout):
+        batch_url = self.service_base_url(service, f'/_batch/{self.region}')
+        self.latest_action = f"GET MANY: {batch_url}"
+        self.action_counter += 1
+        body = pack_records([({'key': key}, None) for key in keys])
+        response = self.send(service, 'POST', batch_url, data=body, timeout=timeout, headers={'Accept-Encoding': ACCEPT_ENCODING})
+        if response.status_code != 200:
+            return {}
+        return batch_hits(response.content)
+
+    def put_record(self, key, value, expiry, tags=None):
+        (data, coding) = compress(value, self.codec, self.compression_threshold)
+        meta = {'key': key, 'expiry': expiry}
+        if coding is not None:
+            meta['coding'] = coding
+        if tags:
+            meta['tags'] = list(tags)
+        return (meta, data)
+
+    def __put_many(self, service: ServiceInfo, records, timeout):
+        batch_url = self.service_base_url(service, f'/_batch/{self.region}')
+        self.latest_action = f"PUT MANY: {batch_url}"
+        self.action_counter += 1
+        return succeeded(self.send(service, 'PUT', batch_url, data=pack_records(records), timeout=timeout).status_code)
+
+    def __delete_many(self, service: ServiceInfo, keys, timeout):
+        batch_url = self.service_base_url(service, f'/_batch/{self.region}')
+        self.latest_action = f"DELETE MANY: {batch_url}"
+        self.action_counter += 1
+        body = pack_records([({'key': key}, None) for key in keys])
+        self.send(service, 'DELETE', batch_url, data=body, timeout=timeout)
+        return True
+
+    def fallback_plan(self, keys):
+        # MEMO: the fallback tiers of each key, they are the same for every key unless the region is partitioned
+        if not self.partitioned:
+            tiers = list(self.fallback_services())
+            return {key: tiers for key in keys}
+        return {key: list(self.fallback_services(key)) for key in keys}
+
+    def plan_groups(self, plan, keys, depth):
+        # MEMO: keys grouped by the service of their tier at the given depth, one batch request per service
+        groups = {}
+        for key in keys:
+            tiers = plan[key]
+            if depth < len(tiers):
+                (service, timeout) = tiers[depth]
+                if service.name not in groups:
+                    groups[service.name] = (service, timeout, [])
+                groups[service.name][2].append(key)
+        return list(groups.values())
+
+    def get_many(self, keys):
+        found = {}
+        remaining = list(dict.fromkeys(keys))
+        if self.near_cache is not None:
+            for key in remaining:
+                value = self.near_cache.get(key)
+                if value is not None:
+                    found[key] = value
+            remaining = [key for key in remaining if key not in found]
+            self.observe_tier(tier='near', count=len(found))
+        plan = self.fallback_plan(remaining)
+        depth = 0
+        while remaining:
+            groups = self.plan_groups(plan, remaining, depth)
+            if not groups:
+                break
+            for (service, timeout, group_keys) in groups:
+                try:
+                    hits = self.__get_many(service, group_keys, timeout)
+                except:
+                    continue
+                found.update(hits)
+                self.observe_tier(service, count=len(hits))
+                if self.near_cache is not None:
+                    for key, value in hits.items():
+                        self.near_cache.put(key, value)
+            # MEMO: only the keys that missed fall through to the next tier
+            remaining = [key for key in remaining if key not in found]
+            depth += 1
+        self.observe_tier(tier='miss', count=len(remaining))
+        self.cache_hit = len(remaining) == 0
+        return found
+
+    # MEMO: items maps key -> value, or key -> (value, expiry) for keys with their own expiry; tags apply to all
+    def put_many(self, items, expiry=60, tags=None):
+        records = {}
+        for key, item in items.items():
+            (value, item_expiry) = item if isinstance(item, tuple) else (item, expiry)
+            records[key] = self.put_record(key, value, item_expiry, tags)
+            if self.near_cache is not None:
+                self.near_cache.invalidate(key)
+        plan = self.fallback_plan(list(records))
+        # MEMO: grouped by first tier (the primary owner when partitioned), the receiving node forwards to the other replicas
+        groups = self.plan_groups(plan, list(records), 0)
+        ok = len(groups) > 0
+        for (_, _, group_keys) in groups:
+            group_ok = False
+            for (service, timeout) in plan[group_keys[0]]:
+                try:
+                    group_ok = self.__put_many(service, [records[key] for key in group_keys], timeout)
+                    break
+                except:
+                    pass
+            ok = ok and group_ok
+        return ok
+
+    def delete_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        if self.near_cache is not None:
+            for key in keys:
+                self.near_cache.invalidate(key)
+        plan = self.fallback_plan(keys)
+        groups = self.plan_groups(plan, keys, 0)
+        ok = len(groups) > 0
+        for (_, _, group_keys) in groups:
+            group_ok = False
+            for (service, timeout) in plan[group_keys[0]]:
+                try:
+                    group_ok = self.__delete_many(service, group_keys, timeout)
+                    break
+                except:
+                    pass
+            ok = ok and group_ok
+        return ok
+
+    def invalidate_body(self, tags=None, prefixes=None):
+        # MEMO: near caches don't know the tags of their entries, they are cleared whole
+        if self.near_cache is not None:
+            self.near_cache.clear()
+        return json.dumps({'tags': list(tags or ()), 'prefixes': list(prefixes or ())})
+
+    # MEMO: drops every entry of the region written with one of the tags, or whose key starts with one of the
+    #       prefixes, on every node of every region; the first node that answers replicates it
+    def invalidate(self, tags=None, prefixes=None):
+        body = self.invalidate_body(tags, prefixes)
+        for (service, timeout) in self.fallback_services():
+            invalidate_url = self.service_base_url(service, f'/_invalidate/{self.region}')
+            self.latest_action = f"INVALIDATE: {invalidate_url}"
+            self.action_counter += 1
+            try:
+                response = self.send(service, 'POST', invalidate_url, data=body, timeout=timeout)
+                return response.status_code == 200
+            except:
+                pass
+        return False
+
+    def lease_url(self, key, ttl=None):
+        # MEMO: the leases of a key are all arbitrated by the same node of the region, its first ring owner
+        owners = self.ring_owners(self.region, key, 1)
+        if not owners:
+            return (None, None)
+        query = {'owner': self.lease_owner} if ttl is None else {'owner': self.lease_owner, 'ttl': ttl}
+        return (owners[0], self.service_base_url(owners[0], f'/_lease/{self.region}/{key}?{urlencode(query)}'))
+
+    def acquire_lease(self, key, ttl=10.0):
+        # MEMO: False only while another client holds the lease, without an answer the caller goes ahead
+        (service, url) = self.lease_url(key, ttl)
+        if service is None:
+            return True
         try:
-            first_remote_service = self.random_remote_service(rank=0)
-            if first_remote_service:
-                return self.__put(first_remote_service, key, value, expiry, 0.75)
+            return self.send(service, 'POST', url, timeout=0.5).status_code != 409
         except:
-            pass
+            return True
+
+    def release_lease(self, key):
+        (service, url) = self.lease_url(key)
+        if service is None:
+            return False
         try:
-            second_remote_service = self.random_remote_service(rank=1)
-            if second_remote_service:
-                return self.__put(second_remote_service, key, value, expiry, 1.0)
+            return self.send(service, 'DELETE', url, timeout=0.5).status_code == 200
         except:
-            pass
+            return False
+
+    def stats(self):
+        # MEMO: where reads were answered from and how fast each node was; latencies are estimated from the
+        #       histogram buckets, in milliseconds
+        (counters, histograms) = self.metrics.snapshot()
+        tiers = {'near': 0, 'local': 0, 'remote': 0, 'miss': 0}
+        nodes = {}
+        for ((name, labels), value) in counters.items():
+            labels = dict(labels)
+            if name == 'zerocache_client_gets_total':
+                tiers[labels['tier']] = tiers.get(labels['tier'], 0) + value
+            elif name == 'zerocache_client_request_failures_total':
+                node = nodes.setdefault(labels['node'], {'region': labels['region'], 'requests': 0, 'failures': 0, 'methods': {}})
+                node['failures'] += value
+        for ((name, labels), histogram) in histograms.items():
+            labels = dict(labels)
+            node = nodes.setdefault(labels['node'], {'region': labels['region'], 'requests': 0, 'failures': 0, 'methods': {}})
+            node['requests'] += histogram.count
+            node['methods'][labels['method']] = {
+                "requests": histogram.count
+                , "mean_ms": round(histogram.sum / histogram.count * 1000, 3)
+                , "p50_ms": round(histogram.quantile(0.5) * 1000, 3)
+                , "p99_ms": round(histogram.quantile(0.99) * 1000, 3)
+            }
+        reads = sum(tiers.values())
+        return {
+            "nodes": nodes
+            , "tiers": tiers
+            , "tier_rates": {tier: (round(count / reads, 4) if reads else None) for (tier, count) in tiers.items()}
+        }
+
+    def metrics_text(self):
+        # MEMO: the same numbers in the Prometheus text format, for applications exposing their own /metrics
+        return render(self.metrics)
+
+    def near_cache_info(self):
+        if self.near_cache is None:
+            return None
+        return self.near_cache.info()
+
+    def current_hedge_delay(self):
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        samples = list(self.get_latencies)
+        if len(samples) < 20:
+            return 0.05
+        # MEMO: fire the hedge once the first request is slower than 95% of recent GETs
+        return quantiles(samples, n=20)[18]
+
+    def hedge_racer(self, service: ServiceInfo, key, timeout):
+        # MEMO: a racer runs on a thread of its own, holding one of the hedge_workers slots until it answers or its
+        #       race is over. requests can't abort a call in flight: once the winner answered, the losers give their
+        #       slots back and finish in the background, up to their timeout, ignored
+        future = Future()
+        once = Lock()
+        def release():
+            if once.acquire(blocking=False):
+                self.hedge_slots.release()
+        def run():
+            try:
+                future.set_result(self.__fetch(service, key, timeout))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                release()
+        Thread(target=run, name='zerocache-hedge', daemon=True).start()
+        return (future, release)
+
+    def hedged_get(self, key):
+        (ok, value, _) = self.hedged_get_entry(key)
+        return (ok, value)
+
+    def hedged_get_entry(self, key):
+        self.cache_hit = False
+        # MEMO: (service, timeout, seconds to wait before the next contender joins the race), the 2nd local node
+        #       joins after the hedge delay, remote regions only once the local nodes missed or timed out
+        contenders = [(service, timeout, timeout) for (service, timeout) in self.fallback_services(key)]
+        if contenders:
+            (service, timeout, _) = contenders[0]
+            contenders[0] = (service, timeout, self.current_hedge_delay())
+        pending = set()
+        racers = {}
+        next_launch = 0.0
+        while pending or contenders:
+            postponed = False
+            if contenders and (not pending or perf_counter() >= next_launch):
+                # MEMO: with every slot taken, a hedge waits for the racers already pending rather than for a slot
+                if self.hedge_slots.acquire(blocking=not pending):
+                    (service, timeout, delay) = contenders.pop(0)
+                    self.log('hedged get ->', service.name)
+                    (future, release) = self.hedge_racer(service, key, timeout)
+                    racers[future] = (service, release)
+                    pending.add(future)
+                    next_launch = perf_counter() + delay
+                else:
+                    postponed = True
+            wait_for = max(0.0, next_launch - perf_counter()) if contenders and not postponed else None
+            (done, pending) = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    (ok, content, get_url, meta) = future.result()
+                except:
+                    continue
+                if ok:
+                    for (_, release) in racers.values():
+                        release()
+                    self.latest_action = f"GET: {get_url}"
+                    self.cache_hit = True
+                    self.observe_tier(racers[future][0])
+                    return (True, content, meta)
+        self.observe_tier(tier='miss')
+        return (False, None, None)
+
+    # MEMO: with stream=True, the value comes back as a file-like object rather than bytes, read from the socket
+    #       as the caller reads it (read(n), stream(n)); close it, or use it in a with block, once done.
+    #       Streamed reads skip the near cache and hedging.
+    def get(self, key, stream=False):
+        if stream:
+            return self.stream_get(key)
+        (ok, value, _) = self.get_entry(key)
+        return (ok, value)
+
+    def stream_get(self, key):
+        self.cache_hit = False
+        for (service, timeout) in self.fallback_services(key):
+            try:
+                reader = self.__open(service, key, timeout)
+                if reader is not None:
+                    self.cache_hit = True
+                    self.observe_tier(service)
+                    return (True, reader)
+            except:
+                pass
+        self.observe_tier(tier='miss')
+        return (False, None)
+
+    # MEMO: get(), along with what the node knows of the entry: {'ttl', 'age'} in seconds, and 'delta' when
+    #       the writer gave one. The meta is None for near cache hits.
+    def get_entry(self, key):
+        if self.near_cache is not None:
+            value = self.near_cache.get(key)
+            if value is not None:
+                self.cache_hit = True
+                self.latest_action = 'GET: near cache'
+                self.observe_tier(tier='near')
+                return (True, value, None)
+        if self.hedged:
+            (ok, value, meta) = self.hedged_get_entry(key)
+        else:
+            (ok, value, meta) = self.fallback_get_entry(key)
+        if ok and self.near_cache is not None:
+            self.near_cache.put(key, value, meta and meta['ttl'])
+        return (ok, value, meta)
+
+    def fallback_get(self, key):
+        (ok, value, _) = self.fallback_get_entry(key)
+        return (ok, value)
+
+    def fallback_get_entry(self, key):
+        self.cache_hit = False
+        for (service, timeout) in self.fallback_services(key):
+            try:
+                self.log('get ->', service.name)
+                (ok, value, meta) = self.__get(service, key, timeout)
+                if ok:
+                    self.observe_tier(service)
+                    return (ok, value, meta)
+            except:
+                pass
+        self.observe_tier(tier='miss')
+        return (False, None, None)
+
+    # MEMO: delta, optional, is how many seconds the value took to compute, for readers refreshing it early
+    def put(self, key, value, expiry, delta=None, tags=None):
+        if self.near_cache is not None:
+            self.near_cache.invalidate(key)
+        ok = self.fallback_put(key, value, expiry, delta, tags)
+        if ok and self.near_cache is not None:
+            self.near_cache.put(key, value, expiry)
+        return ok
+
+    def fallback_put(self, key, value, expiry, delta=None, tags=None):
+        for (service, timeout) in self.fallback_services(key):
+            try:
+                return self.__put(service, key, value, expiry, timeout, delta, tags)
+            except:
+                pass
         return False
 
     def delete(self, key=None):
-        try:
-            first_service = self.next_local_service()
-            if first_service:
-                return self.__delete(first_service, key, 0.5)
-        except:
-            pass
-        try:
-            second_service = self.next_local_service()
-            if first_service != second_service:
-                return self.__delete(second_service, key, 0.5)
-        except:
-            pass
-        try:
-            first_remote_service = self.random_remote_service(rank=0)
-            if first_remote_service:
-                return self.__delete(first_remote_service, key, 0.75)
-        except:
-            pass
-        try:
-            second_remote_service = self.random_remote_service(rank=1)
-            if second_remote_service:
-                return self.__delete(second_remote_service, key, 1.0)
-        except:
-            pass
+        if self.near_cache is not None:
+            self.near_cache.invalidate(key)
+        return self.fallback_delete(key)
+
+    def fallback_delete(self, key=None):
+        for (service, timeout) in self.fallback_services(key):
+            try:
+                return self.__delete(service, key, timeout)
+            except:
+                pass
         return False
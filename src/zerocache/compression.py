@@ -0,0 +1,111 @@
+import gzip
+import lzma
+import zlib
+
+# MEMO: content codings, by their HTTP name. Values above a size threshold are compressed once, by their writer
+#       (client, or else the first node), then stored, replicated and served compressed: readers that don't
+#       accept the coding get them decompressed by the node.
+#       http_native codings are decoded by the HTTP libraries themselves (requests, aiohttp), the others by zerocache.
+
+class ZerocacheDeflateCodec:
+    name = 'deflate'
+    http_native = True
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+class ZerocacheGzipCodec:
+    name = 'gzip'
+    http_native = True
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return gzip.compress(data, self.level, mtime=0)
+
+    def decompress(self, data):
+        return gzip.decompress(data)
+
+# MEMO: slower, but smaller; not an HTTP standard coding, only zerocache clients ask for it
+class ZerocacheXzCodec:
+    name = 'xz'
+    http_native = False
+
+    def __init__(self, preset=1):
+        self.preset = preset
+
+    def compress(self, data):
+        return lzma.compress(data, preset=self.preset)
+
+    def decompress(self, data):
+        return lzma.decompress(data)
+
+CODECS = {
+    'deflate': ZerocacheDeflateCodec
+    , 'gzip': ZerocacheGzipCodec
+    , 'xz': ZerocacheXzCodec
+}
+# MEMO: every coding is decoded by the default codec of its name, whatever the level it was compressed with
+DECODERS = {name: codec() for (name, codec) in CODECS.items()}
+ACCEPT_ENCODING = ', '.join(CODECS)
+# MEMO: streamed values are decoded by the HTTP library as they are read, nodes decompress the other codings
+STREAM_ACCEPT_ENCODING = ', '.join(name for (name, codec) in CODECS.items() if codec.http_native)
+
+def codec_for(compression):
+    if compression is None:
+        return None
+    if isinstance(compression, str):
+        if compression not in CODECS:
+            raise ValueError(f"compression must be one of {tuple(CODECS)}, None, or a codec object")
+        return CODECS[compression]()
+    return compression
+
+def compress(value, codec, threshold):
+    # MEMO: returns (data, coding), the coding is None when the value is left as it is
+    if codec is None or value is None or len(value) < threshold:
+        return (value, None)
+    data = codec.compress(value)
+    if len(data) >= len(value):
+        # MEMO: incompressible (already compressed, random...)
+        return (value, None)
+    return (data, codec.name)
+
+def decompress(data, coding):
+    if not coding or coding == 'identity':
+        return data
+    return DECODERS[coding].decompress(data)
+
+def known_coding(coding):
+    return not coding or coding == 'identity' or coding in DECODERS
+
+def accepted_codings(header):
+    # MEMO: the codings of an Accept-Encoding header, less those refused with q=0
+    codings = set()
+    for part in (header or '').split(','):
+        (coding, _, params) = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        try:
+            q = float(params.strip()[2:]) if params.strip().startswith('q=') else 1.0
+        except ValueError:
+            q = 1.0
+        if q > 0:
+            codings.add(coding)
+    if '*' in codings:
+        codings.update(DECODERS)
+    return codings
+
+def decoded_response(headers, content):
+    # MEMO: the body of a response, once the HTTP library decoded what it could
+    coding = headers.get('Content-Encoding')
+    if coding in DECODERS and not DECODERS[coding].http_native:
+        return DECODERS[coding].decompress(content)
+    return content
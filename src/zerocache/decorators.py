@@ -1,24 +1,166 @@
-import pickle
-from hashlib import md5
+import asyncio
+import functools
+import inspect
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from .client import ZerocacheClient
+from .keys import call_key, function_name
+from .serializers import serializer_for
+from .singleflight import ZerocacheSingleFlight, ZerocacheAsyncSingleFlight
+
+# MEMO: backoff between the GETs of a caller waiting on another process's lease
+def lease_polls(lease_ttl):
+    deadline = time.monotonic() + lease_ttl
+    delay = 0.05
+    while time.monotonic() < deadline:
+        yield delay
+        delay = min(delay * 2, 0.5)
+
+# MEMO: entries are written to live stale_grace seconds past their expiry, a ttl under stale_grace means stale.
+#       XFetch (Vattani et al., "Optimal Probabilistic Cache Stampede Prevention"): a fresh entry is refreshed early
+#       with a probability that grows as its expiry nears, and with how long it took to compute (delta).
+def should_refresh(meta, stale_grace, xfetch_beta):
+    if meta is None:
+        return False
+    fresh = meta['ttl'] - stale_grace
+    if fresh <= 0:
+        return True
+    if xfetch_beta and meta.get('delta'):
+        return meta['delta'] * xfetch_beta * -math.log(1.0 - random.random()) >= fresh
+    return False
+
+# MEMO: concurrent misses of the same call are coalesced, within the process always (one caller runs func, the
+#       others wait for its result), across processes with lease=True: the caller that gets the key's lease
+#       runs func, the others poll the cache for its result for up to lease_ttl seconds, then run func themselves.
+#       With stale_grace and/or xfetch_beta, stale (or soon to expire) values are served while a single background
+#       refresh per key recomputes them.
+#       Calls are keyed by their arguments (see keys.call_key), or by whatever key(*args, **kwargs) returns.
+#       Values are stored by serializer: 'pickle' (the default), 'msgpack', 'bytes', or a serializer object.
+#       Results are tagged with the function's name, and with tags (a list, or a function of the call's arguments
+#       returning one); func.invalidate() drops the cached results of every call, in every region.
+def auto_zerocache(region, expiry=60, lease=False, lease_ttl=10.0, stale_grace=0, xfetch_beta=0, key=None, serializer='pickle', tags=None):
+    put_expiry = math.ceil(expiry + stale_grace)
+    key_func = key
+    codec = serializer_for(serializer)
 
-def auto_zerocache(region, expiry=60):
     def decorator(func):
+        func_tag = function_name(func)
+
+        def call_tags(args, kwargs):
+            return [func_tag, *(tags(*args, **kwargs) if callable(tags) else tags or ())]
+
+        # MEMO: 'async def' functions are served by an AsyncZerocacheClient, from their own event loop
+        if inspect.iscoroutinefunction(func):
+            from .async_client import AsyncZerocacheClient
+            async_flights = ZerocacheAsyncSingleFlight()
+            async_refreshes = ZerocacheAsyncSingleFlight()
+            refresh_tasks = set()
+
+            async def async_run(client, key, args, kwargs):
+                t0 = time.perf_counter()
+                result = await func(*args, **kwargs)
+                put_result = await client.put(key, codec.dumps(result), put_expiry, time.perf_counter() - t0, call_tags(args, kwargs))
+                return result
+
+            async def async_compute(client, key, args, kwargs, refresh=False):
+                if lease:
+                    if not await client.acquire_lease(key, lease_ttl):
+                        if refresh:
+                            return None
+                        for delay in lease_polls(lease_ttl):
+                            await asyncio.sleep(delay)
+                            ok, cached_value = await client.get(key)
+                            if ok:
+                                return codec.loads(cached_value)
+                    else:
+                        try:
+                            # MEMO: the previous holder may have stored the result since our miss
+                            if not refresh:
+                                ok, cached_value = await client.get(key)
+                                if ok:
+                                    return codec.loads(cached_value)
+                            return await async_run(client, key, args, kwargs)
+                        finally:
+                            await client.release_lease(key)
+                return await async_run(client, key, args, kwargs)
+
+            def async_refresh(client, key, args, kwargs):
+                if async_refreshes.busy(key):
+                    return
+                task = asyncio.ensure_future(async_refreshes.do(key, lambda: async_compute(client, key, args, kwargs, refresh=True)))
+                refresh_tasks.add(task)
+                # MEMO: a failed refresh leaves the current value in place, its exception is dropped
+                task.add_done_callback(lambda task: refresh_tasks.discard(task) or task.cancelled() or task.exception())
+
+            @functools.wraps(func)
+            async def async_call(*args, **kwargs):
+                client = await AsyncZerocacheClient.get_instance(region)
+                key = call_key(func, args, kwargs, key_func)
+                ok, cached_value, meta = await client.get_entry(key)
+                if ok:
+                    if should_refresh(meta, stale_grace, xfetch_beta):
+                        async_refresh(client, key, args, kwargs)
+                    return codec.loads(cached_value)
+                return await async_flights.do(key, lambda: async_compute(client, key, args, kwargs))
+
+            async def async_invalidate():
+                client = await AsyncZerocacheClient.get_instance(region)
+                return await client.invalidate(tags=[func_tag])
+            async_call.invalidate = async_invalidate
+            return async_call
+
+        flights = ZerocacheSingleFlight()
+        refreshes = ZerocacheSingleFlight()
+        refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='zerocache-refresh') if stale_grace or xfetch_beta else None
+
+        def run(client, key, args, kwargs):
+            t0 = time.perf_counter()
+            result = func(*args, **kwargs)
+            put_result = client.put(key, codec.dumps(result), put_expiry, time.perf_counter() - t0, call_tags(args, kwargs))
+            return result
+
+        def compute(client, key, args, kwargs, refresh=False):
+            if lease:
+                if not client.acquire_lease(key, lease_ttl):
+                    if refresh:
+                        return None
+                    for delay in lease_polls(lease_ttl):
+                        time.sleep(delay)
+                        ok, cached_value = client.get(key)
+                        if ok:
+                            return codec.loads(cached_value)
+                else:
+                    try:
+                        # MEMO: the previous holder may have stored the result since our miss
+                        if not refresh:
+                            ok, cached_value = client.get(key)
+                            if ok:
+                                return codec.loads(cached_value)
+                        return run(client, key, args, kwargs)
+                    finally:
+                        client.release_lease(key)
+            return run(client, key, args, kwargs)
+
+        def refresh(client, key, args, kwargs):
+            # MEMO: a failed refresh leaves the current value in place, its exception stays in the dropped future
+            if not refreshes.busy(key):
+                refresher.submit(refreshes.do, key, lambda: compute(client, key, args, kwargs, refresh=True))
+
+        @functools.wraps(func)
         def call(*args, **kwargs):
             client = ZerocacheClient.get_instance(region)
-            args_hash = md5()
-            for arg in args:
-                args_hash.update(str(arg).encode('utf-8'))
-            for key, arg in kwargs:
-                args_hash.update(str(key).encode('utf-8'))
-                args_hash.update(str(arg).encode('utf-8'))
-            args_hash_digest = args_hash.hexdigest()
-            key = f"{func.__name__}--{args_hash_digest}"
-            ok, cached_value = client.get(key)
+            key = call_key(func, args, kwargs, key_func)
+            ok, cached_value, meta = client.get_entry(key)
             if ok:
-                return pickle.loads(cached_value)
-            result = func(*args, **kwargs)
-            put_result = client.put(key, pickle.dumps(result), expiry)
-            return result
+                if should_refresh(meta, stale_grace, xfetch_beta):
+                    refresh(client, key, args, kwargs)
+                return codec.loads(cached_value)
+            return flights.do(key, lambda: compute(client, key, args, kwargs))
+
+        def invalidate():
+            return ZerocacheClient.get_instance(region).invalidate(tags=[func_tag])
+        call.invalidate = invalidate
         return call
     return decorator
@@ -0,0 +1,139 @@
+import enum
+import functools
+import re
+import struct
+from hashlib import blake2b
+
+# MEMO: optional dependency, 'pip install zerocache[fast]'. Keys hashed with and without it differ: a cluster's
+#       clients should agree on having it or not.
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+MAX_DEPTH = 32
+# MEMO: containers of these have a canonical repr, encoded in one go rather than item by item
+REPR_SAFE = frozenset((type(None), bool, int, float, str, bytes))
+NESTED_REPR_SAFE = REPR_SAFE | {tuple, list}
+SORTABLE = frozenset((bool, int, str, bytes))
+UNSAFE_NAME = re.compile(r'[^A-Za-z0-9_.-]')
+
+def digest(data):
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return blake2b(data, digest_size=16).hexdigest()
+
+def type_name(value):
+    t = type(value)
+    return f"{t.__module__}.{t.__qualname__}".encode('utf-8')
+
+def repr_safe(values, depth=0):
+    types = set(map(type, values))
+    if types <= REPR_SAFE:
+        return True
+    if depth >= MAX_DEPTH or not types <= NESTED_REPR_SAFE:
+        return False
+    return all(repr_safe(value, depth + 1) for value in values if type(value) is tuple or type(value) is list)
+
+def sortable(values):
+    # MEMO: members of a single type, that sorts
+    types = set(map(type, values))
+    return len(types) <= 1 and types <= SORTABLE
+
+def encode_sized(tag, data, out):
+    out.append(b'%s%d:' % (tag, len(data)))
+    out.append(data)
+
+# MEMO: a canonical, structural encoding of a value: type tagged and length prefixed, so that distinct values
+#       never encode alike, with dict items and set members sorted, so that equal values always encode alike.
+#       Other objects are encoded by type and state (what pickle would save), never by a repr holding an address.
+def encode(value, out, depth=0):
+    t = type(value)
+    if value is None:
+        out.append(b'N')
+    elif t is bool:
+        out.append(b'T' if value else b'F')
+    elif t is int:
+        out.append(b'i%d;' % value)
+    elif t is float:
+        out.append(b'f' + struct.pack('<d', value))
+    elif t is str:
+        encode_sized(b's', value.encode('utf-8', 'surrogatepass'), out)
+    elif t is bytes:
+        encode_sized(b'b', value, out)
+    elif t is bytearray or t is memoryview:
+        encode_sized(b'b', bytes(value), out)
+    elif depth >= MAX_DEPTH:
+        # MEMO: way too deep, or a cycle
+        encode_sized(b'r', repr(value).encode('utf-8', 'surrogatepass'), out)
+    elif (t is tuple or t is list) and repr_safe(value, depth):
+        encode_sized(b'R', repr(value).encode('utf-8'), out)
+    elif t is tuple or t is list:
+        out.append(b'(' if t is tuple else b'[')
+        for item in value:
+            encode(item, out, depth + 1)
+        out.append(b')')
+    elif t is dict and sortable(value) and repr_safe(value.values()):
+        encode_sized(b'R{', repr(sorted(value.items())).encode('utf-8'), out)
+    elif t is dict:
+        encode_items(b'{', value.items(), out, depth)
+    elif (t is set or t is frozenset) and sortable(value):
+        encode_sized(b'R<', repr(sorted(value)).encode('utf-8'), out)
+    elif t is set or t is frozenset:
+        out.append(b'<')
+        out.extend(sorted(encoded(item, depth + 1) for item in value))
+        out.append(b'>')
+    elif t is complex:
+        out.append(b'c' + struct.pack('<dd', value.real, value.imag))
+    elif isinstance(value, enum.Enum):
+        encode_sized(b'e', type_name(value) + b'.' + value.name.encode('utf-8'), out)
+    else:
+        encode_object(value, out, depth)
+
+def encoded(value, depth=0):
+    out = []
+    encode(value, out, depth)
+    return b''.join(out)
+
+def encode_items(tag, items, out, depth):
+    out.append(tag)
+    for (k, v) in sorted((encoded(k, depth + 1), encoded(v, depth + 1)) for (k, v) in items):
+        out.append(k)
+        out.append(v)
+    out.append(b'}')
+
+def encode_object(value, out, depth):
+    encode_sized(b'o', type_name(value), out)
+    # MEMO: subclasses of the builtins (named tuples, str enums...) keep their builtin value
+    for base in (int, float, str, bytes, tuple, list, dict, set, frozenset):
+        if isinstance(value, base):
+            encode(base(value), out, depth + 1)
+            break
+    try:
+        state = value.__getstate__()
+    except:
+        state = None
+    if state is None or state == {}:
+        # MEMO: stateless to pickle (datetimes, decimals...), their repr tells them apart
+        if not isinstance(value, (int, float, str, bytes, tuple, list, dict, set, frozenset)):
+            encode_sized(b'r', repr(value).encode('utf-8', 'surrogatepass'), out)
+    elif type(state) is dict:
+        encode_items(b'{', state.items(), out, depth)
+    else:
+        encode(state, out, depth + 1)
+
+@functools.lru_cache(maxsize=1024)
+def function_name(func):
+    return UNSAFE_NAME.sub('_', func.__qualname__)
+
+# MEMO: key of a call, "<function>--<hash of its arguments>". With key=, the hash is of key(*args, **kwargs)
+#       instead, for functions taking arguments that shouldn't count (connections, loggers...).
+def call_key(func, args, kwargs, key=None):
+    out = []
+    if key is not None:
+        encode(key(*args, **kwargs), out)
+    else:
+        encode(tuple(args), out)
+        if kwargs:
+            encode(kwargs, out)
+    return f"{function_name(func)}--{digest(b''.join(out))}"
@@ -0,0 +1,105 @@
+from collections import deque
+from statistics import quantiles
+from threading import Lock
+
+# MEMO: latency of one node, an EWMA that follows recent conditions, plus a window of samples for percentiles.
+#       Failures are counted apart (consecutive, reset by the next success) rather than mixed in as samples.
+class ZerocacheLatencyStats:
+    __slots__ = ('ewma', 'samples', 'failures')
+
+    def __init__(self, window=64):
+        self.ewma = None
+        self.samples = deque(maxlen=window)
+        self.failures = 0
+
+    def observe(self, ms, alpha):
+        self.ewma = ms if self.ewma is None else alpha * ms + (1 - alpha) * self.ewma
+        self.samples.append(ms)
+        self.failures = 0
+
+    def fail(self):
+        self.failures += 1
+
+    def healthy(self):
+        return self.ewma is not None and self.failures == 0
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    if len(samples) == 1:
+        return samples[0]
+    return quantiles(samples, n=100, method='inclusive')[q - 1]
+
+# MEMO: latency stats of every node by region, fed by active probes and by real traffic alike
+class ZerocacheLatencyTracker:
+    def __init__(self, alpha=0.3, window=64):
+        self.alpha = alpha
+        self.window = window
+        self.nodes = {}
+        self.lock = Lock()
+
+    def _stats(self, region, name) -> ZerocacheLatencyStats:
+        stats = self.nodes.setdefault(region, {}).get(name)
+        if stats is None:
+            stats = self.nodes[region][name] = ZerocacheLatencyStats(self.window)
+        return stats
+
+    def stats(self, region, name) -> ZerocacheLatencyStats:
+        # MEMO: the stats object of a node, for readers that keep it at hand (it is replaced only once forgotten)
+        with self.lock:
+            return self._stats(region, name)
+
+    def observe(self, region, name, ms):
+        with self.lock:
+            self._stats(region, name).observe(ms, self.alpha)
+
+    def fail(self, region, name):
+        with self.lock:
+            self._stats(region, name).fail()
+
+    def forget(self, region, name):
+        with self.lock:
+            self.nodes.get(region, {}).pop(name, None)
+            if not self.nodes.get(region, True):
+                del self.nodes[region]
+
+    def ewma(self, region, name):
+        with self.lock:
+            stats = self.nodes.get(region, {}).get(name)
+            return None if stats is None else stats.ewma
+
+    def node_score(self, region, name):
+        # MEMO: sort key, nodes that failed (or were never measured) come after every healthy one
+        with self.lock:
+            stats = self.nodes.get(region, {}).get(name)
+            if stats is None or stats.ewma is None:
+                return (1, 0, float('inf'))
+            return (0 if stats.failures == 0 else 1, stats.failures, stats.ewma)
+
+    def region_score(self, region):
+        # MEMO: mean EWMA of the healthy nodes of a region, None when none of them answers
+        with self.lock:
+            ewmas = [stats.ewma for stats in self.nodes.get(region, {}).values() if stats.healthy()]
+        if not ewmas:
+            return None
+        return sum(ewmas) / len(ewmas)
+
+    def info(self):
+        with self.lock:
+            info = {}
+            for region, nodes in self.nodes.items():
+                samples = []
+                region_info = {'nodes': {}}
+                for name, stats in nodes.items():
+                    node_samples = list(stats.samples)
+                    samples.extend(node_samples)
+                    region_info['nodes'][name] = {
+                        "ewma_ms": None if stats.ewma is None else round(stats.ewma, 3)
+                        , "p50_ms": percentile(node_samples, 50)
+                        , "p99_ms": percentile(node_samples, 99)
+                        , "failures": stats.failures
+                    }
+                region_info['p50_ms'] = percentile(samples, 50)
+                region_info['p99_ms'] = percentile(samples, 99)
+                info[region] = region_info
+            return info
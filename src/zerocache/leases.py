@@ -0,0 +1,45 @@
+from threading import Lock
+from time import monotonic
+
+MAX_LEASE_TTL = 300.0
+
+# MEMO: short-lived locks on keys, held by an owner token until released or expired. A lease lives on a single
+#       node (the first ring owner of its key), it isn't replicated: losing the node only loses the lease.
+class ZerocacheLeases:
+    def __init__(self):
+        self.lock = Lock()
+        self.leases = {}
+        self.granted = 0
+        self.refused = 0
+
+    def acquire(self, key, owner, ttl):
+        ttl = min(max(ttl, 0.001), MAX_LEASE_TTL)
+        now = monotonic()
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is not None and lease[1] > now and lease[0] != owner:
+                self.refused += 1
+                return False
+            self.leases[key] = (owner, now + ttl)
+            self.granted += 1
+            # MEMO: expired leases are only dropped once in a while, when they pile up
+            if len(self.leases) > 1024:
+                self.leases = {k: v for (k, v) in self.leases.items() if v[1] > now}
+            return True
+
+    def release(self, key, owner):
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is None or lease[0] != owner:
+                return False
+            del self.leases[key]
+            return True
+
+    def info(self):
+        now = monotonic()
+        with self.lock:
+            return {
+                "held": sum(1 for (_, expires) in self.leases.values() if expires > now)
+                , "granted": self.granted
+                , "refused": self.refused
+            }
@@ -1,59 +1,159 @@
 from zeroconf import ServiceBrowser, ServiceListener, Zeroconf, ServiceInfo
+import random
 import socket
-import requests
-from time import perf_counter_ns
-from statistics import mean
+from threading import Event, Thread
+from time import perf_counter
+from .latency import ZerocacheLatencyTracker
+from .pool import ZerocachePool
+from .registry import ZerocacheNode, ZerocacheRegistry
+from .ring import ZerocacheHashRing
+
+SERVICE_TYPE = "_server._geocache._tcp.local."
 
 class ZerocacheListener(ServiceListener):
-    def __init__(self, region=None):
+    def __init__(self, region=None, pool_maxsize=8, pool_idle_timeout=30.0, ring_vnodes=64
+            , probe_interval=5.0, probe_jitter=0.2, latency_alpha=0.3, latency_window=64, network=None):
         self.region = region
-        self.services = {}
-        self.latencies = {}
+        # MEMO: optional, a ZerocacheMemoryNetwork that stands in for zeroconf and for the sockets
+        self.network = network
+        self.registry = ZerocacheRegistry()
+        self.ring_vnodes = ring_vnodes
+        self.rings = {}
+        self.pool = ZerocachePool(maxsize=pool_maxsize, idle_timeout=pool_idle_timeout
+            , adapter=None if network is None else network.adapter(self))
+        self.latencies = ZerocacheLatencyTracker(alpha=latency_alpha, window=latency_window)
         self.avg_latencies = {}
         self.ranked_neighbours = {}
-        self.zeroconf = Zeroconf()
-        self.server_browser = ServiceBrowser(self.zeroconf, "_server._geocache._tcp.local.", self)
+        self.ranked_regions = ()
+        self.ranked_services = {}
         self.verbose = False
+        self.probe_interval = probe_interval
+        self.probe_jitter = probe_jitter
+        self.probe_stop = Event()
+        self._start_discovery()
+
+    # MEMO: browsing and probing start right away, from threads of their own; asyncio subclasses defer them
+    #       until they run in an event loop
+    def _start_discovery(self):
+        if self.probe_interval:
+            Thread(target=self._probe, name='zerocache-probe', daemon=True).start()
+        if self.network is not None:
+            self.zeroconf = self.network
+            self.network.browse(self)
+            return
+        self.zeroconf = Zeroconf()
+        self.server_browser = ServiceBrowser(self.zeroconf, SERVICE_TYPE, self)
 
     def log(self, *args):
         if self.verbose:
             print(*args)
 
+    # MEMO: the nodes by region, as ServiceInfo; a snapshot, it is replaced (never changed) as nodes come and go
+    @property
+    def services(self):
+        return self.registry.snapshot.services
+
     def service_base_url(self, info: ServiceInfo, uri: str = ''):
+        node = self.registry.snapshot.by_name.get(info.name)
+        if node is not None:
+            return node.base_url + uri
         address = socket.inet_ntoa(info.addresses[0])
         return f"http://{address}:{info.port}{uri}"
+
+    def session_for(self, info: ServiceInfo):
+        node = self.registry.snapshot.by_name.get(info.name)
+        if node is None:
+            return self.pool.session(info.name)
+        self.pool.touch(info.name)
+        return node.session
     
+    def ring(self, region) -> ZerocacheHashRing:
+        ring = self.rings.get(region)
+        if ring is None:
+            return ZerocacheHashRing(vnodes=self.ring_vnodes)
+        return ring
+
+    def service_by_name(self, region, name):
+        node = self.registry.snapshot.by_name.get(name)
+        if node is None or node.region != region:
+            return None
+        return node.info
+
+    def ring_owners(self, region, key, replicas):
+        owners = []
+        for name in self.ring(region).owners(key, replicas):
+            info = self.service_by_name(region, name)
+            if info is not None:
+                owners.append(info)
+        return owners
+
+    # MEMO: hook for subclasses, called after a node joined or left the ring of a region
+    def ring_changed(self, region, old_ring: ZerocacheHashRing, new_ring: ZerocacheHashRing):
+        pass
+
     def service_region(self, info: ServiceInfo):
+        node = self.registry.snapshot.by_name.get(info.name)
+        if node is not None:
+            return node.region
         return str(info.properties.get(b'region').decode('utf-8'))
 
-    def ping(self, info: ServiceInfo):
+    def ping(self, info: ServiceInfo, rerank=True):
         ping_url = self.service_base_url(info, '/ping')
         self.log(f"pinging... {ping_url}")
-        latency = 9999
         try:
-            head_ms = perf_counter_ns() // 1000000
-            requests.get(ping_url, params={}, timeout=0.5)
-            tail_ms = perf_counter_ns() // 1000000
-            latency = tail_ms - head_ms
-            self.log(f"ping {ping_url} ... latency = {latency} ms")
+            t0 = perf_counter()
+            self.session_for(info).get(ping_url, params={}, timeout=0.5)
+            latency = perf_counter() - t0
+            self.log(f"ping {ping_url} ... latency = {round(latency * 1000)} ms")
+            self.observe_latency(info, latency)
         except:
             self.log(f"pinging... fail")
-            pass
-
-        region = self.service_region(info)
-        if region not in self.latencies:
-            self.latencies[region] = {}
-        self.latencies[region][info.name] = latency
-        self.avg_latencies[region] = round(mean(self.latencies[region].values()))
-        ranked_items = sorted(self.avg_latencies.items(), key=lambda item:item[1])
-        self.ranked_neighbours = dict(ranked_items)
-        if self.region in self.ranked_neighbours:
-            del self.ranked_neighbours[self.region]
+            self.observe_failure(info)
+        if rerank:
+            self.rerank()
+
+    # MEMO: probes report here, and so do subclasses with the latency of their real traffic
+    def observe_latency(self, info: ServiceInfo, seconds):
+        self.latencies.observe(self.service_region(info), info.name, seconds * 1000)
+
+    def observe_failure(self, info: ServiceInfo):
+        self.latencies.fail(self.service_region(info), info.name)
+
+    def rerank(self):
+        # MEMO: rankings are rebuilt aside and swapped in whole, readers never see them half updated
+        ranked_services = {}
+        avg_latencies = {}
+        for region, services in self.services.items():
+            ranked_services[region] = sorted(services, key=lambda info: self.latencies.node_score(region, info.name))
+            score = self.latencies.region_score(region)
+            avg_latencies[region] = float('inf') if score is None else round(score)
+        ranked_items = sorted(avg_latencies.items(), key=lambda item:item[1])
+        ranked_neighbours = dict(ranked_items)
+        if self.region in ranked_neighbours:
+            del ranked_neighbours[self.region]
+        self.ranked_services = ranked_services
+        self.avg_latencies = avg_latencies
+        self.ranked_neighbours = ranked_neighbours
+        self.ranked_regions = tuple(ranked_neighbours)
+
+    def _probe(self):
+        # MEMO: jittered, so that the nodes and clients of a cluster don't all probe in the same instant
+        while not self.probe_stop.wait(self.probe_interval * random.uniform(1 - self.probe_jitter, 1 + self.probe_jitter)):
+            for services in self.services.values():
+                for info in services:
+                    self.ping(info, rerank=False)
+            self.rerank()
+
+    def stop_probing(self):
+        self.probe_stop.set()
+
+    def latency_info(self):
+        return self.latencies.info()
 
     def cluster_info(self):
         self.log("cluster info:")
         for region, services in self.services.items():
-            self.log(f"    - {region}  |  avg latency: {self.avg_latencies[region]}")
+            self.log(f"    - {region}  |  avg latency: {self.avg_latencies.get(region)}")
             info: ServiceInfo
             for info in services:
                 url = self.service_base_url(info)
@@ -73,16 +173,14 @@ class ZerocacheListener(ServiceListener):
         self_class = type(self).__name__
         self.log(f"({self_class}) Service \"{name}\" removed")
         # ----
-        info: ServiceInfo
-        region: str
-        regions = list(self.services.keys())
-        for region in regions:
-            for info in self.services[region]:
-                if info.name == name:
-                    self.services[region].remove(info)
-                    if len(self.services[region]) == 0:
-                        del self.services[region]
-        regions = list(self.services.keys())
+        node = self.registry.remove(name)
+        if node is not None:
+            old_ring = self.ring(node.region)
+            self.rings[node.region] = old_ring.without_node(name)
+            self.ring_changed(node.region, old_ring, self.rings[node.region])
+            self.latencies.forget(node.region, name)
+        self.rerank()
+        self.pool.close(name)
         self.cluster_info()
 
     def add_service(self, zc: Zeroconf, type_: str, name: str) -> None:
@@ -91,9 +189,13 @@ class ZerocacheListener(ServiceListener):
         info = zc.get_service_info(type_, name)
         self.log(f"({self_class}) Service \"{name}\" added, service info: {info}")
         # ----
-        region = str(info.properties.get(b'region').decode('utf-8'))
-        if region not in self.services.keys():
-            self.services[region] = []
-        self.services[region].append(info)
+        self.service_added(info)
         self.ping(info)
         self.cluster_info()
+
+    def service_added(self, info: ServiceInfo):
+        region = str(info.properties.get(b'region').decode('utf-8'))
+        self.registry.add(ZerocacheNode(info, region, self.pool.open(info.name), self.latencies.stats(region, info.name)))
+        old_ring = self.ring(region)
+        self.rings[region] = old_ring.with_node(info.name)
+        self.ring_changed(region, old_ring, self.rings[region])
@@ -0,0 +1,188 @@
+import random
+import time
+from io import BytesIO
+from threading import Lock
+from urllib.parse import unquote, urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+from urllib3._collections import HTTPHeaderDict
+from zeroconf import ServiceInfo
+
+# MEMO: a cluster in a single process. Listeners given network=ZerocacheMemoryNetwork() discover each other
+#       through it rather than through multicast (it stands in for their Zeroconf instance), and their pooled
+#       sessions send requests through it rather than over sockets: each request is handed to the Bottle app
+#       of the node at its address, as a WSGI call. Links can be slowed down, made lossy, or cut.
+class ZerocacheMemoryNetwork:
+    def __init__(self, latency=0.0, loss=0.0, seed=None, sleep=time.sleep):
+        # MEMO: latency is seconds, or a function of (source region, target region) returning seconds;
+        #       loss is the probability that a request is dropped (the sender times out)
+        self.latency = latency
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.sleep = sleep
+        self.lock = Lock()
+        self.services = {}
+        self.apps = {}
+        self.listeners = []
+        self.partitions = set()
+        self.requests = 0
+        self.dropped = 0
+
+    # MEMO: the subset of Zeroconf that the listeners and servers use
+
+    def register_service(self, info: ServiceInfo):
+        with self.lock:
+            self.services[info.name] = info
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener.add_service(self, info.type, info.name)
+
+    def unregister_service(self, info: ServiceInfo):
+        with self.lock:
+            self.services.pop(info.name, None)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener.remove_service(self, info.type, info.name)
+
+    def get_service_info(self, type_, name):
+        return self.services.get(name)
+
+    def browse(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+            services = list(self.services.values())
+        for info in services:
+            listener.add_service(self, info.type, info.name)
+
+    def forget(self, listener):
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    # MEMO: servers attach their app to their address once it is ready to serve, and detach it when stopped
+
+    def attach(self, address, port, app, region, name):
+        with self.lock:
+            self.apps[(address, port)] = (app, region, name)
+
+    def detach(self, address, port):
+        with self.lock:
+            self.apps.pop((address, port), None)
+
+    # MEMO: faults, a and b are region or node (service) names
+
+    def partition(self, a, b):
+        with self.lock:
+            self.partitions.add(frozenset((a, b)))
+
+    def heal(self, a=None, b=None):
+        with self.lock:
+            if a is None:
+                self.partitions.clear()
+            else:
+                self.partitions.discard(frozenset((a, b)))
+
+    def cut(self, source, target):
+        return any(frozenset((a, b)) in self.partitions for a in source for b in target if a != b)
+
+    def delay(self, source_region, target_region):
+        if callable(self.latency):
+            return self.latency(source_region, target_region)
+        return self.latency
+
+    def adapter(self, listener):
+        return ZerocacheMemoryAdapter(self, listener)
+
+    def info(self):
+        with self.lock:
+            return {
+                "services": len(self.services)
+                , "listeners": len(self.listeners)
+                , "partitions": [sorted(pair) for pair in self.partitions]
+                , "requests": self.requests
+                , "dropped": self.dropped
+            }
+
+def environ_for(request: requests.PreparedRequest, address, port):
+    url = urlsplit(request.url)
+    body = request.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    environ = {
+        'REQUEST_METHOD': request.method
+        , 'SCRIPT_NAME': ''
+        , 'PATH_INFO': unquote(url.path).encode('utf-8').decode('latin-1')
+        , 'QUERY_STRING': url.query
+        , 'SERVER_NAME': address
+        , 'SERVER_PORT': str(port)
+        , 'SERVER_PROTOCOL': 'HTTP/1.1'
+        , 'CONTENT_LENGTH': str(len(body))
+        , 'wsgi.version': (1, 0)
+        , 'wsgi.url_scheme': 'http'
+        , 'wsgi.input': BytesIO(body)
+        , 'wsgi.errors': BytesIO()
+        , 'wsgi.multithread': True
+        , 'wsgi.multiprocess': False
+        , 'wsgi.run_once': False
+    }
+    for (header, value) in request.headers.items():
+        name = header.upper().replace('-', '_')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            if name == 'CONTENT_TYPE':
+                environ[name] = value
+            continue
+        environ[f'HTTP_{name}'] = value
+    return environ
+
+def read_timeout(timeout):
+    if isinstance(timeout, tuple):
+        timeout = timeout[1]
+    return timeout
+
+# MEMO: mounted on the pooled sessions of one listener in place of the socket adapter; responses are built by
+#       requests itself from the WSGI answer, content decoding and streaming behave as over HTTP
+class ZerocacheMemoryAdapter(HTTPAdapter):
+    def __init__(self, network: ZerocacheMemoryNetwork, listener):
+        super().__init__()
+        self.network = network
+        self.listener = listener
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        network = self.network
+        url = urlsplit(request.url)
+        (address, port) = (url.hostname, url.port or 80)
+        target = network.apps.get((address, port))
+        if target is None:
+            raise requests.ConnectionError(f'nothing serves {address}:{port}', request=request)
+        (app, target_region, target_name) = target
+        source = (self.listener.region, getattr(self.listener, 'svcname', None))
+        timeout = read_timeout(timeout)
+        with network.lock:
+            network.requests += 1
+            dropped = network.cut(source, (target_region, target_name)) or (network.loss and network.random.random() < network.loss)
+            if dropped:
+                network.dropped += 1
+        delay = network.delay(source[0], target_region)
+        if dropped or (timeout is not None and delay > timeout):
+            network.sleep(timeout or 0)
+            raise requests.ReadTimeout(f'{address}:{port} did not answer within {timeout}s', request=request)
+        if delay:
+            network.sleep(delay)
+        answer = {}
+        def start_response(status, headers, exc_info=None):
+            answer['status'] = status
+            answer['headers'] = headers
+        result = app(environ_for(request, address, port), start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        (code, _, reason) = answer['status'].partition(' ')
+        raw = HTTPResponse(body=BytesIO(body), headers=HTTPHeaderDict(answer['headers']), status=int(code), reason=reason
+            , preload_content=False, decode_content=True, request_url=request.url)
+        response = self.build_response(request, raw)
+        if not stream:
+            response.content
+        return response
@@ -0,0 +1,44 @@
+from hashlib import blake2b
+
+FANOUT = 16
+DEPTH = 3
+
+def key_leaf(key, leaves):
+    return int.from_bytes(blake2b(key.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'big') % leaves
+
+def version_hash(key, stamp, deleted):
+    version = f'{key}\0{stamp!r}\0{1 if deleted else 0}'.encode('utf-8', 'surrogatepass')
+    return int.from_bytes(blake2b(version, digest_size=8).digest(), 'big')
+
+# MEMO: a hash tree of the versions (key, stamp, deleted, region) of a cache. Keys are spread over fanout**depth
+#       leaves by hash; a leaf's hash XORs the hashes of its versions (so their order doesn't matter), every other
+#       node hashes its children. Two nodes compare trees top down, only descending into the branches that
+#       differ: the exchange grows with how many keys differ, not with how many keys there are.
+class ZerocacheMerkleTree:
+    def __init__(self, versions, fanout=FANOUT, depth=DEPTH):
+        self.fanout = fanout
+        self.depth = depth
+        leaves = fanout ** depth
+        self.buckets = {}
+        sums = [0] * leaves
+        for version in versions:
+            leaf = key_leaf(version[0], leaves)
+            sums[leaf] ^= version_hash(version[0], version[1], version[2])
+            self.buckets.setdefault(leaf, []).append(version)
+        self.levels = [None] * (depth + 1)
+        self.levels[depth] = [digest.to_bytes(8, 'big') for digest in sums]
+        for level in range(depth - 1, -1, -1):
+            below = self.levels[level + 1]
+            self.levels[level] = [
+                blake2b(b''.join(below[index * fanout:(index + 1) * fanout]), digest_size=8).digest()
+                for index in range(fanout ** level)
+            ]
+
+    def hashes(self, level, indexes):
+        return [self.levels[level][index].hex() for index in indexes]
+
+    def children(self, indexes):
+        return [index * self.fanout + child for index in indexes for child in range(self.fanout)]
+
+    def versions(self, leaves):
+        return [version for leaf in leaves for version in self.buckets.get(leaf, ())]
@@ -0,0 +1,136 @@
+from bisect import bisect_left
+from threading import Lock
+
+# MEMO: upper bounds of the latency buckets in seconds, those of the Prometheus client libraries
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HELP = {
+    'zerocache_http_requests_total': 'Requests served, by route, method and status'
+    , 'zerocache_http_request_duration_seconds': 'Time spent serving requests, by route and method'
+    , 'zerocache_cache_hits_total': 'Lookups that found a live entry'
+    , 'zerocache_cache_misses_total': 'Lookups that found no live entry'
+    , 'zerocache_cache_evictions_total': 'Entries pushed out to make room'
+    , 'zerocache_cache_expirations_total': 'Entries dropped for age'
+    , 'zerocache_cache_entries': 'Entries held'
+    , 'zerocache_cache_bytes': 'Bytes of values held'
+    , 'zerocache_cache_tombstones': 'Deletes remembered for anti-entropy'
+    , 'zerocache_replication_duration_seconds': 'Time taken by replication requests, by peer'
+    , 'zerocache_replication_failures_total': 'Replication requests that failed or were dropped, by peer'
+    , 'zerocache_replication_queue_depth': 'Replication requests waiting for a worker'
+    , 'zerocache_ping_duration_seconds': 'Round trip of the latency probes, by region'
+    , 'zerocache_ping_failures_total': 'Latency probes that failed, by region'
+    , 'zerocache_client_request_duration_seconds': 'Time taken by client requests, by node and method'
+    , 'zerocache_client_request_failures_total': 'Client requests that failed, by node and method'
+    , 'zerocache_client_gets_total': 'Client reads, by the fallback tier that answered (near, local, remote) or miss'
+}
+
+# MEMO: cumulative counts per upper bound, like Prometheus histograms; the last bucket is +Inf
+class ZerocacheHistogram:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def copy(self):
+        histogram = ZerocacheHistogram(self.bounds)
+        histogram.counts = list(self.counts)
+        histogram.sum = self.sum
+        histogram.count = self.count
+        return histogram
+
+    def buckets(self):
+        total = 0
+        for (bound, count) in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            yield (bound, total)
+
+    def quantile(self, q):
+        # MEMO: estimated the way histogram_quantile() does, interpolating inside the bucket the rank falls in
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        lower = 0.0
+        seen = 0
+        for (bound, count) in zip(self.bounds, self.counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.bounds[-1]
+
+# MEMO: counters and histograms keyed by (name, labels), labels a tuple of (label, value) pairs; values read
+#       elsewhere (cache sizes, queue depths) are passed to render() as they are scraped
+class ZerocacheMetrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels=(), amount=1):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + amount
+
+    def observe(self, name, labels, seconds):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = ZerocacheHistogram(self.buckets)
+            histogram.observe(seconds)
+
+    def counter(self, name, labels=()):
+        with self.lock:
+            return self.counters.get((name, labels), 0)
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: histogram.copy() for (key, histogram) in self.histograms.items()}
+        return (counters, histograms)
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for (_, value) in pairs)
+    return '{' + ','.join(f'{label}="{value}"' for ((label, _), value) in zip(pairs, escaped)) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# MEMO: the text exposition format, one family per name; gauges is a list of (name, type, [(labels, value)])
+def render(metrics: ZerocacheMetrics, gauges=()):
+    (counters, histograms) = metrics.snapshot()
+    families = {}
+    for ((name, labels), value) in sorted(counters.items()):
+        families.setdefault(name, ('counter', []))[1].append((labels, value))
+    for ((name, labels), histogram) in sorted(histograms.items(), key=lambda item: item[0]):
+        families.setdefault(name, ('histogram', []))[1].append((labels, histogram))
+    for (name, kind, samples) in gauges:
+        families.setdefault(name, (kind, []))[1].extend(samples)
+    lines = []
+    for (name, (kind, samples)) in families.items():
+        if name in HELP:
+            lines.append(f'# HELP {name} {HELP[name]}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (labels, value) in samples:
+            if kind != 'histogram':
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                continue
+            for (bound, count) in value.buckets():
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", format_value(bound))])} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(value.sum)}')
+            lines.append(f'{name}_count{format_labels(labels)} {value.count}')
+    return '\n'.join(lines) + '\n'
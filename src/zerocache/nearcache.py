@@ -0,0 +1,59 @@
+from threading import Lock
+from time import monotonic
+from cachetools import TLRUCache
+
+# MEMO: an in-process TLRU in front of the network, bounded in bytes of values rather than entries.
+#       Entries live for the expiry they were written with, but never longer than max_staleness,
+#       since writes made by other processes can't invalidate it.
+class ZerocacheNearCache:
+    def __init__(self, max_bytes=16 * 1024 * 1024, max_staleness=1.0):
+        self.max_staleness = max_staleness
+        self.cache = TLRUCache(maxsize=max_bytes, ttu=self.ttu, timer=monotonic, getsizeof=self.getsizeof)
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def ttu(self, key, entry, now):
+        return now + min(entry[1], self.max_staleness)
+
+    def getsizeof(self, entry):
+        return len(entry[0])
+
+    def get(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, expiry=None):
+        if not isinstance(value, bytes):
+            self.invalidate(key)
+            return
+        expiry = self.max_staleness if expiry is None else expiry
+        with self.lock:
+            try:
+                self.cache[key] = (value, expiry)
+            except ValueError:
+                # MEMO: cachetools refuses values larger than the whole budget
+                self.cache.pop(key, None)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def info(self):
+        with self.lock:
+            return {
+                "hits": self.hits
+                , "misses": self.misses
+                , "maxsize": self.cache.maxsize
+                , "currsize": self.cache.currsize
+                , "entries": len(self.cache)
+            }
@@ -0,0 +1,80 @@
+from threading import Lock
+from time import monotonic
+import requests
+from requests.adapters import HTTPAdapter
+
+# MEMO: persistent (keep-alive) HTTP sessions, one per node, keyed by the node's zeroconf service name
+class ZerocachePool:
+    def __init__(self, maxsize=8, idle_timeout=30.0, adapter=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        # MEMO: optional, a transport adapter mounted instead of the socket one (see memory)
+        self.adapter = adapter
+        self.sessions = {}
+        self.last_used = {}
+        self.last_reaped = monotonic()
+        self.lock = Lock()
+
+    def _new_session(self):
+        session = requests.Session()
+        if self.adapter is not None:
+            # MEMO: no proxy applies to an in-process transport, and looking them up in the environment
+            #       would cost more than the request itself
+            session.trust_env = False
+        adapter = self.adapter or HTTPAdapter(pool_connections=1, pool_maxsize=self.maxsize)
+        session.mount('http://', adapter)
+        return session
+
+    def open(self, name):
+        with self.lock:
+            if name not in self.sessions:
+                self.sessions[name] = self._new_session()
+            self.last_used[name] = monotonic()
+            return self.sessions[name]
+
+    def session(self, name) -> requests.Session:
+        now = monotonic()
+        with self.lock:
+            session = self.sessions.get(name)
+            if session is None:
+                # MEMO: a node that was never announced (or already removed) still gets a session, it is reaped once idle
+                session = self.sessions[name] = self._new_session()
+            self.last_used[name] = now
+        if now - self.last_reaped > self.idle_timeout / 2:
+            self.reap(now)
+        return session
+
+    def touch(self, name):
+        # MEMO: for callers holding a session already (see registry), no lock: a single dict store, which the
+        #       reaper tolerates
+        now = monotonic()
+        self.last_used[name] = now
+        if now - self.last_reaped > self.idle_timeout / 2:
+            self.reap(now)
+
+    def reap(self, now=None):
+        # MEMO: closing a session only drops its idle sockets, the session itself stays usable and reconnects lazily
+        now = monotonic() if now is None else now
+        self.last_reaped = now
+        with self.lock:
+            idle = [name for name, used in list(self.last_used.items()) if now - used > self.idle_timeout]
+            sessions = [self.sessions[name] for name in idle if name in self.sessions]
+            for name in idle:
+                self.last_used.pop(name, None)
+        for session in sessions:
+            session.close()
+
+    def close(self, name):
+        with self.lock:
+            session = self.sessions.pop(name, None)
+            self.last_used.pop(name, None)
+        if session is not None:
+            session.close()
+
+    def close_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+            self.last_used.clear()
+        for session in sessions:
+            session.close()
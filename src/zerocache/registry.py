@@ -0,0 +1,56 @@
+import socket
+from threading import Lock
+from zeroconf import ServiceInfo
+from .latency import ZerocacheLatencyStats
+
+# MEMO: what the request path needs to know of a node, worked out once when the node is announced: its region,
+#       its base URL, its pooled session and its latency stats
+class ZerocacheNode:
+    __slots__ = ('info', 'name', 'region', 'base_url', 'session', 'stats')
+
+    def __init__(self, info: ServiceInfo, region, session=None, stats: ZerocacheLatencyStats = None):
+        self.info = info
+        self.name = info.name
+        self.region = region
+        self.base_url = f"http://{socket.inet_ntoa(info.addresses[0])}:{info.port}"
+        self.session = session
+        self.stats = stats
+
+# MEMO: never modified once published. Nodes by name, and by region in the order they were announced;
+#       services holds their ServiceInfo by region, the shape ZerocacheListener.services always had.
+class ZerocacheRegistrySnapshot:
+    __slots__ = ('by_name', 'by_region', 'services')
+
+    def __init__(self, by_name):
+        self.by_name = by_name
+        by_region = {}
+        for node in by_name.values():
+            by_region.setdefault(node.region, []).append(node)
+        self.by_region = {region: tuple(nodes) for (region, nodes) in by_region.items()}
+        self.services = {region: tuple(node.info for node in nodes) for (region, nodes) in by_region.items()}
+
+# MEMO: copy-on-write; readers take the current snapshot, a single attribute read, and use it without locking.
+#       Announcements and retirements (rare) build the next snapshot under the lock and swap it in whole.
+class ZerocacheRegistry:
+    def __init__(self):
+        self.lock = Lock()
+        self.snapshot = ZerocacheRegistrySnapshot({})
+
+    def add(self, node: ZerocacheNode):
+        with self.lock:
+            by_name = dict(self.snapshot.by_name)
+            # MEMO: a node announced again replaces its record, and keeps its place
+            by_name[node.name] = node
+            self.snapshot = ZerocacheRegistrySnapshot(by_name)
+
+    def remove(self, name) -> ZerocacheNode:
+        with self.lock:
+            if name not in self.snapshot.by_name:
+                return None
+            by_name = dict(self.snapshot.by_name)
+            node = by_name.pop(name)
+            self.snapshot = ZerocacheRegistrySnapshot(by_name)
+            return node
+
+    def node(self, name) -> ZerocacheNode:
+        return self.snapshot.by_name.get(name)
@@ -0,0 +1,131 @@
+from queue import Queue, Full, Empty
+from threading import Thread, Lock, Event
+from time import perf_counter
+
+from .metrics import ZerocacheMetrics
+from .pool import ZerocachePool
+
+ACK_LOCAL = 'local'
+ACK_QUORUM = 'quorum'
+ACK_ALL = 'all'
+ACK_MODES = (ACK_LOCAL, ACK_QUORUM, ACK_ALL)
+
+# MEMO: tracks the acknowledgements of a single fan-out (one write, many peers)
+class ZerocacheReplicationTask:
+    def __init__(self, required, pending):
+        self.required = required
+        self.pending = pending
+        self.acks = 0
+        self.failures = 0
+        self.lock = Lock()
+        self.event = Event()
+        if self.required <= 0 or self.pending < self.required:
+            self.event.set()
+
+    def done(self, ok, counted=True):
+        with self.lock:
+            if counted:
+                self.pending -= 1
+                if ok:
+                    self.acks += 1
+                else:
+                    self.failures += 1
+            # MEMO: wake the writer as soon as the outcome is known, either enough acks or too many failures
+            if self.acks >= self.required or self.acks + self.pending < self.required:
+                self.event.set()
+
+    def wait(self, timeout):
+        self.event.wait(timeout)
+        with self.lock:
+            return self.acks >= self.required
+
+class ZerocacheReplicator:
+    def __init__(self, pool: ZerocachePool, workers=8, queue_size=1024, timeout=0.5, metrics: ZerocacheMetrics = None):
+        self.pool = pool
+        # MEMO: optional, gets the latency and the failures of every send, per peer
+        self.metrics = metrics
+        self.timeout = timeout
+        self.queue = Queue(maxsize=queue_size)
+        self.lock = Lock()
+        self.sent = 0
+        self.failures = 0
+        self.dropped = 0
+        self.peer_failures = {}
+        self.stopping = Event()
+        self.workers = [Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    # MEMO: sends is a list of (peer name, http method, url, body, counted towards the acknowledgement, headers)
+    def submit(self, sends, required=0) -> ZerocacheReplicationTask:
+        task = ZerocacheReplicationTask(required, sum(1 for send in sends if send[4]))
+        for (name, method, url, data, counted, headers) in sends:
+            try:
+                if self.stopping.is_set():
+                    raise Full()
+                self.queue.put_nowait((name, method, url, data, counted, headers, task))
+            except Full:
+                with self.lock:
+                    self.dropped += 1
+                    self.peer_failures[name] = self.peer_failures.get(name, 0) + 1
+                if self.metrics is not None:
+                    self.metrics.inc('zerocache_replication_failures_total', (('peer', name),))
+                task.done(False, counted)
+        return task
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            (name, method, url, data, counted, headers, task) = item
+            if self.stopping.is_set():
+                task.done(False, counted)
+                return
+            ok = False
+            t0 = perf_counter()
+            try:
+                response = self.pool.session(name).request(method, url, data=data, headers=headers, timeout=self.timeout)
+                ok = response.status_code < 500
+            except:
+                pass
+            if self.metrics is not None:
+                self.metrics.observe('zerocache_replication_duration_seconds', (('peer', name),), perf_counter() - t0)
+                if not ok:
+                    self.metrics.inc('zerocache_replication_failures_total', (('peer', name),))
+            with self.lock:
+                self.sent += 1
+                if not ok:
+                    self.failures += 1
+                    self.peer_failures[name] = self.peer_failures.get(name, 0) + 1
+            task.done(ok, counted)
+
+    def stop(self):
+        # MEMO: never blocks, even with a full queue or workers stuck on a slow peer. The queued sends are given up,
+        #       so that writers waiting on their acknowledgement wake up, then each idle worker gets its sentinel.
+        self.stopping.set()
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                break
+            if item is not None:
+                (_, _, _, _, counted, _, task) = item
+                task.done(False, counted)
+        for _ in self.workers:
+            try:
+                self.queue.put_nowait(None)
+            except Full:
+                break
+
+    def info(self):
+        with self.lock:
+            return {
+                "queue_depth": self.queue.qsize()
+                , "queue_maxsize": self.queue.maxsize
+                , "workers": len(self.workers)
+                , "sent": self.sent
+                , "failures": self.failures
+                , "dropped": self.dropped
+                , "peer_failures": dict(self.peer_failures)
+            }
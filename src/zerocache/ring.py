@@ -0,0 +1,46 @@
+from bisect import bisect
+from hashlib import md5
+
+def ring_hash(value: str) -> int:
+    # MEMO: must be stable across processes, unlike hash(), every client and node has to agree on it
+    return int.from_bytes(md5(value.encode('utf-8')).digest()[:8], 'big')
+
+# MEMO: an immutable consistent-hash ring, each node placed at `vnodes` points. Changes build a new ring,
+#       which is swapped in as a whole, so readers never need a lock. When a node joins or leaves, only
+#       the keys of the ranges next to its points change owners.
+class ZerocacheHashRing:
+    def __init__(self, names=(), vnodes=64):
+        self.vnodes = vnodes
+        self.names = frozenset(names)
+        points = []
+        for name in self.names:
+            for index in range(vnodes):
+                points.append((ring_hash(f'{name}#{index}'), name))
+        points.sort()
+        self.points = [point for (point, _) in points]
+        self.point_names = [name for (_, name) in points]
+
+    def with_node(self, name):
+        return ZerocacheHashRing(self.names | {name}, self.vnodes)
+
+    def without_node(self, name):
+        return ZerocacheHashRing(self.names - {name}, self.vnodes)
+
+    def __len__(self):
+        return len(self.names)
+
+    def owners(self, key, replicas=1):
+        # MEMO: the first `replicas` distinct nodes found walking clockwise from the key's point
+        if not self.points:
+            return []
+        replicas = min(replicas, len(self.names))
+        owners = []
+        start = bisect(self.points, ring_hash(key))
+        count = len(self.points)
+        for offset in range(count):
+            name = self.point_names[(start + offset) % count]
+            if name not in owners:
+                owners.append(name)
+                if len(owners) == replicas:
+                    break
+        return owners
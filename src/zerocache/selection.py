@@ -0,0 +1,126 @@
+import random
+from threading import Lock
+from time import monotonic
+
+# MEMO: a node's breaker opens after `threshold` failures in a row, the node is then skipped for `backoff`
+#       seconds. Once they elapsed, a single trial request is let through (half-open): a success closes the
+#       breaker, a failure opens it again for twice as long, up to max_backoff.
+class ZerocacheCircuitBreaker:
+    def __init__(self, threshold=3, backoff=1.0, max_backoff=30.0):
+        self.threshold = threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.backoff = backoff
+        self.failures = 0
+        self.open_until = 0.0
+        self.lock = Lock()
+
+    def is_open(self):
+        return self.failures >= self.threshold
+
+    def is_available(self):
+        # MEMO: no side effect, for filtering and ordering nodes: closed, or open with its backoff elapsed
+        with self.lock:
+            return not self.is_open() or monotonic() >= self.open_until
+
+    def acquire_trial(self):
+        # MEMO: called right before a request is sent to the node. Half-open, the request is the trial, the next
+        #       ones skip the node until it succeeds or the backoff elapses again. False while the breaker is open.
+        with self.lock:
+            if not self.is_open():
+                return True
+            now = monotonic()
+            if now < self.open_until:
+                return False
+            self.open_until = now + self.backoff
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.backoff = self.base_backoff
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures == self.threshold:
+                self.open_until = monotonic() + self.backoff
+            elif self.failures > self.threshold:
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                self.open_until = monotonic() + self.backoff
+
+    def info(self):
+        with self.lock:
+            return {
+                "state": ('open' if monotonic() < self.open_until else 'half-open') if self.is_open() else 'closed'
+                , "failures": self.failures
+                , "backoff": self.backoff
+            }
+
+# MEMO: strategies order the available local nodes, the client tries the first two of them.
+#       `client` gives each strategy the in-flight request counts and latency EWMAs of the nodes.
+class ZerocacheRoundRobin:
+    def __init__(self):
+        self.index = 0
+
+    def order(self, services, client):
+        start = self.index % len(services)
+        self.index = start + 1
+        return services[start:] + services[:start]
+
+class ZerocacheFastest:
+    def order(self, services, client):
+        ranked = client.ranked_services.get(client.region) or []
+        rank = {info.name: index for index, info in enumerate(ranked)}
+        return sorted(services, key=lambda info: rank.get(info.name, len(rank)))
+
+class ZerocacheLeastOutstanding:
+    def order(self, services, client):
+        return sorted(services, key=lambda info: (client.inflight_requests(info), client.node_latency(info)))
+
+# MEMO: smooth weighted round-robin (as in nginx), weights are the inverse of the latency EWMA, so a node twice
+#       as fast gets twice the requests, without long runs on the same node
+class ZerocacheWeightedRoundRobin:
+    def __init__(self):
+        self.current = {}
+        self.lock = Lock()
+
+    def order(self, services, client):
+        weights = {info.name: 1.0 / max(client.node_latency(info), 0.001) for info in services}
+        total = sum(weights.values())
+        with self.lock:
+            for name, weight in weights.items():
+                self.current[name] = self.current.get(name, 0.0) + weight
+            for name in list(self.current):
+                if name not in weights:
+                    del self.current[name]
+            chosen = max(services, key=lambda info: self.current[info.name])
+            self.current[chosen.name] -= total
+        others = sorted((info for info in services if info is not chosen), key=lambda info: -weights[info.name])
+        return [chosen] + others
+
+# MEMO: power of two choices, two random nodes are compared on (in-flight + 1) * latency, the cheaper goes
+#       first. Avoids the herd behaviour of always picking the single best node.
+class ZerocachePowerOfTwo:
+    def order(self, services, client):
+        if len(services) < 2:
+            return list(services)
+        (a, b) = random.sample(services, 2)
+        cost = lambda info: (client.inflight_requests(info) + 1) * client.node_latency(info)
+        pair = [a, b] if cost(a) <= cost(b) else [b, a]
+        return pair + [info for info in services if info is not a and info is not b]
+
+SELECTION_STRATEGIES = {
+    'round_robin': ZerocacheRoundRobin
+    , 'fastest': ZerocacheFastest
+    , 'least_outstanding': ZerocacheLeastOutstanding
+    , 'weighted': ZerocacheWeightedRoundRobin
+    , 'p2c': ZerocachePowerOfTwo
+}
+
+def selection_strategy(selection):
+    if isinstance(selection, str):
+        if selection not in SELECTION_STRATEGIES:
+            raise ValueError(f"selection must be one of {tuple(SELECTION_STRATEGIES)}, or a strategy object")
+        return SELECTION_STRATEGIES[selection]()
+    return selection
@@ -0,0 +1,56 @@
+import pickle
+
+# MEMO: optional dependency, 'pip install zerocache[msgpack]'
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# MEMO: serializers turn the values of auto_zerocache functions into the bytes stored in the cache, and back:
+#       any object with dumps(value) -> bytes and loads(data) -> value will do
+
+class ZerocachePickleSerializer:
+    def __init__(self, protocol=5):
+        self.protocol = protocol
+
+    def dumps(self, value):
+        return pickle.dumps(value, protocol=self.protocol)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+# MEMO: compact and quick, but only for plain data (None, bools, numbers, strings, bytes, lists and dicts),
+#       tuples come back as lists
+class ZerocacheMsgpackSerializer:
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("the msgpack serializer needs 'msgpack', 'pip install zerocache[msgpack]'")
+
+    def dumps(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+# MEMO: for functions returning bytes (rendered pages, images...), stored as they are
+class ZerocacheBytesSerializer:
+    def dumps(self, value):
+        if not isinstance(value, (bytes, bytearray, memoryview)):
+            raise TypeError(f"the bytes serializer only stores bytes, not {type(value).__name__}")
+        return bytes(value)
+
+    def loads(self, data):
+        return data
+
+SERIALIZERS = {
+    'pickle': ZerocachePickleSerializer
+    , 'msgpack': ZerocacheMsgpackSerializer
+    , 'bytes': ZerocacheBytesSerializer
+}
+
+def serializer_for(serializer):
+    if isinstance(serializer, str):
+        if serializer not in SERIALIZERS:
+            raise ValueError(f"serializer must be one of {tuple(SERIALIZERS)}, or a serializer object")
+        return SERIALIZERS[serializer]()
+    return serializer
@@ -1,46 +1,212 @@
 # standard imports
+import io
 import json
+import logging
+import math
 import random
 import signal
 import socket
 import time
-from datetime import datetime, timedelta
-from threading import Thread
+from threading import Event, Thread
 from hashlib import md5
+from urllib.parse import urlencode
 
 # third party imports
-from cachetools import TLRUCache
-from bottle import Bottle, request, response
-import requests
+from bottle import Bottle, ServerAdapter, request, response
 from zeroconf import ServiceInfo
 
 # local imports
 from .listener import ZerocacheListener
+from .replication import ZerocacheReplicator, ACK_MODES, ACK_QUORUM, ACK_ALL
+from .batch import HEADER, pack_records, unpack_records, record_chunks, read_records
+from .store import ZerocacheEntry, ZerocacheStore, SIZE_BYTES
+from .leases import ZerocacheLeases
+from .compression import codec_for, compress, decompress, known_coding, accepted_codings
+from .snapshot import entry_record, record_entry, write_snapshot, read_snapshot
+from .antientropy import ZerocacheAntiEntropy
+from .metrics import ZerocacheMetrics, CONTENT_TYPE, render
+
+logger = logging.getLogger(__name__)
+
+SERVER_BACKENDS = ('paste', 'waitress', 'cheroot', 'wsgiref')
+
+# MEMO: the remote cache holds the keys of every other region alike, any region name other than the node's own
+#       lands there; this one stands for the whole remote cache, or for its entries of no known region
+REMOTE_REGION = '_remote'
+
+BODY_CHUNK_SIZE = 256 * 1024
+
+# MEMO: bottle's own PasteServer wraps the app in a TransLogger, which formats a log line for every request
+class ZerocachePasteServer(ServerAdapter):
+    def run(self, handler):
+        from paste import httpserver
+
+        # MEMO: paste writes the headers and the body separately, without TCP_NODELAY, Nagle's algorithm holds
+        #       the body back until the client's delayed ACK (~40ms) on every response that has a body
+        class NoDelayHandler(httpserver.WSGIHandler):
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        httpserver.serve(handler, host=self.host, port=str(self.port), handler=NoDelayHandler, **self.options)
+
+def parse_expiry(raw):
+    one_hour = 60 * 60 # 60 seconds x 60 minutes
+    try:
+        return max(min( int(raw), 99999999 ), 1) # maxes out at around 3.17 years, must be at least 1 second
+    except:
+        return one_hour
+
+def parse_delta(raw):
+    # MEMO: seconds the value took to compute, optional
+    try:
+        return max(min(float(raw), 99999999.0), 0.0)
+    except:
+        return None
+
+def parse_stamp(raw):
+    # MEMO: wall clock time of a write, given by the first node that got it, or now for a new write
+    try:
+        return float(raw)
+    except:
+        return time.time()
+
+def parse_tags(raw):
+    # MEMO: comma separated in query strings, a list in batch records; None when there are none
+    if not raw:
+        return None
+    tags = raw.split(',') if isinstance(raw, str) else raw
+    return tuple(str(tag) for tag in tags if tag) or None
+
+# MEMO: bodies are read straight from the WSGI input, in chunks, and joined once; bottle's request.body would first
+#       copy them into a BytesIO (or a temporary file, past MEMFILE_MAX) that read() then copies out again.
+#       Bodies without a length (chunked) are read from bottle's decoded copy, spooled to a temporary file.
+def body_stream():
+    length = request.content_length
+    if length < 0 or 'chunked' in request.get_header('Transfer-Encoding', '').lower():
+        body = request.body
+        length = body.seek(0, io.SEEK_END)
+        body.seek(0)
+        return (body, length)
+    return (request.environ['wsgi.input'], length)
+
+def read_chunks(stream, size, keep=True, chunk_size=BODY_CHUNK_SIZE):
+    # MEMO: with keep=False, the bytes are read and dropped, for the connection to stay usable
+    chunks = []
+    while size > 0:
+        chunk = stream.read(min(size, chunk_size))
+        if not chunk:
+            break
+        size -= len(chunk)
+        if keep:
+            chunks.append(chunk)
+    return chunks
+
+def read_body(limit=None):
+    # MEMO: None when the body is larger than limit
+    (stream, length) = body_stream()
+    if limit is not None and length > limit:
+        read_chunks(stream, length, keep=False)
+        return None
+    # MEMO: a single chunk is returned as it is, without a copy
+    return b''.join(read_chunks(stream, length))
+
+def read_batch_body(max_value_size=None):
+    # MEMO: a batch may hold up to max_value_size bytes per record on top of its manifest, which is read first to
+    #       count the records; None when the body (or the manifest itself) is larger than that
+    (stream, length) = body_stream()
+    if max_value_size is None or length < HEADER.size:
+        return b''.join(read_chunks(stream, length))
+    header = b''.join(read_chunks(stream, HEADER.size))
+    (head_size,) = HEADER.unpack(header)
+    if head_size > max_value_size:
+        read_chunks(stream, length - HEADER.size, keep=False)
+        return None
+    head = b''.join(read_chunks(stream, min(head_size, length - HEADER.size)))
+    try:
+        count = len(json.loads(head))
+    except:
+        # MEMO: left for unpack_records to refuse
+        count = 0
+    rest = length - HEADER.size - len(head)
+    if length > HEADER.size + head_size + count * max_value_size:
+        read_chunks(stream, rest, keep=False)
+        return None
+    return b''.join([header, head, *read_chunks(stream, rest)])
+
+def unpack_batch(body):
+    # MEMO: the records of a batch request, ValueError when it is malformed: truncated, or a manifest that isn't a list
+    #       of records with a string key (and when given, a numeric stamp, a string coding, tags as a list or a string)
+    try:
+        records = unpack_records(body)
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f'malformed batch manifest: {e!r}')
+    for (meta, _) in records:
+        if not isinstance(meta.get('key'), str) or not isinstance(meta.get('stamp', 0.0), (int, float)) \
+                or not isinstance(meta.get('coding') or '', str) or not isinstance(meta.get('tags') or '', (str, list)):
+            raise ValueError('malformed batch record')
+    return records
+
+def entry_headers(entry: ZerocacheEntry):
+    meta = entry.meta()
+    response.set_header('X-Zerocache-TTL', str(meta['ttl']))
+    response.set_header('Age', str(int(meta['age'])))
+    if entry.delta is not None:
+        response.set_header('X-Zerocache-Delta', str(entry.delta))
 
 class ZerocacheServer(ZerocacheListener):
-    def ttu(self, key, value, now: datetime):
-        one_hour = 60 * 60 # 60 seconds x 60 minutes
-        try:
-            expiry = max(min( int(request.query.get('expiry', one_hour)), 99999999 ), 1) # maxes out at around 3.17 years, must be at least 1 second
-        except:
-            expiry = one_hour
-        value = now + timedelta(seconds=expiry)
-        print('ttu...', str(value))
-        print(self)
-        return value
-
-    def __init__(self, address, port=6789, region=None):
-        super().__init__(region)
+    def __init__(self, address, port=6789, region=None, pool_maxsize=8, pool_idle_timeout=30.0, threadpool_workers=32, keepalive_timeout=60
+            , replication_workers=8, replication_queue_size=1024, replication_ack='local', replication_timeout=0.5
+            , local_maxsize=None, remote_maxsize=None, size_mode='entries', cache_shards=16, server_backend='paste', server_options=None
+            , partitioned=False, replicas=2, ring_vnodes=64, probe_interval=5.0, compression='deflate', compression_threshold=1024
+            , snapshot_path=None, snapshot_interval=None, bootstrap=False, bootstrap_timeout=10.0
+            , anti_entropy_interval=30.0, tombstone_ttl=300.0, network=None, max_value_size=64 * 1024 * 1024):
+        # MEMO: with size_mode='bytes', the maxsizes are budgets in bytes of values rather than entry counts, and have
+        #       no default: each of the cache_shards gets maxsize / cache_shards bytes, which also caps the largest
+        #       value it can hold (the entry counts 1024 and 4096 would leave 64 and 256 bytes per shard)
+        if size_mode == SIZE_BYTES and (local_maxsize is None or remote_maxsize is None):
+            raise ValueError("size_mode='bytes' needs local_maxsize and remote_maxsize, in bytes")
+        local_maxsize = 1024 if local_maxsize is None else local_maxsize
+        remote_maxsize = 4096 if remote_maxsize is None else remote_maxsize
+        # MEMO: set before the listener starts browsing, ring_changed() may be called right away
+        self.partitioned = partitioned
+        self.replicas = replicas
+        self.metrics = ZerocacheMetrics()
+        super().__init__(region, pool_maxsize=pool_maxsize, pool_idle_timeout=pool_idle_timeout, ring_vnodes=ring_vnodes
+            , probe_interval=probe_interval, network=network)
+        if replication_ack not in ACK_MODES:
+            raise ValueError(f"replication_ack must be one of {ACK_MODES}")
+        self.replication_ack = replication_ack
+        self.replication_timeout = replication_timeout
+        self.replicator = ZerocacheReplicator(self.pool, workers=replication_workers, queue_size=replication_queue_size, timeout=replication_timeout
+            , metrics=self.metrics)
         self.clients = {}
-        self.ttu_tmp = {}
-        self.local_cache = TLRUCache(maxsize=1024, ttu=self.ttu, timer=datetime.now)
-        self.local_cache_hits = 0
-        self.local_cache_misses = 0
-        self.remote_cache = TLRUCache(maxsize=4096, ttu=self.ttu, timer=datetime.now)
-        self.remote_cache_hits = 0
-        self.remote_cache_misses = 0
+        self.local_cache = ZerocacheStore(maxsize=local_maxsize, size_mode=size_mode, shards=cache_shards)
+        self.remote_cache = ZerocacheStore(maxsize=remote_maxsize, size_mode=size_mode, shards=cache_shards)
+        self.leases = ZerocacheLeases()
+        # MEMO: values written uncompressed (by older or non-compressing clients) are compressed here
+        self.codec = codec_for(compression)
+        self.compression_threshold = compression_threshold
+        # MEMO: bytes, as sent by the writer (compressed or not); larger values are refused with a 413, None for no limit
+        self.max_value_size = max_value_size
+        # MEMO: both caches are saved to snapshot_path on shutdown (and every snapshot_interval seconds), and
+        #       loaded back on start; with bootstrap, a node also copies the caches of a peer of its region
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_stop = Event()
+        self.bootstrap = bootstrap
+        self.bootstrap_timeout = bootstrap_timeout
+        # MEMO: deletes are remembered for tombstone_ttl seconds, which must outlast a few anti-entropy rounds
+        self.anti_entropy = ZerocacheAntiEntropy(self, interval=anti_entropy_interval)
+        self.tombstone_ttl = tombstone_ttl
         self.address = address
         self.port = port
+        if server_backend not in SERVER_BACKENDS:
+            raise ValueError(f"server_backend must be one of {SERVER_BACKENDS}")
+        self.server_backend = server_backend
+        self.server_options = server_options or {}
+        self.threadpool_workers = threadpool_workers
+        self.keepalive_timeout = keepalive_timeout
         svctype = '_server._geocache._tcp.local.'
         svcname = random.randbytes(4).hex() + '.' + svctype
         self.svcname = svcname
@@ -54,11 +220,22 @@ class ZerocacheServer(ZerocacheListener):
             , addresses = [socket.inet_aton(address)],
         )
         self.bottle_running = False
-        signal.signal(signal.SIGTERM, self.unregister)
-        signal.signal(signal.SIGQUIT, self.unregister)
-        signal.signal(signal.SIGHUP, self.unregister)
+        # MEMO: nodes of a memory network share their process, they are stopped with stop()
+        if network is None:
+            signal.signal(signal.SIGTERM, self.unregister)
+            signal.signal(signal.SIGQUIT, self.unregister)
+            signal.signal(signal.SIGHUP, self.unregister)
 
     def start(self):
+        self.load_snapshot()
+        if self.snapshot_path and self.snapshot_interval:
+            Thread(target=self._snapshot_loop, name='zerocache-snapshot', daemon=True).start()
+        if self.network is not None:
+            # MEMO: nothing to serve, the network calls the app in process; start() returns once registered
+            self.network.attach(self.address, self.port, self._bottle_app(), self.region, self.svcname)
+            self.bottle_running = True
+            self.register()
+            return
         reg_thread = Thread(target=self.register)
         reg_thread.start()
         try:
@@ -74,142 +251,668 @@ class ZerocacheServer(ZerocacheListener):
             try:
                 # MEMO: _bottle_init() sets bottle_running to True
                 if self.bottle_running:
-                    print('register... going')
+                    logger.info('register... going')
                     self.zeroconf.register_service(self.zeroconf_service_info)
                     self.registered = True
+                    self.anti_entropy.start()
+                    if self.bootstrap:
+                        Thread(target=self.bootstrap_from_peers, name='zerocache-bootstrap', daemon=True).start()
                 else:
-                    print('register... waiting')
+                    logger.debug('register... waiting')
                     time.sleep(delay)
                     delay = min(delay+0.25, 5.0)
             except:
                 pass
 
     def unregister(self, sig, frame):
-        print('unregister... invoked')
+        logger.debug('unregister... invoked')
         if self.registered:
-            print('unregister... happening')
+            logger.info('unregister... happening')
             self.registered = False
+            self.snapshot_stop.set()
+            self.anti_entropy.stop()
+            self.save_snapshot()
             self.zeroconf.unregister_service(self.zeroconf_service_info)
+            self.stop_probing()
+            self.replicator.stop()
+            self.pool.close_all()
+            if self.network is not None:
+                self.network.detach(self.address, self.port)
+                self.network.forget(self)
+                self.bottle_running = False
+                return
             signal.raise_signal(signal.SIGINT)
 
+    def stop(self):
+        self.unregister(None, None)
+
     def _service_info_properties(self):
         return {'region': self.region}
 
-    def _bottle_init(self):
+    def cache_records(self, wall=None):
+        now = time.monotonic()
+        for (cache, store) in (('local', self.local_cache), ('remote', self.remote_cache)):
+            for (key, entry) in store.items():
+                if entry.expires > now:
+                    yield (entry_record(cache, key, entry, now, wall), entry.value)
+
+    def scope_versions(self, scope, peer=None):
+        # MEMO: (key, stamp, deleted, region) of the entries and tombstones of a scope: the node's own region, another
+        #       region (its entries in the remote cache), or the whole remote cache (REMOTE_REGION); only the keys
+        #       shared with the peer the scope is compared with
+        if scope == self.region:
+            for (key, entry) in self.local_cache.items():
+                if self.shares(key, peer):
+                    yield (key, entry.stamp, False, self.region)
+            for (key, stamp, _) in self.local_cache.tombstones():
+                if self.shares(key, peer):
+                    yield (key, stamp, True, self.region)
+            return
+        for (key, entry) in self.remote_cache.items():
+            region = entry.region or REMOTE_REGION
+            if (scope == REMOTE_REGION or region == scope) and self.shares(key, peer):
+                yield (key, entry.stamp, False, region)
+        for (key, stamp, region) in self.remote_cache.tombstones():
+            region = region or REMOTE_REGION
+            if (scope == REMOTE_REGION or region == scope) and self.shares(key, peer):
+                yield (key, stamp, True, region)
+
+    def shares(self, key, peer=None):
+        # MEMO: whether both this node and the peer (a node name) own the key. Partitioned nodes only hold their slice
+        #       of the ring, comparing whole caches would pull every key onto every node. The peer's ownership is read
+        #       from the ring of its region, its nodes are assumed partitioned with the same replicas as this one.
+        if not self.partitioned:
+            return True
+        if not self.owns(key):
+            return False
+        node = self.registry.snapshot.by_name.get(peer) if peer is not None else None
+        if node is None:
+            return True
+        owners = self.ring(node.region).owners(key, self.replicas)
+        return len(owners) == 0 or peer in owners
+
+    def anti_entropy_targets(self):
+        # MEMO: a random peer of the region, for both caches; the representative of the region also checks the
+        #       region's entries against a random node of every other region
+        targets = []
+        own = self.services.get(self.region, [])
+        peers = [svc for svc in own if svc.name != self.svcname]
+        if peers:
+            peer = random.choice(peers)
+            targets.extend([(peer, self.region), (peer, REMOTE_REGION)])
+        if own and min(svc.name for svc in own) == self.svcname:
+            for (region, services) in self.services.items():
+                if region != self.region and services:
+                    targets.append((random.choice(services), self.region))
+        return targets
+
+    def restore(self, records, wall=None):
+        restored = 0
+        now = time.monotonic()
+        for (meta, value) in records:
+            entry = record_entry(meta, value, now, wall)
+            if entry is None or not self.owns(meta['key']):
+                continue
+            store = self.local_cache if meta.get('cache') == 'local' else self.remote_cache
+            try:
+                restored += store.add(meta['key'], entry)
+            except ValueError:
+                pass
+        return restored
+
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        try:
+            write_snapshot(self.snapshot_path, self.cache_records(time.time()))
+            logger.info('snapshot saved to %s', self.snapshot_path)
+        except:
+            logger.exception('snapshot to %s failed', self.snapshot_path)
+
+    def load_snapshot(self):
+        if not self.snapshot_path:
+            return
+        try:
+            restored = self.restore(read_snapshot(self.snapshot_path), time.time())
+            logger.info('%s entries restored from %s', restored, self.snapshot_path)
+        except:
+            logger.exception('restoring %s failed, starting cold', self.snapshot_path)
+
+    def _snapshot_loop(self):
+        while not self.snapshot_stop.wait(self.snapshot_interval):
+            self.save_snapshot()
+
+    def bootstrap_from_peers(self):
+        # MEMO: waits for the first peer of the region to show up, then streams its dump, fastest peers first
+        deadline = time.monotonic() + self.bootstrap_timeout
+        while time.monotonic() < deadline:
+            peers = [svc for svc in self.ranked_services.get(self.region) or self.services.get(self.region, []) if svc.name != self.svcname]
+            for peer in peers:
+                try:
+                    url = self.service_base_url(peer, '/_dump')
+                    with self.session_for(peer).get(url, stream=True, timeout=(0.5, self.bootstrap_timeout)) as dump:
+                        if dump.status_code != 200:
+                            continue
+                        restored = self.restore(read_records(dump.raw))
+                    logger.info('%s entries bootstrapped from %s', restored, peer.name)
+                    return
+                except:
+                    logger.warning('bootstrap from %s failed', peer.name)
+            time.sleep(0.25)
+        logger.info('no peer to bootstrap from')
+
+    def http_dump(self):
+        # MEMO: streamed, the values aren't joined into one more copy of the caches
+        chunks = record_chunks(self.cache_records())
+        response.content_type = 'application/octet-stream'
+        response.set_header('Content-Length', str(sum(len(chunk) for chunk in chunks)))
+        return iter(chunks)
+
+    def _server_adapter(self):
+        # MEMO: every backend keeps connections alive (HTTP/1.1) for the pooled clients and peers, serves them from
+        #       a pool of threadpool_workers threads, and drops idle sockets after keepalive_timeout
+        if self.server_backend == 'paste':
+            options = {'protocol_version': 'HTTP/1.1', 'use_threadpool': True, 'threadpool_workers': self.threadpool_workers, 'socket_timeout': self.keepalive_timeout}
+            adapter = ZerocachePasteServer
+        elif self.server_backend == 'waitress':
+            options = {'threads': self.threadpool_workers, 'channel_timeout': self.keepalive_timeout}
+            adapter = 'waitress'
+        elif self.server_backend == 'cheroot':
+            options = {'numthreads': self.threadpool_workers, 'timeout': self.keepalive_timeout}
+            adapter = 'cheroot'
+        else:
+            # MEMO: single threaded, for debugging only
+            options = {}
+            adapter = 'wsgiref'
+        options.update(self.server_options)
+        return (adapter, options)
+
+    def _bottle_app(self):
         self._app = Bottle()
+        self._app.install(self.timed)
         self._route()
+        return self._app
+
+    def _bottle_init(self):
+        self._bottle_app()
         self.bottle_running = True
-        self._app.run(server='paste', host=self.address, port=self.port, debug=True) # blocks until server is terminated
+        (adapter, options) = self._server_adapter()
+        logger.info('serving on %s:%s with %s', self.address, self.port, self.server_backend)
+        self._app.run(server=adapter, host=self.address, port=self.port, debug=False, quiet=True, **options) # blocks until server is terminated
         self.bottle_running = False
 
+    # MEMO: bottle plugin, counts and times every request under its route's rule (not its URL, keys would make
+    #       a label value each); streamed bodies are only timed until their first byte is ready
+    def timed(self, callback):
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            status = 500
+            try:
+                result = callback(*args, **kwargs)
+                status = response.status_code
+                return result
+            finally:
+                labels = (('route', request.route.rule), ('method', request.method))
+                self.metrics.observe('zerocache_http_request_duration_seconds', labels, time.perf_counter() - t0)
+                self.metrics.inc('zerocache_http_requests_total', labels + (('status', str(status)),))
+        return wrapper
+
     def _route(self):
+        # MEMO: batch routes come first, so that they win over the '/<region>/<key>' pattern
+        self._app.route('/_batch/<region>', method='POST', callback=self.http_get_many)
+        self._app.route('/_batch/<region>', method='PUT', callback=self.http_put_many)
+        self._app.route('/_batch/<region>', method='DELETE', callback=self.http_delete_many)
+        self._app.route('/_lease/<region>/<key>', method='POST', callback=self.http_acquire_lease)
+        self._app.route('/_lease/<region>/<key>', method='DELETE', callback=self.http_release_lease)
+        self._app.route('/_invalidate/<region>', method='POST', callback=self.http_invalidate)
         self._app.route('/<region>/<key>', method='GET', callback=self.http_get)
         self._app.route('/<region>/<key>', method='PUT', callback=self.http_put)
         self._app.route('/<region>/<key>', method='DELETE', callback=self.http_delete)
+        self._app.route('/_dump', method='GET', callback=self.http_dump)
+        self._app.route('/_sync/<scope>/tree', method='POST', callback=self.http_sync_tree)
+        self._app.route('/_sync/<scope>/versions', method='POST', callback=self.http_sync_versions)
         self._app.route('/ping', method='GET', callback=self.http_ping)
         self._app.route('/local_cache_info', method='GET', callback=self.local_cache_info)
         self._app.route('/remote_cache_info', method='GET', callback=self.remote_cache_info)
+        self._app.route('/replication_info', method='GET', callback=self.replication_info)
+        self._app.route('/latency_info', method='GET', callback=self.http_latency_info)
+        self._app.route('/lease_info', method='GET', callback=self.lease_info)
+        self._app.route('/anti_entropy_info', method='GET', callback=self.anti_entropy_info)
+        self._app.route('/metrics', method='GET', callback=self.http_metrics)
+
+    def observe_latency(self, info: ServiceInfo, seconds):
+        super().observe_latency(info, seconds)
+        self.metrics.observe('zerocache_ping_duration_seconds', (('region', self.service_region(info)),), seconds)
+
+    def observe_failure(self, info: ServiceInfo):
+        super().observe_failure(info)
+        self.metrics.inc('zerocache_ping_failures_total', (('region', self.service_region(info)),))
 
     def http_ping(self):
         return 'pong'
 
     def http_get(self, region, key):
-        if region == self.region:
-            if key in self.local_cache.keys():
-                self.local_cache_hits += 1
-                return self.local_cache[key]
-            else:
-                self.local_cache_misses += 1
-        if key in self.remote_cache.keys():
-            self.remote_cache_hits += 1
-            return self.remote_cache[key]
-        else:
-            self.remote_cache_misses += 1
-        response.status = 404
-        return None
-    
-    def http_put(self, region, key):
-        print('put:', region, key)
-        print(list(self.services.keys()))
-        self.ttu_tmp[key] = timedelta(hours=1)
-        if region == self.region:
-            self.local_cache[key] = request.body.read()
-        else:
-            self.remote_cache[key] = request.body.read()
+        entry = self.lookup_entry(region, key)
+        if entry is None:
+            response.status = 404
+            return None
+        entry_headers(entry)
+        response.set_header('Vary', 'Accept-Encoding')
+        return self.served_value(entry, response_header=True)
+
+    def served_value(self, entry: ZerocacheEntry, response_header=False):
+        # MEMO: compressed values go out as they are stored to readers that accept their coding. The stored bytes
+        #       are handed to the WSGI server as they are, it writes them to the socket without a copy.
+        if entry.coding is None:
+            return entry.value
+        if entry.coding in accepted_codings(request.get_header('Accept-Encoding')):
+            if response_header:
+                response.set_header('Content-Encoding', entry.coding)
+            return entry.value
+        return decompress(entry.value, entry.coding)
+
+    def encoded(self, value, coding=None):
+        if coding is None or coding == 'identity':
+            return compress(value, self.codec, self.compression_threshold)
+        return (value, coding)
+
+    def peer_sends(self, method, uri, data=None, query=None, names=None, headers=None):
+        sends = []
+        query = dict(query or {})
+        svc: ServiceInfo
+        for svc in self.services.get(self.region, []):
+            if svc.name != self.svcname and (names is None or svc.name in names):
+                url = self.service_base_url(svc, f"{uri}?{urlencode({**query, 'recurse': 0})}")
+                logger.debug('also %s -> %s %s', method, svc.name, url)
+                sends.append((svc.name, method, url, data, True, headers))
+        return sends
+
+    def region_sends(self, method, uri, data=None, query=None, headers=None):
+        sends = []
+        for other_region, services in self.services.items():
+            if other_region != self.region:
+                svc = services[random.randint(0, len(services)-1)]
+                url = self.service_base_url(svc, f"{uri}?{urlencode(query)}" if query else uri)
+                logger.debug('also %s cross-region -> %s %s', method, svc.name, url)
+                sends.append((svc.name, method, url, data, self.replication_ack == ACK_ALL, headers))
+        return sends
+
+    def replication_sends(self, method, region, uri, data=None, query=None, key=None, headers=None):
+        sends = []
         if request.query.get('recurse', '1') == '1':
-            svc: ServiceInfo
-            for svc in self.services[self.region]:
-                if svc.name != self.svcname:
-                    print('also put ->', svc.name, socket.inet_ntoa(svc.addresses[0]), svc.port)
-                    url = f"http://{socket.inet_ntoa(svc.addresses[0])}:{svc.port}/{region}/{key}?recurse=0"
-                    requests.put(url, data=request.body, timeout=0.5)
+            names = None
+            if self.partitioned and key is not None:
+                # MEMO: partitioned regions only spread a key to its ring owners
+                names = set(self.ring(self.region).owners(key, self.replicas))
+            sends.extend(self.peer_sends(method, uri, data, query, names, headers))
             if region == self.region:
-                print('also spread to other regions')
-                for other_region, services in self.services.items():
-                    if other_region != self.region:
-                        rng = random.randint(0, len(self.services[other_region])-1)
-                        svc = services[rng]
-                        print('also put cross-region ->', svc.name, socket.inet_ntoa(svc.addresses[0]), svc.port)
-                        url = f"http://{socket.inet_ntoa(svc.addresses[0])}:{svc.port}/{region}/{key}"
-                        requests.put(url, data=request.body, timeout=0.5)
+                sends.extend(self.region_sends(method, uri, data, query, headers))
+        return sends
 
-    def http_delete(self, region, key):
-        print("http_delete...")
+    def batch_replication_sends(self, method, region, records, body):
+        if not self.partitioned:
+            return self.replication_sends(method, region, f'/_batch/{region}', body)
+        sends = []
+        if request.query.get('recurse', '1') == '1':
+            # MEMO: each owner only gets the part of the batch it owns
+            per_owner = {}
+            for (meta, value) in records:
+                for name in self.ring(self.region).owners(meta['key'], self.replicas):
+                    if name != self.svcname:
+                        per_owner.setdefault(name, []).append((meta, value))
+            for name, owned in per_owner.items():
+                sends.extend(self.peer_sends(method, f'/_batch/{region}', pack_records(owned), names={name}))
+            if region == self.region:
+                sends.extend(self.region_sends(method, f'/_batch/{region}', body))
+        return sends
+
+    def owns(self, key):
+        if not self.partitioned:
+            return True
+        owners = self.ring(self.region).owners(key, self.replicas)
+        # MEMO: until the ring is known, keep everything
+        return len(owners) == 0 or self.svcname in owners
+
+    def ring_changed(self, region, old_ring, new_ring):
+        # MEMO: the browser starts before __init__ is done, nothing is held until the node is registered
+        if self.partitioned and region == self.region and getattr(self, 'registered', False):
+            # MEMO: not on the zeroconf thread, the handoff walks the whole cache
+            Thread(target=self.handoff, args=(old_ring, new_ring), daemon=True).start()
+
+    def handoff(self, old_ring, new_ring):
+        # MEMO: only keys whose owners changed move; each is sent by the first of its old owners still in the ring
+        now = time.monotonic()
+        per_target = {}
+        for (cache_region, cache) in ((self.region, self.local_cache), (REMOTE_REGION, self.remote_cache)):
+            for (key, entry) in cache.items():
+                region = entry.region or cache_region
+                old_owners = old_ring.owners(key, self.replicas)
+                senders = [name for name in old_owners if name in new_ring.names]
+                if not senders or senders[0] != self.svcname:
+                    continue
+                for name in new_ring.owners(key, self.replicas):
+                    if name not in old_owners:
+                        meta = {'key': key, 'expiry': max(1, math.ceil(entry.expires - now)), 'stamp': entry.stamp}
+                        if entry.delta is not None:
+                            meta['delta'] = entry.delta
+                        if entry.coding is not None:
+                            meta['coding'] = entry.coding
+                        if entry.tags:
+                            meta['tags'] = list(entry.tags)
+                        per_target.setdefault((name, region), []).append((meta, entry.value))
+        sends = []
+        for ((name, region), records) in per_target.items():
+            logger.info('handoff of %s keys to %s', len(records), name)
+            sends.extend(self.peer_sends('PUT', f'/_batch/{region}', pack_records(records), names={name}))
+        self.replicator.submit(sends)
+
+    # MEMO: returns False when the configured acknowledgement mode was not satisfied in time
+    def replicate(self, sends):
+        counted = sum(1 for send in sends if send[4])
+        if self.replication_ack == ACK_QUORUM:
+            # MEMO: a majority of the region's replicas, this node's own write included
+            required = (counted + 1) // 2
+        elif self.replication_ack == ACK_ALL:
+            required = counted
+        else:
+            required = 0
+        task = self.replicator.submit(sends, required)
+        return required == 0 or task.wait(self.replication_timeout)
+
+    def store(self, region, key, value, expiry, delta=None, coding=None, stamp=None, tags=None):
+        now = time.monotonic()
         if region == self.region:
-            if key in self.local_cache.keys():
-                print("deleting", region, key)
-                del self.local_cache[key]
-            else:
-                response.status = 404
+            entry = ZerocacheEntry(value, now + expiry, now, delta, coding, stamp, tags=tags)
         else:
-            print("deleting elsewhere...?", region, key)
-            if key in self.remote_cache.keys():
-                print("deleting elsewhere...!", region, key)
-                del self.remote_cache[key]
-        if request.query.get('recurse', '1') == '1':
-            svc: ServiceInfo
-            for svc in self.services[self.region]:
-                if svc.name != self.svcname:
-                    print('also delete ->', svc.name, socket.inet_ntoa(svc.addresses[0]), svc.port)
-                    url = f"http://{socket.inet_ntoa(svc.addresses[0])}:{svc.port}/{region}/{key}?recurse=0"
-                    requests.delete(url, timeout=0.5)
+            entry = ZerocacheEntry(value, now + expiry, now, delta, coding, stamp, region, tags)
+        try:
+            # MEMO: a version older than the one held (or than its delete) is dropped, that's not a failure
             if region == self.region:
-                print('also delete in other regions')
-                for other_region, services in self.services.items():
-                    if other_region != self.region:
-                        rng = random.randint(0, len(self.services[other_region])-1)
-                        svc = services[rng]
-                        print('also delete cross-region ->', svc.name, socket.inet_ntoa(svc.addresses[0]), svc.port)
-                        url = f"http://{socket.inet_ntoa(svc.addresses[0])}:{svc.port}/{region}/{key}"
-                        requests.delete(url, timeout=0.5)
+                self.local_cache.put(key, entry)
+            else:
+                self.remote_cache.put(key, entry)
+        except ValueError:
+            # MEMO: in size_mode='bytes', a value larger than the budget of a cache shard can't be stored
+            return False
+        return True
+
+    def lookup_entry(self, region, key) -> ZerocacheEntry:
+        if region == self.region:
+            entry = self.local_cache.get(key)
+            if entry is not None:
+                return entry
+        return self.remote_cache.get(key)
+
+    def lookup(self, region, key):
+        entry = self.lookup_entry(region, key)
+        if entry is None:
+            return None
+        return decompress(entry.value, entry.coding)
+
+    def evict(self, region, key, stamp=None):
+        stamp = time.time() if stamp is None else stamp
+        if region == self.region:
+            return self.local_cache.bury(key, stamp, self.tombstone_ttl)
+        return self.remote_cache.bury(key, stamp, self.tombstone_ttl, region)
+
+    def invalidate(self, region, tags=(), prefixes=(), stamp=None):
+        stamp = time.time() if stamp is None else stamp
+        if region == self.region:
+            return self.local_cache.invalidate(tags, prefixes, stamp, self.tombstone_ttl)
+        return self.remote_cache.invalidate(tags, prefixes, stamp, self.tombstone_ttl, region)
+
+    def http_put(self, region, key):
+        logger.debug('put: %s %s', region, key)
+        coding = request.get_header('Content-Encoding')
+        if not known_coding(coding):
+            response.status = 415
+            return None
+        value = read_body(self.max_value_size)
+        if value is None:
+            response.status = 413
+            return None
+        (value, coding) = self.encoded(value, coding)
+        expiry = parse_expiry(request.query.get('expiry'))
+        delta = parse_delta(request.query.get('delta'))
+        stamp = parse_stamp(request.query.get('stamp'))
+        tags = parse_tags(request.query.get('tags'))
+        if self.owns(key) and not self.store(region, key, value, expiry, delta, coding, stamp, tags):
+            response.status = 413
+            return None
+        query = {'expiry': expiry, 'stamp': stamp} if delta is None else {'expiry': expiry, 'delta': delta, 'stamp': stamp}
+        if tags:
+            query['tags'] = ','.join(tags)
+        # MEMO: peers and other regions get the value compressed, sent from the very buffer it is stored in
+        headers = None if coding is None else {'Content-Encoding': coding}
+        if not self.replicate(self.replication_sends('PUT', region, f'/{region}/{key}', value, query, key, headers)):
+            response.status = 504
+
+    def http_delete(self, region, key):
+        logger.debug('delete: %s %s', region, key)
+        stamp = parse_stamp(request.query.get('stamp'))
+        if not self.evict(region, key, stamp) and region == self.region:
+            response.status = 404
+        if not self.replicate(self.replication_sends('DELETE', region, f'/{region}/{key}', query={'stamp': stamp}, key=key)):
+            response.status = 504
+
+    def http_invalidate(self, region):
+        # MEMO: drops every entry of the region written with one of the tags, or whose key starts with one of the
+        #       prefixes, on every node of every region; the body is JSON {"tags": [...], "prefixes": [...]}.
+        #       The first node to get it stamps it, entries written after the stamp are kept.
+        body = read_body(self.max_value_size)
+        if body is None:
+            response.status = 413
+            return None
+        try:
+            query = json.loads(body)
+            tags = parse_tags(query.get('tags')) or ()
+            prefixes = tuple(str(prefix) for prefix in query.get('prefixes') or () if prefix)
+        except:
+            response.status = 400
+            return None
+        logger.debug('invalidate: %s tags %s prefixes %s', region, tags, prefixes)
+        query = {'tags': list(tags), 'prefixes': list(prefixes), 'stamp': parse_stamp(query.get('stamp'))}
+        dropped = self.invalidate(region, tags, prefixes, query['stamp'])
+        if not self.replicate(self.replication_sends('POST', region, f'/_invalidate/{region}', json.dumps(query))):
+            response.status = 504
+        response.content_type = 'application/json'
+        return json.dumps({'dropped': dropped})
+
+    def http_acquire_lease(self, region, key):
+        # MEMO: 200 when granted (or renewed, for the same owner), 409 while another owner holds the lease
+        try:
+            ttl = float(request.query.get('ttl', 10))
+        except ValueError:
+            ttl = 10.0
+        if not self.leases.acquire(f'{region}/{key}', request.query.get('owner', ''), ttl):
+            response.status = 409
+            return 'held\n'
+        return 'granted\n'
+
+    def http_release_lease(self, region, key):
+        if not self.leases.release(f'{region}/{key}', request.query.get('owner', '')):
+            response.status = 404
+        return None
+
+    def http_get_many(self, region):
+        body = read_batch_body(self.max_value_size)
+        if body is None:
+            response.status = 413
+            return None
+        try:
+            records = unpack_batch(body)
+        except ValueError:
+            response.status = 400
+            return None
+        hits = []
+        for (meta, _) in records:
+            entry = self.lookup_entry(region, meta['key'])
+            if entry is not None:
+                value = self.served_value(entry)
+                hit = {'key': meta['key'], **entry.meta(), 'stamp': entry.stamp}
+                if value is entry.value and entry.coding is not None:
+                    hit['coding'] = entry.coding
+                if entry.tags:
+                    hit['tags'] = list(entry.tags)
+                hits.append((hit, value))
+        response.content_type = 'application/octet-stream'
+        return pack_records(hits)
+
+    def http_put_many(self, region):
+        body = read_batch_body(self.max_value_size)
+        if body is None:
+            response.status = 413
+            return None
+        try:
+            records = unpack_batch(body)
+        except ValueError:
+            response.status = 400
+            return None
+        logger.debug('put many: %s %s', region, len(records))
+        if not all(known_coding(meta.get('coding')) for (meta, _) in records):
+            response.status = 415
+            return None
+        accepted = [(meta, value) for (meta, value) in records if not self.oversized(value)]
+        if len(accepted) < len(records):
+            # MEMO: the rest of the batch is stored, refused values are left out of the copies sent to peers
+            response.status = 413
+            records = accepted
+            body = pack_records(records)
+        body = self.stamped(records, body)
+        for (meta, value) in records:
+            if value is not None and self.owns(meta['key']):
+                (value, coding) = self.encoded(value, meta.get('coding'))
+                self.store(region, meta['key'], value, parse_expiry(meta.get('expiry')), parse_delta(meta.get('delta')), coding, meta['stamp']
+                    , parse_tags(meta.get('tags')))
+        # MEMO: peers get the very same batch, one request per peer rather than one per key
+        if records and not self.replicate(self.batch_replication_sends('PUT', region, records, body)):
+            response.status = 504
+
+    def oversized(self, value):
+        return self.max_value_size is not None and value is not None and len(value) > self.max_value_size
+
+    def stamped(self, records, body):
+        # MEMO: the first node to get a batch stamps its records, the copies sent to peers carry the same stamps
+        stamp = time.time()
+        missing = False
+        for (meta, _) in records:
+            if 'stamp' not in meta:
+                meta['stamp'] = stamp
+                missing = True
+        return pack_records(records) if missing else body
+
+    def sync_query(self):
+        # MEMO: the JSON body of the anti-entropy requests, None once the response is set to an error
+        body = read_body(self.max_value_size)
+        if body is None:
+            response.status = 413
+            return None
+        try:
+            query = json.loads(body)
+            if not isinstance(query, dict):
+                raise ValueError('not a JSON object')
+            return query
+        except ValueError:
+            response.status = 400
+            return None
+
+    def http_sync_tree(self, scope):
+        query = self.sync_query()
+        if query is None:
+            return None
+        tree = self.anti_entropy.tree(scope, query.get('peer'))
+        try:
+            hashes = tree.hashes(query['level'], query['indexes'])
+        except (KeyError, TypeError, IndexError):
+            response.status = 400
+            return None
+        response.content_type = 'application/json'
+        return json.dumps({'hashes': hashes})
+
+    def http_sync_versions(self, scope):
+        query = self.sync_query()
+        if query is None:
+            return None
+        tree = self.anti_entropy.tree(scope, query.get('peer'))
+        try:
+            versions = tree.versions(query['leaves'])
+        except (KeyError, TypeError, IndexError):
+            response.status = 400
+            return None
+        response.content_type = 'application/json'
+        return json.dumps({'versions': versions})
+
+    def anti_entropy_info(self):
+        response.content_type = 'application/json'
+        return json.dumps(self.anti_entropy.info())
+
+    def http_delete_many(self, region):
+        body = read_batch_body(self.max_value_size)
+        if body is None:
+            response.status = 413
+            return None
+        try:
+            records = unpack_batch(body)
+        except ValueError:
+            response.status = 400
+            return None
+        logger.debug('delete many: %s %s', region, len(records))
+        body = self.stamped(records, body)
+        for (meta, _) in records:
+            self.evict(region, meta['key'], meta['stamp'])
+        if not self.replicate(self.batch_replication_sends('DELETE', region, records, body)):
+            response.status = 504
+
+    def replication_info(self):
+        response.content_type = 'application/json'
+        return json.dumps(self.replicator.info())
+
+    def lease_info(self):
+        response.content_type = 'application/json'
+        return json.dumps(self.leases.info())
+
+    def http_latency_info(self):
+        response.content_type = 'application/json'
+        return json.dumps(self.latency_info())
 
     def local_cache_info(self):
         response.content_type = 'application/json'
-        return json.dumps({
-            "hits": self.local_cache_hits
-            , "misses": self.local_cache_misses
-            , "maxsize": self.local_cache.maxsize
-            , "currsize": self.local_cache.currsize
-        })
+        return json.dumps(self.local_cache.info())
 
     def remote_cache_info(self):
         response.content_type = 'application/json'
-        return json.dumps({
-            "hits": self.remote_cache_hits
-            , "misses": self.remote_cache_misses
-            , "maxsize": self.remote_cache.maxsize
-            , "currsize": self.remote_cache.currsize
-        })
+        return json.dumps(self.remote_cache.info())
+
+    def cache_gauges(self):
+        # MEMO: the caches keep their own counts, read as they are scraped
+        infos = (('local', self.local_cache.info()), ('remote', self.remote_cache.info()))
+        gauges = []
+        for (field, name, kind) in (
+            ('hits', 'zerocache_cache_hits_total', 'counter')
+            , ('misses', 'zerocache_cache_misses_total', 'counter')
+            , ('evictions', 'zerocache_cache_evictions_total', 'counter')
+            , ('expirations', 'zerocache_cache_expirations_total', 'counter')
+            , ('entries', 'zerocache_cache_entries', 'gauge')
+            , ('bytes', 'zerocache_cache_bytes', 'gauge')
+            , ('tombstones', 'zerocache_cache_tombstones', 'gauge')
+        ):
+            gauges.append((name, kind, [((('cache', cache),), info[field]) for (cache, info) in infos]))
+        gauges.append(('zerocache_replication_queue_depth', 'gauge', [((), self.replicator.queue.qsize())]))
+        return gauges
+
+    def http_metrics(self):
+        response.content_type = CONTENT_TYPE
+        return render(self.metrics, self.cache_gauges())
 
 class ZerocacheTestServer(ZerocacheServer):
-    def __init__(self, address, port=6789, region=None):
+    def __init__(self, address, port=6789, region=None, **kwargs):
         r_hash = int(md5(region.encode('utf-8')).hexdigest()[0:4], 16)
         regional_bracket = r_hash % 5
         regional_latency = regional_bracket * 100
         self.latency = regional_latency + random.randint(3,6)*10
         self.extra_latency = 0
-        print(f"+ + + + + {region} - rhash... {r_hash}, regional bracket {regional_bracket}, regional latency {regional_latency}, specific latency {self.latency}")
-        super().__init__(address, port=port, region=region)
+        logger.info(f"+ + + + + {region} - rhash... {r_hash}, regional bracket {regional_bracket}, regional latency {regional_latency}, specific latency {self.latency}")
+        super().__init__(address, port=port, region=region, **kwargs)
 
     def _route(self):
         super()._route()
@@ -242,3 +945,19 @@ class ZerocacheTestServer(ZerocacheServer):
     def http_delete(self, region, key):
         self.delay()
         return super().http_delete(region, key)
+
+    def http_invalidate(self, region):
+        self.delay()
+        return super().http_invalidate(region)
+
+    def http_get_many(self, region):
+        self.delay()
+        return super().http_get_many(region)
+
+    def http_put_many(self, region):
+        self.delay()
+        return super().http_put_many(region)
+
+    def http_delete_many(self, region):
+        self.delay()
+        return super().http_delete_many(region)
@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import Future
+from threading import Lock
+
+# MEMO: concurrent calls for the same key share a single execution, the first caller runs it and the
+#       others wait for its result (or its exception)
+class ZerocacheSingleFlight:
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def busy(self, key):
+        return key in self.calls
+
+    def __len__(self):
+        return len(self.calls)
+
+# MEMO: the same, for coroutines of a single event loop
+class ZerocacheAsyncSingleFlight:
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, fn):
+        future = self.calls.get(key)
+        if future is not None:
+            # MEMO: shielded, a cancelled waiter doesn't cancel the call the others wait for
+            return await asyncio.shield(future)
+        future = self.calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # MEMO: marks the exception as retrieved, when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self.calls[key]
+
+    def busy(self, key):
+        return key in self.calls
+
+    def __len__(self):
+        return len(self.calls)
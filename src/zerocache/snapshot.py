@@ -0,0 +1,48 @@
+import mmap
+import os
+from .batch import record_chunks, unpack_records
+from .store import ZerocacheEntry
+
+# MEMO: snapshots and dumps are batch bodies (see batch), one record per entry of the local or remote cache.
+#       Snapshots outlive the process, their entries carry an absolute (wall clock) expiry; dumps are read
+#       by a peer right away, their entries carry the seconds they have left (ttl), whatever the peer's clock.
+
+def entry_record(cache, key, entry: ZerocacheEntry, now, wall=None):
+    meta = {'cache': cache, 'key': key, 'age': round(max(now - entry.created, 0.0), 3), 'stamp': entry.stamp}
+    if wall is None:
+        meta['ttl'] = round(entry.expires - now, 3)
+    else:
+        meta['expires'] = round(wall + entry.expires - now, 3)
+    if entry.delta is not None:
+        meta['delta'] = entry.delta
+    if entry.coding is not None:
+        meta['coding'] = entry.coding
+    if entry.region is not None:
+        meta['region'] = entry.region
+    if entry.tags:
+        meta['tags'] = list(entry.tags)
+    return meta
+
+def record_entry(meta, value, now, wall=None):
+    # MEMO: None for entries that expired in the meantime
+    ttl = meta['expires'] - wall if 'expires' in meta else meta.get('ttl', 0)
+    if value is None or ttl <= 0:
+        return None
+    return ZerocacheEntry(value, now + ttl, now - meta.get('age', 0), meta.get('delta'), meta.get('coding')
+        , meta.get('stamp'), meta.get('region'), meta.get('tags'))
+
+def write_snapshot(path, records):
+    # MEMO: written aside then renamed, a crash mid-write leaves the previous snapshot in place
+    partial = f'{path}.partial'
+    with open(partial, 'wb') as file:
+        file.writelines(record_chunks(records))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(partial, path)
+
+def read_snapshot(path):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return []
+    # MEMO: memory-mapped, the file is paged in as it is parsed rather than read into one more copy first
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+        return unpack_records(view)
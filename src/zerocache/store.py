@@ -0,0 +1,382 @@
+import time
+from threading import Lock
+from cachetools import Cache, TLRUCache
+
+SIZE_ENTRIES = 'entries'
+SIZE_BYTES = 'bytes'
+SIZE_MODES = (SIZE_ENTRIES, SIZE_BYTES)
+# MEMO: past this many invalidated prefixes, the store is swept and the oldest quarter is forgotten
+MAX_PREFIX_INVALIDATIONS = 1024
+
+# MEMO: created is when this node stored the entry, delta how long the value took to compute (when the writer
+#       said so), both monotonic seconds; they let readers refresh a value before it expires.
+#       coding is the content coding the value is stored with (see compression), None when stored as it is.
+#       stamp is the wall clock time of the write, given by the first node that got it: between two versions of
+#       a key, the latest stamp wins (see antientropy). region is the region the entry belongs to, when it's
+#       another one than the node's. tags are the names the write was tagged with, for bulk invalidation.
+class ZerocacheEntry:
+    __slots__ = ('value', 'expires', 'created', 'delta', 'coding', 'stamp', 'region', 'tags')
+
+    def __init__(self, value, expires: float, created: float = None, delta: float = None, coding: str = None
+            , stamp: float = None, region: str = None, tags: tuple = None):
+        self.value = value
+        self.expires = expires
+        self.created = time.monotonic() if created is None else created
+        self.delta = delta
+        self.coding = coding
+        self.stamp = time.time() if stamp is None else stamp
+        self.region = region
+        self.tags = tuple(tags) if tags else None
+
+    def meta(self, now=None):
+        now = time.monotonic() if now is None else now
+        meta = {'ttl': round(max(self.expires - now, 0.0), 3), 'age': round(max(now - self.created, 0.0), 3)}
+        if self.delta is not None:
+            meta['delta'] = self.delta
+        return meta
+
+# MEMO: every entry carries its own deadline, computed once from the expiry of its write
+def entry_ttu(key, entry: ZerocacheEntry, now: float):
+    return entry.expires
+
+def entry_size(entry: ZerocacheEntry):
+    return len(entry.value)
+
+# MEMO: a TLRUCache of ZerocacheEntry, sized either by entry count or by bytes of values, which also
+#       counts how many entries were pushed out for room (evictions) or dropped for age (expirations)
+class ZerocacheTLRUCache(TLRUCache):
+    def __init__(self, maxsize, size_mode=SIZE_ENTRIES):
+        if size_mode not in SIZE_MODES:
+            raise ValueError(f"size_mode must be one of {SIZE_MODES}")
+        getsizeof = entry_size if size_mode == SIZE_BYTES else None
+        super().__init__(maxsize=maxsize, ttu=entry_ttu, timer=time.monotonic, getsizeof=getsizeof)
+        self.size_mode = size_mode
+        self.evictions = 0
+        self.expirations = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.expirations += len(expired)
+        return expired
+
+    def bytes_in_use(self):
+        if self.size_mode == SIZE_BYTES:
+            return self.currsize
+        # MEMO: entry-sized caches don't track bytes, they are summed on demand (info endpoints only),
+        #       Cache.__getitem__ reads without refreshing the LRU order
+        return sum(len(Cache.__getitem__(self, key).value) for key in list(self))
+
+# MEMO: tombstones are (stamp, monotonic expiry, region) of deleted keys, kept for a while so that the
+#       deleted version isn't brought back by a peer that missed the delete.
+#       tags maps each tag to the keys written with it. Keys are added as they are written and never removed one
+#       by one (evictions and expirations happen inside cachetools), lookups check the entry still carries the
+#       tag; the index is rebuilt from the cache once it holds twice as many keys as the cache has entries.
+class ZerocacheShard:
+    __slots__ = ('lock', 'cache', 'tombstones', 'hits', 'misses', 'tags', 'indexed')
+
+    def __init__(self, maxsize, size_mode):
+        self.lock = Lock()
+        self.cache = ZerocacheTLRUCache(maxsize=maxsize, size_mode=size_mode)
+        self.tombstones = {}
+        self.hits = 0
+        self.misses = 0
+        self.tags = {}
+        self.indexed = 0
+
+    def store(self, key, entry: ZerocacheEntry):
+        self.cache[key] = entry
+        self.index(key, entry)
+
+    def index(self, key, entry: ZerocacheEntry):
+        if not entry.tags:
+            return
+        for tag in entry.tags:
+            self.tags.setdefault(tag, set()).add(key)
+        self.indexed += len(entry.tags)
+        if self.indexed > 2 * len(self.cache) + 1024:
+            self.reindex()
+
+    def reindex(self):
+        tags = {}
+        indexed = 0
+        for key in list(self.cache):
+            for tag in Cache.__getitem__(self.cache, key).tags or ():
+                tags.setdefault(tag, set()).add(key)
+                indexed += 1
+        self.tags = tags
+        self.indexed = indexed
+
+    def entry(self, key) -> ZerocacheEntry:
+        # MEMO: read without refreshing the LRU order, None when missing or expired
+        if key not in self.cache:
+            return None
+        return Cache.__getitem__(self.cache, key)
+
+    def tombstone(self, key, now):
+        tombstone = self.tombstones.get(key)
+        if tombstone is not None and tombstone[1] <= now:
+            del self.tombstones[key]
+            return None
+        return tombstone
+
+# MEMO: cachetools caches aren't thread-safe. The store splits its capacity over shards picked by key hash,
+#       each with its own lock, TLRU and counters, so worker threads only contend on the same shard.
+#       In size_mode='bytes', a value can't be larger than the budget of one shard (maxsize / shards).
+#       Invalidations are remembered like deletes, (region, tag) -> (stamp, monotonic expiry): a write older than an
+#       invalidation that matches it, coming late from a peer, is dropped.
+#       Prefixes aren't indexed, each invalidated prefix is a generation instead, (region, prefix) -> (stamp,
+#       monotonic expiry, tombstone ttl, generation), checked with one lookup per distinct prefix length: entries it
+#       predates are hidden right away, and buried once read, or swept by items() (anti-entropy, dumps, snapshots).
+#       It is kept for the tombstone ttl, and past it until a sweep that started after it buried what it hid.
+class ZerocacheStore:
+    def __init__(self, maxsize, size_mode=SIZE_ENTRIES, shards=16):
+        self.size_mode = size_mode
+        self.maxsize = maxsize
+        shard_maxsize = max(1, -(-maxsize // shards))
+        self.shards = tuple(ZerocacheShard(shard_maxsize, size_mode) for _ in range(shards))
+        # MEMO: copy-on-write, read on every write without locking
+        self.lock = Lock()
+        self.tag_invalidations = {}
+        self.prefix_invalidations = {}
+        self.prefix_lengths = ()
+        # MEMO: generation of the latest prefix invalidation, and of the latest one a complete sweep has seen
+        self.generation = 0
+        self.swept = 0
+
+    def shard(self, key) -> ZerocacheShard:
+        return self.shards[hash(key) % len(self.shards)]
+
+    def get(self, key):
+        shard = self.shard(key)
+        with shard.lock:
+            try:
+                # MEMO: a single lookup, expired entries raise KeyError just like missing ones
+                entry = shard.cache[key]
+            except KeyError:
+                shard.misses += 1
+                return None
+            if self.prefix_invalidations and self.hidden(shard, key, entry, time.monotonic()):
+                shard.misses += 1
+                return None
+            shard.hits += 1
+            return entry
+
+    def set(self, key, entry: ZerocacheEntry):
+        shard = self.shard(key)
+        with shard.lock:
+            shard.store(key, entry)
+
+    def put(self, key, entry: ZerocacheEntry):
+        # MEMO: the latest write wins, older versions (and versions older than their delete) are dropped
+        shard = self.shard(key)
+        with shard.lock:
+            tombstone = shard.tombstone(key, time.monotonic())
+            if tombstone is not None:
+                if tombstone[0] > entry.stamp:
+                    return False
+                del shard.tombstones[key]
+            current = shard.cache.get(key)
+            if current is not None and current.stamp > entry.stamp:
+                return False
+            if self.invalidated(key, entry, time.monotonic()):
+                return False
+            shard.store(key, entry)
+            return True
+
+    def invalidated(self, key, entry: ZerocacheEntry, now):
+        if entry.tags and self.tag_invalidations:
+            for tag in entry.tags:
+                invalidation = self.tag_invalidations.get((entry.region, tag))
+                if invalidation is not None and invalidation[0] >= entry.stamp and invalidation[1] > now:
+                    return True
+        return self.prefix_invalidation(key, entry, now) is not None
+
+    def prefix_invalidation(self, key, entry: ZerocacheEntry, now):
+        # MEMO: the invalidation of a prefix of the key that the entry predates, None when there is none
+        invalidations = self.prefix_invalidations
+        if not invalidations:
+            return None
+        for length in self.prefix_lengths:
+            if length > len(key):
+                break
+            invalidation = invalidations.get((entry.region, key[:length]))
+            if invalidation is not None and invalidation[0] >= entry.stamp and self.prefix_live(invalidation, now):
+                return invalidation
+        return None
+
+    def prefix_live(self, invalidation, now):
+        return invalidation[1] > now or invalidation[3] > self.swept
+
+    def hidden(self, shard: ZerocacheShard, key, entry: ZerocacheEntry, now):
+        # MEMO: called with the shard's lock held, buries the entry when an invalidated prefix hides it
+        invalidation = self.prefix_invalidation(key, entry, now)
+        if invalidation is None:
+            return False
+        self.buried(shard, key, invalidation[0], invalidation[2], entry.region, now)
+        return True
+
+    def bury(self, key, stamp, ttl, region=None):
+        # MEMO: deletes the key unless it was written again since, and leaves a tombstone
+        now = time.monotonic()
+        shard = self.shard(key)
+        with shard.lock:
+            return self.buried(shard, key, stamp, ttl, region, now)
+
+    def buried(self, shard: ZerocacheShard, key, stamp, ttl, region, now):
+        # MEMO: called with the shard's lock held
+        current = shard.cache.get(key)
+        if current is not None and current.stamp > stamp:
+            return False
+        tombstone = shard.tombstone(key, now)
+        if tombstone is None or tombstone[0] < stamp:
+            shard.tombstones[key] = (stamp, now + ttl, region)
+        # MEMO: expired tombstones are only dropped once in a while, when they pile up
+        if len(shard.tombstones) > 1024:
+            shard.tombstones = {k: v for (k, v) in shard.tombstones.items() if v[1] > now}
+        return shard.cache.pop(key, None) is not None
+
+    def remember(self, invalidations, matches, invalidation, live):
+        invalidations = {match: value for (match, value) in invalidations.items() if live(value)}
+        for match in matches:
+            if match not in invalidations or invalidations[match][0] < invalidation[0]:
+                invalidations[match] = invalidation
+        return invalidations
+
+    def invalidate(self, tags=(), prefixes=(), stamp=None, ttl=300.0, region=None):
+        # MEMO: drops every entry of the region (None for the node's own) written with one of the tags, or under
+        #       one of the prefixes, before stamp. Tagged entries are looked up in the index of each shard and buried
+        #       right away, they are the count returned; entries under a prefix are hidden from now on (see above).
+        now = time.monotonic()
+        stamp = time.time() if stamp is None else stamp
+        tags = tuple(tags)
+        prefixes = tuple(prefixes)
+        with self.lock:
+            if tags:
+                self.tag_invalidations = self.remember(self.tag_invalidations, [(region, tag) for tag in tags], (stamp, now + ttl)
+                    , lambda value: value[1] > now)
+            if prefixes:
+                self.generation += 1
+                invalidations = self.remember(self.prefix_invalidations, [(region, prefix) for prefix in prefixes]
+                    , (stamp, now + ttl, ttl, self.generation), lambda value: self.prefix_live(value, now))
+                self.publish_prefixes(invalidations)
+        if len(self.prefix_invalidations) > MAX_PREFIX_INVALIDATIONS:
+            self.items()
+            self.forget_prefixes(MAX_PREFIX_INVALIDATIONS * 3 // 4)
+        dropped = 0
+        for shard in self.shards:
+            if not tags:
+                break
+            with shard.lock:
+                keys = set()
+                for tag in tags:
+                    keys.update(shard.tags.get(tag, ()))
+                for key in keys:
+                    entry = shard.entry(key)
+                    if entry is None or entry.region != region or entry.stamp > stamp:
+                        continue
+                    if any(tag in tags for tag in entry.tags or ()):
+                        dropped += self.buried(shard, key, stamp, ttl, region, now)
+                for tag in tags:
+                    kept = {key for key in shard.tags.get(tag, ()) if key in shard.cache}
+                    if kept:
+                        shard.tags[tag] = kept
+                    else:
+                        shard.tags.pop(tag, None)
+        return dropped
+
+    def publish_prefixes(self, invalidations):
+        # MEMO: called with the store's lock held. The lengths are published first, readers may see one too many,
+        #       never one too few
+        self.prefix_lengths = tuple(sorted({len(prefix) for (_, prefix) in invalidations} | set(self.prefix_lengths)))
+        self.prefix_invalidations = invalidations
+        self.prefix_lengths = tuple(sorted({len(prefix) for (_, prefix) in invalidations}))
+
+    def forget_prefixes(self, keep=None):
+        # MEMO: drops the prefix invalidations that are expired and swept. Over keep, the oldest swept ones go too:
+        #       what they hid is buried already, only late writes older than them would be let in again
+        with self.lock:
+            now = time.monotonic()
+            invalidations = {match: value for (match, value) in self.prefix_invalidations.items() if self.prefix_live(value, now)}
+            if keep is not None and len(invalidations) > keep:
+                swept = sorted((value[0], match) for (match, value) in invalidations.items() if value[3] <= self.swept)
+                for (_, match) in swept[:len(invalidations) - keep]:
+                    del invalidations[match]
+            if len(invalidations) != len(self.prefix_invalidations):
+                self.publish_prefixes(invalidations)
+
+    def tombstones(self):
+        # MEMO: a snapshot of the live tombstones, as (key, stamp, region)
+        now = time.monotonic()
+        tombstones = []
+        for shard in self.shards:
+            with shard.lock:
+                for (key, (stamp, expires, region)) in shard.tombstones.items():
+                    if expires > now:
+                        tombstones.append((key, stamp, region))
+        return tombstones
+
+    def add(self, key, entry: ZerocacheEntry):
+        # MEMO: only when the key isn't held yet, restored entries never override fresher writes
+        shard = self.shard(key)
+        with shard.lock:
+            now = time.monotonic()
+            if key in shard.cache or shard.tombstone(key, now) is not None or self.invalidated(key, entry, now):
+                return False
+            shard.store(key, entry)
+            return True
+
+    def pop(self, key):
+        shard = self.shard(key)
+        with shard.lock:
+            return shard.cache.pop(key, None)
+
+    def items(self):
+        # MEMO: a snapshot of the live entries, read without refreshing their LRU order
+        items = []
+        now = time.monotonic()
+        with self.lock:
+            generation = self.generation
+        for shard in self.shards:
+            with shard.lock:
+                for key in list(shard.cache):
+                    entry = Cache.__getitem__(shard.cache, key)
+                    if self.prefix_invalidations and self.hidden(shard, key, entry, now):
+                        continue
+                    items.append((key, entry))
+        # MEMO: every entry hidden by the prefix invalidations seen at the start is buried by now
+        if generation > self.swept:
+            with self.lock:
+                self.swept = max(self.swept, generation)
+            self.forget_prefixes()
+        return items
+
+    def __len__(self):
+        return sum(len(shard.cache) for shard in self.shards)
+
+    def _sum(self, read):
+        total = 0
+        for shard in self.shards:
+            with shard.lock:
+                total += read(shard)
+        return total
+
+    def info(self):
+        return {
+            "hits": self._sum(lambda shard: shard.hits)
+            , "misses": self._sum(lambda shard: shard.misses)
+            , "maxsize": self.maxsize
+            , "currsize": self._sum(lambda shard: shard.cache.currsize)
+            , "size_mode": self.size_mode
+            , "shards": len(self.shards)
+            , "entries": self._sum(lambda shard: len(shard.cache))
+            , "bytes": self._sum(lambda shard: shard.cache.bytes_in_use())
+            , "evictions": self._sum(lambda shard: shard.cache.evictions)
+            , "expirations": self._sum(lambda shard: shard.cache.expirations)
+            , "tombstones": self._sum(lambda shard: len(shard.tombstones))
+            , "tags": self._sum(lambda shard: len(shard.tags))
+        }
@@ -1,5 +1,10 @@
 import sys
 from zerocache import ZerocacheTestServer
 
-s = ZerocacheTestServer('127.0.0.1', port=int(sys.argv[1]), region=sys.argv[2])
+options = sys.argv[3:]
+def option(name, default=None):
+    return next((arg.split('=', 1)[1] for arg in options if arg.startswith(f'--{name}=')), default)
+
+s = ZerocacheTestServer('127.0.0.1', port=int(sys.argv[1]), region=sys.argv[2], partitioned='--partitioned' in options
+    , snapshot_path=option('snapshot'), bootstrap='--bootstrap' in options, anti_entropy_interval=float(option('anti-entropy', 30.0)))
 s.start()
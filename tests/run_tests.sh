@@ -3,7 +3,7 @@
 rm -f client.coverage dummy_server.coverage .coverage
 
 
-PYTHONPATH=src coverage run --append --data-file=client.coverage -m pytest tests/test_manual_integration.py tests/test_network_fallback.py tests/test_decorator.py
+PYTHONPATH=src coverage run --append --data-file=client.coverage -m pytest tests/test_manual_integration.py tests/test_network_fallback.py tests/test_decorator.py tests/test_hedged_reads.py tests/test_batch.py tests/test_partitioning.py tests/test_latency_ranking.py tests/test_async_client.py tests/test_compression.py tests/test_snapshot.py tests/test_anti_entropy.py tests/test_metrics.py tests/test_memory_network.py tests/test_invalidation.py tests/test_streaming.py tests/test_replication.py tests/test_near_cache.py tests/test_size_mode.py tests/test_store_concurrency.py tests/test_hedge_stall.py tests/test_selection.py
 
 
 coverage combine client.coverage dummy_server.coverage
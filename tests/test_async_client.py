@@ -0,0 +1,94 @@
+import asyncio
+import subprocess
+import time
+import signal
+import pickle
+from zerocache import AsyncZerocacheClient, auto_zerocache
+
+
+def start_dummy_servers():
+    local_1 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15001', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    local_2 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15002', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    services = [local_1, local_2]
+    # Sleep 2 seconds to allow "zerconf" to do its thing
+    print('sleep 2')
+    time.sleep(1)
+    print('sleep 1')
+    time.sleep(1)
+    return services
+
+def stop_dummy_servers(services):
+    print('')
+    print('terminating...')
+    for service in services:
+        print('- one down')
+        service.send_signal(signal.SIGTERM)
+        time.sleep(0.5)
+        service.send_signal(signal.SIGKILL)
+    print('terminating... all done')
+
+calls = []
+
+@auto_zerocache('local', 60)
+async def slow_echo(message):
+    calls.append(message)
+    await asyncio.sleep(0.5)
+    return message
+
+async def discovered(zc, count):
+    deadline = time.time() + 10
+    while len(zc.services.get('local', [])) < count and time.time() < deadline:
+        await asyncio.sleep(0.25)
+
+async def async_operations():
+    async with AsyncZerocacheClient('local') as zc:
+        await discovered(zc, 2)
+
+        (ok, value) = await zc.get('nothing')
+        assert not ok
+
+        assert await zc.put('foo', pickle.dumps('bar'), 60)
+        await asyncio.sleep(0.5)
+        # MEMO: many lookups in flight at once, from a single client
+        results = await asyncio.gather(*[zc.get('foo') for _ in range(500)])
+        print('hits', sum(ok for (ok, _) in results))
+        assert all(ok and pickle.loads(value) == 'bar' for (ok, value) in results)
+
+        assert await zc.put_many({'a': pickle.dumps('alpha'), 'b': pickle.dumps('beta')}, 60)
+        await asyncio.sleep(0.5)
+        found = await zc.get_many(['a', 'b', 'zzz'])
+        assert sorted(found.keys()) == ['a', 'b']
+
+        # MEMO: large values travel compressed, both ways
+        big = pickle.dumps(['zerocache'] * 2000)
+        assert await zc.put('big', big, 60)
+        assert await zc.put_many({'big-batch': big}, 60)
+        await asyncio.sleep(0.5)
+        assert await zc.get('big') == (True, big)
+        assert await zc.get_many(['big', 'big-batch']) == {'big': big, 'big-batch': big}
+
+        assert await zc.delete('foo')
+        assert await zc.delete_many(['a', 'b'])
+        await asyncio.sleep(0.5)
+        for _ in range(2):
+            (ok, _) = await zc.get('foo')
+            assert not ok
+            assert await zc.get_many(['a', 'b']) == {}
+
+    zc = await AsyncZerocacheClient.get_instance('local')
+    await discovered(zc, 2)
+    assert await slow_echo('hello') == 'hello'
+    await asyncio.sleep(0.5)
+    assert await slow_echo('hello') == 'hello'
+    print('calls', calls)
+    assert calls == ['hello']
+    await AsyncZerocacheClient.clear_instance('local')
+
+
+def test_async_client():
+    services = []
+    try:
+        services = start_dummy_servers()
+        asyncio.run(async_operations())
+    finally:
+        stop_dummy_servers(services)
@@ -0,0 +1,86 @@
+import subprocess
+import time
+import signal
+import os
+from zerocache import ZerocacheClient
+import pickle
+
+
+def start_dummy_servers():
+    local_1 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15001', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    local_2 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15002', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    services = [local_1, local_2]
+    # Sleep 2 seconds to allow "zerconf" to do its thing
+    print('sleep 2')
+    time.sleep(1)
+    print('sleep 1')
+    time.sleep(1)
+    return services
+
+def stop_dummy_servers(services):
+    print('')
+    print('terminating...')
+    for service in services:
+        print('- one down')
+        service.send_signal(signal.SIGTERM)
+        time.sleep(0.5)
+        service.send_signal(signal.SIGKILL)
+    print('terminating... all done')
+
+def eventually(check, deadline=5):
+    deadline = time.time() + deadline
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_batch_operations():
+    services = []
+    try:
+        ZerocacheClient.clear_instance('local')
+        zc: ZerocacheClient = ZerocacheClient.get_instance('local')
+        services = start_dummy_servers()
+        deadline = time.time() + 10
+        while len(zc.services.get('local', [])) < 2 and time.time() < deadline:
+            time.sleep(0.25)
+
+        found = zc.get_many(['a', 'b', 'c'])
+        print('get_many, nothing stored yet', found)
+        assert found == {}
+        assert not zc.cache_hit
+
+        put_ok = zc.put_many({
+            'a': pickle.dumps('alpha')
+            , 'b': pickle.dumps(['b', 'e', 't', 'a'])
+            , 'c': (pickle.dumps('gamma'), 30) # an expiry of its own
+        }, 60)
+        print('put_many', put_ok, zc.latest_action)
+        assert put_ok == True
+        time.sleep(0.5)
+
+        # MEMO: the round-robin alternates nodes, both of them must have received the batch
+        for _ in range(2):
+            found = zc.get_many(['a', 'b', 'c', 'zzz'])
+            print('get_many', zc.latest_action, found.keys())
+            assert sorted(found.keys()) == ['a', 'b', 'c']
+            assert pickle.loads(found['a']) == 'alpha'
+            assert pickle.loads(found['b']) == ['b', 'e', 't', 'a']
+            assert pickle.loads(found['c']) == 'gamma'
+
+        print('d should expire, a, b and c should not')
+        assert zc.put_many({'d': (pickle.dumps('delta'), 1)}, 60)
+        assert eventually(lambda: all(zc.get_many(['d']) == {} for _ in range(2)))
+        found = zc.get_many(['a', 'b', 'c', 'd'])
+        assert sorted(found.keys()) == ['a', 'b', 'c']
+
+        delete_ok = zc.delete_many(['a', 'b', 'c'])
+        assert delete_ok == True
+        time.sleep(0.5)
+        for _ in range(2):
+            found = zc.get_many(['a', 'b', 'c'])
+            print('get_many after delete_many', zc.latest_action, found)
+            assert found == {}
+    finally:
+        stop_dummy_servers(services)
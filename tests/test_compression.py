@@ -0,0 +1,98 @@
+import subprocess
+import time
+import signal
+import zlib
+from zerocache import ZerocacheClient
+import pickle
+import requests
+
+
+def start_dummy_servers():
+    local_1 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15041', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    local_2 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15042', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    remote_1 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15043', 'faraway'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    services = [local_1, local_2, remote_1]
+    # Sleep 2 seconds to allow "zerconf" to do its thing
+    print('sleep 2')
+    time.sleep(1)
+    print('sleep 1')
+    time.sleep(1)
+    return services
+
+def stop_dummy_servers(services):
+    print('')
+    print('terminating...')
+    for service in services:
+        print('- one down')
+        service.send_signal(signal.SIGTERM)
+        time.sleep(0.5)
+        service.send_signal(signal.SIGKILL)
+    print('terminating... all done')
+
+def raw_get(port, region, key, accept):
+    # MEMO: the body as sent by the node, not decoded by requests
+    response = requests.get(f'http://127.0.0.1:{port}/{region}/{key}', headers={'Accept-Encoding': accept}, stream=True)
+    return (response.status_code, response.headers.get('Content-Encoding'), response.raw.read(decode_content=False))
+
+
+def test_compression():
+    services = []
+    try:
+        ZerocacheClient.clear_instance('local')
+        zc: ZerocacheClient = ZerocacheClient.get_instance('local')
+        services = start_dummy_servers()
+        deadline = time.time() + 10
+        while (len(zc.services.get('local', [])) < 2 or len(zc.services.get('faraway', [])) < 1) and time.time() < deadline:
+            time.sleep(0.25)
+
+        value = pickle.dumps(['zerocache'] * 2000)
+        assert zc.put('big', value, 60)
+        assert zc.put('small', pickle.dumps('tiny'), 60)
+        time.sleep(1)
+
+        print('stored and replicated compressed, served compressed to readers that accept it')
+        for port in (15041, 15042):
+            (status, coding, body) = raw_get(port, 'local', 'big', 'deflate')
+            assert status == 200 and coding == 'deflate'
+            assert len(body) < len(value) / 10
+            assert zlib.decompress(body) == value
+        (status, coding, body) = raw_get(15043, 'local', 'big', 'gzip, deflate')
+        assert status == 200 and coding == 'deflate' and zlib.decompress(body) == value
+
+        print('and decompressed for the others')
+        (status, coding, body) = raw_get(15041, 'local', 'big', 'identity')
+        assert status == 200 and coding is None and body == value
+        (status, coding, body) = raw_get(15041, 'local', 'small', 'deflate')
+        assert status == 200 and coding is None and pickle.loads(body) == 'tiny'
+
+        print('clients decode transparently, single and batch')
+        assert zc.get('big') == (True, value)
+        assert zc.get_many(['big', 'small']) == {'big': value, 'small': pickle.dumps('tiny')}
+
+        print('other codings, stored uncompressed values get compressed by the node')
+        xz = ZerocacheClient('local', compression='xz', probe_interval=None)
+        plain = ZerocacheClient('local', compression=None, probe_interval=None)
+        deadline = time.time() + 10
+        while (len(xz.services.get('local', [])) < 2 or len(plain.services.get('local', [])) < 2) and time.time() < deadline:
+            time.sleep(0.25)
+        assert xz.put('xz', value, 60)
+        assert plain.put('plain', value, 60)
+        assert xz.put_many({'many': value}, 60)
+        time.sleep(1)
+        (status, coding, body) = raw_get(15042, 'local', 'xz', 'xz')
+        assert status == 200 and coding == 'xz' and len(body) < len(value) / 10
+        (status, coding, body) = raw_get(15042, 'local', 'plain', 'deflate')
+        assert status == 200 and coding == 'deflate' and zlib.decompress(body) == value
+        for key in ('xz', 'plain', 'many'):
+            assert zc.get(key) == (True, value)
+            assert xz.get(key) == (True, value)
+            assert plain.get(key) == (True, value)
+        assert plain.get_many(['xz', 'many']) == {'xz': value, 'many': value}
+
+        print('unknown codings are refused')
+        response = requests.put('http://127.0.0.1:15041/local/odd?expiry=60', data=b'????', headers={'Content-Encoding': 'snappy'})
+        assert response.status_code == 415
+        xz.stop_probing()
+        plain.stop_probing()
+    finally:
+        stop_dummy_servers(services)
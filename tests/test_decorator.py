@@ -3,6 +3,9 @@ import time
 import signal
 import os
 from zerocache import auto_zerocache, ZerocacheClient
+from zerocache.decorators import call_key
+from concurrent.futures import ThreadPoolExecutor
+import pickle
 import requests
 import random
 
@@ -46,6 +49,46 @@ def echo(value):
     time.sleep(1)
     return value
 
+computations = []
+
+@auto_zerocache(os.getenv('CACHE_REGION', 'local'))
+def popular(value):
+    computations.append(value)
+    time.sleep(1)
+    return value * 2
+
+@auto_zerocache(os.getenv('CACHE_REGION', 'local'), lease=True, lease_ttl=5)
+def leased(value):
+    computations.append(value)
+    time.sleep(1)
+    return value * 2
+
+@auto_zerocache(os.getenv('CACHE_REGION', 'local'), serializer='bytes')
+def render(value):
+    time.sleep(1)
+    return f"<p>{value}</p>".encode('utf-8')
+
+@auto_zerocache(os.getenv('CACHE_REGION', 'local'), key=lambda value, log=None: value)
+def logged(value, log=None):
+    time.sleep(1)
+    if log is not None:
+        log.append(value)
+    return value * 3
+
+generations = []
+
+@auto_zerocache(os.getenv('CACHE_REGION', 'local'), 1, stale_grace=30)
+def stale_ok(value):
+    generations.append(value)
+    time.sleep(1)
+    return (value, len(generations))
+
+@auto_zerocache(os.getenv('CACHE_REGION', 'local'), 60, xfetch_beta=1000)
+def early(value):
+    generations.append(value)
+    time.sleep(0.5)
+    return (value, len(generations))
+
 def speedup_invoker(func, *args):
     zc: ZerocacheClient = ZerocacheClient.get_instance(os.getenv('CACHE_REGION', 'local'))
     print(func.__name__, str(args))
@@ -164,6 +207,11 @@ def test_decorator_integrations():
         print("underconstruction(set([1,2,3,4])) first call: ", clk_13 - clk_12)
         print("underconstruction(set([1,2,3,4])) second call: ", clk_14 - clk_13)
 
+        speedup_invoker(render, 'hello')
+        assert render('hello') == b'<p>hello</p>'
+        speedup_invoker(logged, 7)
+        assert logged(7, log=[]) == 21
+
         echo_invoker(1)
         echo_invoker(1)
         echo_invoker(True)
@@ -178,3 +226,109 @@ def test_decorator_integrations():
         echo_invoker('hello')
     finally:
         stop_dummy_servers(services)
+
+
+class Point:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+def test_call_keys():
+    assert call_key(echo, ({'a': 1, 'b': [2, 3]},), {}) == call_key(echo, ({'b': [2, 3], 'a': 1},), {})
+    assert call_key(echo, ({3, 1, 2},), {}) == call_key(echo, ({1, 2, 3},), {})
+    assert call_key(echo, (), {'a': 1, 'b': 2}) == call_key(echo, (), {'b': 2, 'a': 1})
+    assert call_key(echo, (), {'a': 1}) != call_key(echo, (), {'a': 2})
+    assert call_key(echo, (1,), {}) != call_key(echo, (True,), {})
+    assert call_key(echo, (1,), {}) != call_key(echo, (1.0,), {})
+    assert call_key(echo, ('ab', 'c'), {}) != call_key(echo, ('a', 'bc'), {})
+    assert call_key(echo, ([1, 2],), {}) != call_key(echo, ((1, 2),), {})
+    # MEMO: objects are keyed by their state, not by their address
+    assert call_key(echo, (Point(1, 2),), {}) == call_key(echo, (Point(1, 2),), {})
+    assert call_key(echo, (Point(1, 2),), {}) != call_key(echo, (Point(2, 1),), {})
+    assert call_key(echo, (1,), {}) != call_key(negate, (1,), {})
+    assert call_key(Fidget.spinner, (), {}).startswith('Fidget.spinner--')
+    assert call_key(echo, (1, []), {}, lambda value, log: value) == call_key(echo, (1, ['x']), {}, lambda value, log: value)
+
+
+def test_decorator_coalescing():
+    services = []
+    try:
+        ZerocacheClient.clear_instance(os.getenv('CACHE_REGION', 'local'))
+        zc: ZerocacheClient = ZerocacheClient.get_instance(os.getenv('CACHE_REGION', 'local'))
+        services = start_dummy_servers()
+        deadline = time.time() + 10
+        while len(zc.services.get('local', [])) < 1 and time.time() < deadline:
+            time.sleep(0.25)
+
+        print('concurrent misses of the same call run it once')
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(popular, [21] * 8))
+        print(results, computations)
+        assert results == [42] * 8
+        assert computations == [21]
+
+        print('leases: one owner at a time')
+        other = ZerocacheClient(os.getenv('CACHE_REGION', 'local'), probe_interval=None)
+        deadline = time.time() + 10
+        while len(other.services.get('local', [])) < 1 and time.time() < deadline:
+            time.sleep(0.25)
+        assert other.acquire_lease('some-key', 5)
+        assert not zc.acquire_lease('some-key', 5)
+        assert other.release_lease('some-key')
+        assert zc.acquire_lease('some-key', 5)
+        assert zc.release_lease('some-key')
+
+        print("another process holds the lease, the call waits for its result rather than running")
+        key = call_key(leased, (5,), {})
+        assert other.acquire_lease(key, 5)
+        t0 = time.time()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            waiting = executor.submit(leased, 5)
+            time.sleep(1)
+            other.put(key, pickle.dumps(-1), 60)
+            other.release_lease(key)
+            assert waiting.result() == -1
+        print('waited', time.time() - t0, computations)
+        assert computations == [21]
+        other.stop_probing()
+    finally:
+        stop_dummy_servers(services)
+
+
+def test_decorator_refresh():
+    services = []
+    try:
+        ZerocacheClient.clear_instance(os.getenv('CACHE_REGION', 'local'))
+        zc: ZerocacheClient = ZerocacheClient.get_instance(os.getenv('CACHE_REGION', 'local'))
+        services = start_dummy_servers()
+        deadline = time.time() + 10
+        while len(zc.services.get('local', [])) < 1 and time.time() < deadline:
+            time.sleep(0.25)
+
+        print('entries come with their ttl, age and compute time')
+        assert stale_ok('a') == ('a', 1)
+        (ok, _, meta) = zc.get_entry(call_key(stale_ok, ('a',), {}))
+        print(meta)
+        assert ok and 29 < meta['ttl'] <= 31 and meta['delta'] >= 1.0
+
+        print('past its expiry, the stale value is served while one refresh runs in the background')
+        time.sleep(1.5)
+        t0 = time.time()
+        assert stale_ok('a') == ('a', 1)
+        assert stale_ok('a') == ('a', 1)
+        print('stale calls took', time.time() - t0)
+        assert time.time() - t0 < 1.0
+        time.sleep(1.5)
+        assert stale_ok('a') == ('a', 2)
+        assert generations == ['a', 'a']
+
+        print('xfetch: a value that takes long to compute is refreshed before it expires')
+        assert early('b') == ('b', 3)
+        # MEMO: refreshes are drawn at random, almost surely on the first hits with such a beta
+        deadline = time.time() + 5
+        while early('b') == ('b', 3) and time.time() < deadline:
+            time.sleep(0.25)
+        assert early('b')[1] > 3
+        print('ttl after the early refresh', zc.get_entry(call_key(early, ('b',), {}))[2])
+    finally:
+        stop_dummy_servers(services)
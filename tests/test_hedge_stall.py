@@ -0,0 +1,66 @@
+import time
+from zerocache import ZerocacheClient, ZerocacheServer, ZerocacheMemoryNetwork
+
+
+def start_servers(network):
+    servers = [
+        ZerocacheServer('10.0.0.1', port=7601, region='local', network=network, probe_interval=0, anti_entropy_interval=0)
+        , ZerocacheServer('10.0.0.2', port=7602, region='local', network=network, probe_interval=0, anti_entropy_interval=0)
+    ]
+    for server in servers:
+        server.start()
+        server.store('local', 'foo', b'bar', 60)
+    return servers
+
+def timed_gets(zc, count):
+    latencies = []
+    for _ in range(count):
+        t0 = time.perf_counter()
+        assert zc.get('foo') == (True, b'bar')
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+
+def test_hedge_stall():
+    network = ZerocacheMemoryNetwork(seed=1)
+    servers = start_servers(network)
+    # MEMO: the breaker would soon take the stalled node out of the race, keep it in
+    zc = ZerocacheClient('local', network=network, probe_interval=0, hedged=True, hedge_delay=0.05, hedge_workers=4
+        , breaker_threshold=1000)
+    try:
+        assert zc.get('foo') == (True, b'bar')
+
+        print('one node stalls: its requests never answer, and run until they time out')
+        network.partition('local', servers[0].svcname)
+        latencies = timed_gets(zc, 40)
+        print('max latency', max(latencies))
+        print('the losers give their slot back once the winner answered, the hedges never wait for one')
+        assert max(latencies) < 0.2
+        assert zc.hedge_slots._value == 4
+        assert zc.inflight[servers[0].svcname] > 0
+    finally:
+        for server in servers:
+            server.stop()
+
+def test_hedge_latency_shift():
+    network = ZerocacheMemoryNetwork(seed=1)
+    servers = start_servers(network)
+    zc = ZerocacheClient('local', network=network, probe_interval=0, hedged=True, breaker_backoff=30)
+    try:
+        print('warm up on a fast network, the hedge delay follows the p95 of the reads')
+        timed_gets(zc, 40)
+        assert zc.current_hedge_delay() < 0.01
+
+        print('the latency rises well under the tier timeout, the reads wait for it rather than missing')
+        network.latency = 0.12
+        latencies = timed_gets(zc, 10)
+        assert min(latencies) >= 0.12 and max(latencies) < 0.5
+        assert all(zc.breaker(info).info()['state'] == 'closed' for info in zc.services['local'])
+
+        print('reads cut off by their timeout are samples at that timeout')
+        network.latency = 0.6
+        assert zc.get('foo') == (False, None)
+        assert zc.get_latencies[-1] == 0.5
+    finally:
+        for server in servers:
+            server.stop()
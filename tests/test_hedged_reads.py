@@ -0,0 +1,67 @@
+import subprocess
+import time
+import signal
+import os
+from zerocache import ZerocacheClient
+import requests
+
+
+def start_dummy_servers():
+    local_1 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15001', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    local_2 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15002', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    services = [local_1, local_2]
+    # Sleep 2 seconds to allow "zerconf" to do its thing
+    print('sleep 2')
+    time.sleep(1)
+    print('sleep 1')
+    time.sleep(1)
+    return services
+
+def stop_dummy_servers(services):
+    print('')
+    print('terminating...')
+    for service in services:
+        print('- one down')
+        service.send_signal(signal.SIGTERM)
+        time.sleep(0.5)
+        service.send_signal(signal.SIGKILL)
+    print('terminating... all done')
+
+
+def test_hedged_reads():
+    services = []
+    try:
+        ZerocacheClient.clear_instance('local')
+        zc: ZerocacheClient = ZerocacheClient('local', hedged=True, hedge_delay=0.1)
+        services = start_dummy_servers()
+        deadline = time.time() + 10
+        while len(zc.services.get('local', [])) < 2 and time.time() < deadline:
+            time.sleep(0.25)
+
+        put_ok = zc.put('foo', 'bar', 60)
+        assert put_ok == True
+        print('wait a second')
+        time.sleep(1)
+
+        (ok, value) = zc.get('foo')
+        print(ok, value, zc.latest_action)
+        assert ok == True
+        assert value == b'bar'
+
+        print("'break' first local server, the hedge to the second one should answer well within 0.5 seconds")
+        requests.post('http://127.0.0.1:15001/extra_latency?seconds=3')
+        for _ in range(2):
+            t0 = time.perf_counter()
+            (ok, value) = zc.get('foo')
+            latency = time.perf_counter() - t0
+            print(ok, value, zc.latest_action, latency)
+            assert ok == True
+            assert ':15002' in zc.latest_action
+            assert latency < 0.5
+
+        (ok, value) = zc.get('missing')
+        print('miss', ok, value)
+        assert ok == False
+        assert value == None
+    finally:
+        stop_dummy_servers(services)
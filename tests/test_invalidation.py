@@ -0,0 +1,142 @@
+import time
+from zerocache import ZerocacheClient, ZerocacheServer, ZerocacheMemoryNetwork, auto_zerocache
+from zerocache.decorators import call_key
+from zerocache.store import ZerocacheStore, ZerocacheEntry, MAX_PREFIX_INVALIDATIONS
+
+
+def start_servers(network):
+    servers = [
+        ZerocacheServer('10.0.0.1', port=7101, region='local', network=network, probe_interval=0, anti_entropy_interval=0)
+        , ZerocacheServer('10.0.0.2', port=7102, region='local', network=network, probe_interval=0, anti_entropy_interval=0)
+        , ZerocacheServer('10.0.1.1', port=7103, region='faraway', network=network, probe_interval=0, anti_entropy_interval=0)
+    ]
+    for server in servers:
+        server.start()
+    return servers
+
+def eventually(check, deadline=5):
+    deadline = time.time() + deadline
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.05)
+    return False
+
+def held(servers, key):
+    return [server.lookup('local', key) is not None for server in servers]
+
+computations = []
+
+@auto_zerocache('local', tags=lambda user: [f'user:{user}'])
+def profile(user):
+    computations.append(user)
+    return {'user': user}
+
+
+def test_invalidation():
+    network = ZerocacheMemoryNetwork(seed=1)
+    servers = start_servers(network)
+    zc = ZerocacheClient('local', network=network, probe_interval=0)
+    try:
+        print('tagged writes are indexed on every node, the tags travel with the replicas')
+        assert zc.put('user:1:name', b'ada', 60, tags=['user:1'])
+        assert zc.put('user:1:mail', b'ada@example.com', 60, tags=['user:1', 'mail'])
+        assert zc.put('user:2:name', b'bob', 60, tags=['user:2'])
+        assert zc.put_many({'page:home': b'home', 'page:about': b'about'}, 60, tags=['pages'])
+        assert zc.put('other', b'other', 60)
+        assert eventually(lambda: all(all(held(servers, key)) for key in ('user:1:name', 'user:1:mail', 'user:2:name', 'page:home', 'page:about', 'other')))
+        assert servers[2].lookup_entry('local', 'user:1:mail').tags == ('user:1', 'mail')
+        assert servers[1].lookup_entry('local', 'page:home').tags == ('pages',)
+
+        print('one call drops every entry of a tag, on all nodes of all regions')
+        assert zc.invalidate(tags=['user:1'])
+        assert eventually(lambda: not any(held(servers, 'user:1:name') + held(servers, 'user:1:mail')))
+        assert all(held(servers, 'user:2:name')) and all(held(servers, 'other'))
+        assert zc.get('user:1:name') == (False, None)
+
+        print('and every entry under a prefix')
+        assert zc.invalidate(prefixes=['page:'])
+        assert eventually(lambda: not any(held(servers, 'page:home') + held(servers, 'page:about')))
+        assert all(held(servers, 'user:2:name')) and all(held(servers, 'other'))
+        servers[0].store('local', 'page:late', b'late', 60, stamp=time.time() - 60)
+        assert servers[0].lookup('local', 'page:late') is None
+        assert servers[0].store('local', 'page:new', b'new', 60) and servers[0].lookup('local', 'page:new') == b'new'
+        print('entries hidden by a prefix are buried once read, or swept with the next anti-entropy round')
+        assert 'page:about' not in [key for (key, _) in servers[1].local_cache.items()]
+        assert {'page:home', 'page:about'} <= {key for (key, _, _) in servers[1].local_cache.tombstones()}
+
+        print('writes newer than the invalidation are kept, older ones arriving late are dropped')
+        stamp = time.time()
+        servers[0].invalidate('local', tags=['user:2'], stamp=stamp)
+        assert servers[0].lookup('local', 'user:2:name') is None
+        servers[0].store('local', 'user:2:name', b'late', 60, stamp=stamp - 1, tags=['user:2'])
+        assert servers[0].lookup('local', 'user:2:name') is None
+        assert servers[0].store('local', 'user:2:name', b'bob again', 60, stamp=stamp + 1, tags=['user:2'])
+        assert servers[0].lookup('local', 'user:2:name') == b'bob again'
+        assert servers[0].invalidate('local', tags=['user:2'], stamp=stamp) == 0
+        assert servers[0].lookup('local', 'user:2:name') == b'bob again'
+
+        print('an entry written again without the tag is not dropped with it')
+        assert zc.put('retagged', b'v1', 60, tags=['old'])
+        assert zc.put('retagged', b'v2', 60)
+        assert eventually(lambda: all(server.lookup('local', 'retagged') == b'v2' for server in servers))
+        assert zc.invalidate(tags=['old'])
+        time.sleep(0.3)
+        assert all(held(servers, 'retagged'))
+
+        print('the remote caches only drop the entries of the invalidated region')
+        servers[2].store('elsewhere', 'user:3:name', b'carol', 60, tags=['user:3'])
+        servers[2].store('local', 'user:3:mail', b'carol@example.com', 60, tags=['user:3'])
+        assert servers[2].invalidate('elsewhere', tags=['user:3']) == 1
+        assert servers[2].lookup('elsewhere', 'user:3:name') is None
+        assert servers[2].lookup('local', 'user:3:mail') == b'carol@example.com'
+
+        print('decorated functions tag their results, and can drop them all')
+        ZerocacheClient._instances['local'] = zc
+        keys = [call_key(profile, (user,), {}) for user in (7, 8)]
+        assert profile(7) == {'user': 7} and profile(8) == {'user': 8}
+        assert profile(7) == {'user': 7} and computations == [7, 8]
+        assert eventually(lambda: all(all(held(servers, key)) for key in keys))
+        assert servers[2].lookup_entry('local', keys[0]).tags == ('profile', 'user:7')
+        assert profile.invalidate()
+        assert eventually(lambda: not any(held(servers, keys[0]) + held(servers, keys[1])))
+        assert profile(7) == {'user': 7} and computations == [7, 8, 7]
+        assert eventually(lambda: all(held(servers, keys[0])))
+        assert zc.invalidate(tags=['user:7'])
+        assert eventually(lambda: not any(held(servers, keys[0])))
+        assert profile(7) == {'user': 7} and computations == [7, 8, 7, 7]
+    finally:
+        ZerocacheClient._instances.pop('local', None)
+        for server in servers:
+            server.stop()
+
+
+def test_prefix_invalidation_lifetime():
+    store = ZerocacheStore(maxsize=4096, shards=4)
+    def put(key, expiry=3600):
+        assert store.put(key, ZerocacheEntry(key.encode(), time.monotonic() + expiry))
+    put('long')
+    put('page:1')
+    put('page:2', expiry=60)
+
+    print('an invalidated prefix is kept for the tombstone ttl, not as long as the longest lived entry')
+    store.invalidate(prefixes=['page:'], ttl=0.2)
+    (_, expires, _, _) = store.prefix_invalidations[(None, 'page:')]
+    assert expires <= time.monotonic() + 0.2
+    assert store.get('page:1') is None
+    print('past it, until a sweep buried what it hid')
+    time.sleep(0.3)
+    assert store.prefix_invalidations and store.prefix_lengths == (5,)
+    assert {key for (key, _) in store.items()} == {'long'}
+    assert store.prefix_invalidations == {} and store.prefix_lengths == ()
+    assert len(store) == 1 and 'page:2' in {key for (key, _, _) in store.tombstones()}
+    put('page:3')
+    assert store.get('page:3') is not None and store.get('long') is not None
+
+    print('past MAX_PREFIX_INVALIDATIONS, the store is swept and the oldest are forgotten')
+    for index in range(MAX_PREFIX_INVALIDATIONS + 10):
+        put(f'item:{index}:value')
+        store.invalidate(prefixes=[f'item:{index}:'])
+    assert len(store.prefix_invalidations) <= MAX_PREFIX_INVALIDATIONS
+    assert all(store.get(f'item:{index}:value') is None for index in range(MAX_PREFIX_INVALIDATIONS + 10))
+    assert (None, f'item:{MAX_PREFIX_INVALIDATIONS + 9}:') in store.prefix_invalidations
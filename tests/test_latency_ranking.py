@@ -0,0 +1,135 @@
+import subprocess
+import time
+import signal
+import requests
+from zerocache import ZerocacheClient
+from zerocache.selection import ZerocacheCircuitBreaker
+
+
+def start_dummy_servers():
+    local_1 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15001', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    local_2 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15002', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    services = [local_1, local_2]
+    # Sleep 2 seconds to allow "zerconf" to do its thing
+    print('sleep 2')
+    time.sleep(1)
+    print('sleep 1')
+    time.sleep(1)
+    return services
+
+def stop_dummy_servers(services):
+    print('')
+    print('terminating...')
+    for service in services:
+        print('- one down')
+        service.send_signal(signal.SIGTERM)
+        time.sleep(0.5)
+        service.send_signal(signal.SIGKILL)
+    print('terminating... all done')
+
+
+def local_ewmas(zc):
+    # MEMO: EWMA in ms of each local node by port, None until it was measured
+    return {info.port: zc.latencies.ewma('local', info.name) for info in zc.services.get('local', [])}
+
+def slower_by(zc, slow, fast, ms):
+    ewmas = local_ewmas(zc)
+    return None not in ewmas.values() and len(ewmas) == 2 and ewmas[slow] - ewmas[fast] > ms
+
+def test_fastest_local_node():
+    services = []
+    zc = None
+    try:
+        zc = ZerocacheClient('local', local_order='fastest', probe_interval=0.5)
+        services = start_dummy_servers()
+        deadline = time.time() + 10
+        while len(zc.services.get('local', [])) < 2 and time.time() < deadline:
+            time.sleep(0.25)
+
+        print("slow down the first local server, without making it time out")
+        requests.post('http://127.0.0.1:15001/extra_latency?seconds=0.3')
+        # MEMO: a few probe rounds for the EWMA to follow; both nodes must have been measured (an unmeasured node
+        #       ranks last) and the extra latency must show in the slow one's EWMA before the ranking is checked
+        deadline = time.time() + 10
+        while not slower_by(zc, 15001, 15002, 200) and time.time() < deadline:
+            time.sleep(0.25)
+        print('ewmas', local_ewmas(zc))
+        assert slower_by(zc, 15001, 15002, 200)
+        zc.rerank()
+        info = zc.latency_info()
+        print('latency info', info)
+        assert len(info['local']['nodes']) == 2
+        assert zc.ranked_services['local'][0].port == 15002
+        zc.put('foo', 'foo', 60)
+        time.sleep(0.5)
+        for _ in range(3):
+            zc.get('foo')
+            print(zc.latest_action)
+            assert ':15002' in zc.latest_action
+
+        print("and the other way around")
+        requests.post('http://127.0.0.1:15001/extra_latency?seconds=0')
+        requests.post('http://127.0.0.1:15002/extra_latency?seconds=0.3')
+        deadline = time.time() + 10
+        while not slower_by(zc, 15002, 15001, 200) and time.time() < deadline:
+            time.sleep(0.25)
+        print('ewmas', local_ewmas(zc))
+        assert slower_by(zc, 15002, 15001, 200)
+        zc.rerank()
+        assert zc.ranked_services['local'][0].port == 15001
+        zc.put('bar', 'bar', 60)
+        print(zc.latest_action)
+        assert ':15001' in zc.latest_action
+    finally:
+        if zc is not None:
+            zc.stop_probing()
+        stop_dummy_servers(services)
+
+
+def test_circuit_breaker():
+    services = []
+    zc = None
+    try:
+        # MEMO: no probes, the breaker only learns from the client's own requests
+        zc = ZerocacheClient('local', probe_interval=None, breaker_threshold=2, breaker_backoff=30)
+        services = start_dummy_servers()
+        deadline = time.time() + 10
+        while len(zc.services.get('local', [])) < 2 and time.time() < deadline:
+            time.sleep(0.25)
+        zc.put('foo', 'foo', 60)
+        time.sleep(0.5)
+
+        print("'break' the first local server")
+        requests.post('http://127.0.0.1:15001/extra_latency?seconds=3')
+        broken = [info for info in zc.services['local'] if info.port == 15001][0]
+        while zc.breaker(broken).info()['state'] == 'closed':
+            (ok, _) = zc.get('foo')
+            assert ok
+        print('breaker', zc.breaker(broken).info())
+
+        print("no more 0.5s timeouts, every GET goes to the second local server")
+        for _ in range(4):
+            t0 = time.time()
+            (ok, _) = zc.get('foo')
+            print(zc.latest_action, time.time() - t0)
+            assert ok
+            assert ':15002' in zc.latest_action
+            assert time.time() - t0 < 0.4
+    finally:
+        if zc is not None:
+            zc.stop_probing()
+        stop_dummy_servers(services)
+
+
+def test_half_open_trial():
+    breaker = ZerocacheCircuitBreaker(threshold=1, backoff=0.2)
+    breaker.failure()
+    assert not breaker.is_available() and not breaker.acquire_trial()
+    time.sleep(0.3)
+    print('asking whether the node is available does not take its trial')
+    assert all(breaker.is_available() for _ in range(5))
+    assert breaker.acquire_trial()
+    print('the next requests skip the node while the trial is pending')
+    assert not breaker.is_available() and not breaker.acquire_trial()
+    breaker.success()
+    assert breaker.is_available() and breaker.acquire_trial()
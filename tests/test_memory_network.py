@@ -0,0 +1,84 @@
+import time
+import pickle
+from zerocache import ZerocacheClient, ZerocacheServer, ZerocacheMemoryNetwork
+
+
+def start_servers(network):
+    servers = [
+        ZerocacheServer('10.0.0.1', port=7001, region='local', network=network, probe_interval=0, anti_entropy_interval=0)
+        , ZerocacheServer('10.0.0.2', port=7002, region='local', network=network, probe_interval=0, anti_entropy_interval=0)
+        , ZerocacheServer('10.0.1.1', port=7003, region='faraway', network=network, probe_interval=0, anti_entropy_interval=0)
+    ]
+    for server in servers:
+        server.start()
+    return servers
+
+def eventually(check, deadline=5):
+    deadline = time.time() + deadline
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_memory_network():
+    network = ZerocacheMemoryNetwork(seed=1)
+    servers = start_servers(network)
+    try:
+        print('discovery is immediate, no multicast involved')
+        zc = ZerocacheClient('local', network=network, probe_interval=0)
+        assert len(zc.services['local']) == 2 and len(zc.services['faraway']) == 1
+        assert list(zc.ranked_neighbours) == ['faraway']
+
+        print('writes are replicated through the network, compressed values included')
+        big = b'zerocache' * 1000
+        assert zc.put('a', pickle.dumps('alpha'), 60)
+        assert zc.put('big', big, 60)
+        assert eventually(lambda: all(server.lookup('local', 'a') is not None for server in servers))
+        assert pickle.loads(zc.get('a')[1]) == 'alpha'
+        assert zc.get('big') == (True, big)
+        assert zc.get_many(['a', 'big', 'missing']) == {'a': pickle.dumps('alpha'), 'big': big}
+
+        print('a partition keeps writes from the other region')
+        network.partition('local', 'faraway')
+        assert zc.put('cut', b'cut', 60)
+        assert eventually(lambda: servers[1].lookup('local', 'cut') is not None)
+        time.sleep(0.6)
+        assert servers[2].lookup('local', 'cut') is None
+        network.heal()
+
+        print('a node that is cut off times out, the client falls back to the other one')
+        network.partition(servers[0].svcname, 'local')
+        network.partition(servers[1].svcname, 'local')
+        t0 = time.perf_counter()
+        (ok, value) = zc.get('a')
+        assert ok and pickle.loads(value) == 'alpha'
+        assert ':7003' in zc.latest_action
+        assert time.perf_counter() - t0 >= 1.0
+        network.heal()
+
+        print('latency is injected per pair of regions')
+        network.latency = lambda source, target: 0.6 if target == 'local' else 0.0
+        (ok, _) = zc.get('a')
+        assert ok and ':7003' in zc.latest_action
+        network.latency = 0.0
+
+        print('lost requests are counted')
+        network.loss = 1.0
+        assert zc.get('a') == (False, None)
+        network.loss = 0.0
+        assert network.info()['dropped'] >= 3
+
+        print('stopped nodes leave the cluster, snapshots taken before are left as they were')
+        before = zc.registry.snapshot
+        servers[2].stop()
+        assert 'faraway' not in zc.services
+        assert len(before.services['faraway']) == 1
+        assert zc.registry.node(servers[2].svcname) is None
+        node = zc.registry.node(servers[0].svcname)
+        assert node.base_url == 'http://10.0.0.1:7001' and node.region == 'local' and node.stats.ewma is not None
+        assert zc.get('a')[0]
+    finally:
+        for server in servers:
+            server.stop()
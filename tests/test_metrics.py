@@ -0,0 +1,88 @@
+import subprocess
+import time
+import signal
+from zerocache import ZerocacheClient
+import pickle
+import requests
+
+
+def start_dummy_servers():
+    local_1 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15071', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    local_2 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15072', 'local'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    remote_1 = subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', '15073', 'faraway'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    services = [local_1, local_2, remote_1]
+    # Sleep 2 seconds to allow "zerconf" to do its thing
+    print('sleep 2')
+    time.sleep(1)
+    print('sleep 1')
+    time.sleep(1)
+    return services
+
+def stop_dummy_servers(services):
+    print('')
+    print('terminating...')
+    for service in services:
+        print('- one down')
+        service.send_signal(signal.SIGTERM)
+        time.sleep(0.5)
+        service.send_signal(signal.SIGKILL)
+    print('terminating... all done')
+
+def scrape(port):
+    samples = {}
+    for line in requests.get(f'http://127.0.0.1:{port}/metrics').text.splitlines():
+        if line and not line.startswith('#'):
+            (name, value) = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_metrics():
+    services = []
+    try:
+        ZerocacheClient.clear_instance('local')
+        zc: ZerocacheClient = ZerocacheClient.get_instance('local')
+        services = start_dummy_servers()
+        deadline = time.time() + 10
+        while (len(zc.services.get('local', [])) < 2 or len(zc.services.get('faraway', [])) < 1) and time.time() < deadline:
+            time.sleep(0.25)
+
+        assert zc.put('a', pickle.dumps('alpha'), 60)
+        time.sleep(0.5)
+        for _ in range(4):
+            assert zc.get('a')[0]
+        assert zc.get('missing') == (False, None)
+        # MEMO: written on the remote node only, the local nodes miss it
+        assert requests.put('http://127.0.0.1:15073/local/far?expiry=60&recurse=0', data=b'far').status_code == 200
+        assert zc.get('far') == (True, b'far')
+
+        print('the client knows which tier answered, and how fast each node was')
+        stats = zc.stats()
+        print(stats)
+        assert stats['tiers']['local'] == 4
+        assert stats['tiers']['remote'] == 1
+        assert stats['tiers']['miss'] == 1
+        assert stats['tier_rates']['local'] > 0.5
+        assert any(node['region'] == 'faraway' and node['methods']['GET']['requests'] > 0 for node in stats['nodes'].values())
+        assert all(node['methods']['GET']['p99_ms'] >= node['methods']['GET']['p50_ms'] > 0 for node in stats['nodes'].values() if 'GET' in node['methods'])
+        assert 'zerocache_client_gets_total{tier="local"} 4' in zc.metrics_text()
+
+        print('the nodes export their counts in the Prometheus text format')
+        response = requests.get('http://127.0.0.1:15071/metrics')
+        assert response.headers['Content-Type'].startswith('text/plain')
+        assert '# TYPE zerocache_http_request_duration_seconds histogram' in response.text
+        samples = {}
+        for port in (15071, 15072):
+            for (name, value) in scrape(port).items():
+                samples[name] = samples.get(name, 0) + value
+        print(samples)
+        assert samples['zerocache_cache_hits_total{cache="local"}'] >= 4
+        assert samples['zerocache_cache_misses_total{cache="local"}'] >= 3
+        assert samples['zerocache_cache_entries{cache="local"}'] >= 2
+        assert samples['zerocache_http_requests_total{route="/<region>/<key>",method="GET",status="200"}'] >= 4
+        assert samples['zerocache_http_requests_total{route="/<region>/<key>",method="GET",status="404"}'] >= 3
+        assert samples['zerocache_http_request_duration_seconds_count{route="/<region>/<key>",method="PUT"}'] >= 1
+        assert samples['zerocache_replication_duration_seconds_count{peer="' + zc.services['faraway'][0].name + '"}'] >= 1
+        assert samples['zerocache_ping_duration_seconds_count{region="faraway"}'] >= 1
+    finally:
+        stop_dummy_servers(services)
@@ -0,0 +1,101 @@
+import time
+from zerocache import ZerocacheClient, ZerocacheServer, ZerocacheMemoryNetwork, ZerocacheNearCache
+
+
+def start_servers(network):
+    servers = [
+        ZerocacheServer('10.0.0.1', port=7401, region='local', network=network, probe_interval=0, anti_entropy_interval=0
+            , max_value_size=1024)
+        , ZerocacheServer('10.0.0.2', port=7402, region='local', network=network, probe_interval=0, anti_entropy_interval=0
+            , max_value_size=1024)
+    ]
+    for server in servers:
+        server.start()
+    return servers
+
+def eventually(check, deadline=5):
+    deadline = time.time() + deadline
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.05)
+    return False
+
+def near(zc, key):
+    return zc.near_cache.get(key)
+
+
+def test_near_cache():
+    network = ZerocacheMemoryNetwork(seed=1)
+    servers = start_servers(network)
+    zc = ZerocacheClient('local', network=network, probe_interval=0, compression=None
+        , near_cache=ZerocacheNearCache(max_bytes=4096, max_staleness=0.5))
+    try:
+        print('writes fill the near cache, reads are answered from it')
+        assert zc.put('a', b'alpha', 60)
+        assert zc.get('a') == (True, b'alpha')
+        assert zc.latest_action == 'GET: near cache'
+        assert zc.near_cache_info()['hits'] == 1 and zc.near_cache_info()['entries'] == 1
+
+        print('misses read through, and fill it')
+        assert eventually(lambda: all(server.lookup('local', 'a') is not None for server in servers))
+        for server in servers:
+            server.store('local', 'b', b'beta', 60)
+        assert near(zc, 'b') is None
+        assert zc.get('b') == (True, b'beta')
+        assert zc.latest_action != 'GET: near cache'
+        assert near(zc, 'b') == b'beta'
+        assert zc.get_many(['c']) == {}
+        for server in servers:
+            server.store('local', 'c', b'gamma', 60)
+        assert zc.get_many(['c']) == {'c': b'gamma'} and near(zc, 'c') == b'gamma'
+
+        print('entries expire after max_staleness, writes made elsewhere show up then')
+        for server in servers:
+            server.store('local', 'b', b'beta 2', 60)
+        assert zc.get('b') == (True, b'beta')
+        assert eventually(lambda: near(zc, 'b') is None, deadline=1)
+        assert zc.get('b') == (True, b'beta 2')
+
+        print('or sooner when written with a shorter expiry')
+        zc.near_cache.put('short', b'short', 0.1)
+        assert near(zc, 'short') == b'short'
+        time.sleep(0.15)
+        assert near(zc, 'short') is None
+
+        print('puts, deletes and invalidations drop the entries')
+        assert zc.put('a', b'alpha 2', 60) and near(zc, 'a') == b'alpha 2'
+        assert zc.delete('a') and near(zc, 'a') is None
+        assert eventually(lambda: all(server.lookup('local', 'a') is None for server in servers))
+        assert zc.get('a') == (False, None)
+        assert zc.put('d', b'delta', 60) and near(zc, 'd') == b'delta'
+        assert zc.put_many({'d': b'delta 2', 'e': b'epsilon'}, 60)
+        assert near(zc, 'd') is None and near(zc, 'e') is None
+        assert eventually(lambda: all(server.lookup('local', 'd') == b'delta 2' for server in servers))
+        assert zc.get_many(['d', 'e']) == {'d': b'delta 2', 'e': b'epsilon'}
+        assert near(zc, 'd') == b'delta 2'
+        assert zc.delete_many(['d', 'e'])
+        assert near(zc, 'd') is None and near(zc, 'e') is None
+        assert zc.put('f', b'phi', 60) and near(zc, 'f') == b'phi'
+        assert zc.invalidate(prefixes=['nothing:'])
+        assert zc.near_cache_info()['entries'] == 0
+
+        print('refused writes leave the previous value out of the near cache too')
+        assert zc.put('g', b'small', 60) and near(zc, 'g') == b'small'
+        assert not zc.put('g', b'x' * 2048, 60)
+        assert near(zc, 'g') is None
+        assert eventually(lambda: all(server.lookup('local', 'g') == b'small' for server in servers))
+        assert zc.get('g') == (True, b'small')
+        assert not zc.put_many({'g': b'x' * 2048}, 60)
+        assert near(zc, 'g') is None
+
+        print('the near cache is bounded in bytes of values')
+        for index in range(8):
+            zc.near_cache.put(f'big_{index}', b'x' * 1000, 60)
+        assert zc.near_cache_info()['currsize'] <= 4096
+        assert near(zc, 'big_7') is not None and near(zc, 'big_0') is None
+        zc.near_cache.put('too_big', b'x' * 8192, 60)
+        assert near(zc, 'too_big') is None
+    finally:
+        for server in servers:
+            server.stop()
@@ -0,0 +1,69 @@
+import subprocess
+import time
+import signal
+import requests
+from zerocache import ZerocacheClient
+import pickle
+
+
+def start_dummy_servers():
+    services = []
+    for port in ['15031', '15032', '15033']:
+        services.append(subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', port, 'partitioned', '--partitioned'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    # Sleep 2 seconds to allow "zerconf" to do its thing
+    print('sleep 2')
+    time.sleep(1)
+    print('sleep 1')
+    time.sleep(1)
+    return services
+
+def stop_dummy_servers(services):
+    print('')
+    print('terminating...')
+    for service in services:
+        print('- one down')
+        service.send_signal(signal.SIGTERM)
+        time.sleep(0.5)
+        service.send_signal(signal.SIGKILL)
+    print('terminating... all done')
+
+def local_entries(ports):
+    return [requests.get(f'http://127.0.0.1:{port}/local_cache_info').json()['entries'] for port in ports]
+
+
+def test_partitioned_region():
+    services = []
+    try:
+        ZerocacheClient.clear_instance('partitioned')
+        zc = ZerocacheClient('partitioned', partitioned=True, replicas=2)
+        services = start_dummy_servers()
+        deadline = time.time() + 10
+        while len(zc.services.get('partitioned', [])) < 3 and time.time() < deadline:
+            time.sleep(0.25)
+        # MEMO: the nodes need to see each other too, not only the client
+        time.sleep(1)
+
+        keys = [f'key-{i}' for i in range(30)]
+        for key in keys:
+            assert zc.put(key, pickle.dumps(key), 60)
+        time.sleep(0.5)
+
+        # MEMO: 2 copies of each key, spread over 3 nodes, rather than 3 copies
+        entries = local_entries(['15031', '15032', '15033'])
+        print('entries per node', entries)
+        assert sum(entries) == 2 * len(keys)
+        for key in keys:
+            (ok, value) = zc.get(key)
+            assert ok and pickle.loads(value) == key
+
+        print('a node leaves, its keys are handed over to the next owners')
+        services[0].send_signal(signal.SIGTERM)
+        time.sleep(2)
+        entries = local_entries(['15032', '15033'])
+        print('entries per node', entries)
+        assert sum(entries) == 2 * len(keys)
+        for key in keys:
+            (ok, value) = zc.get(key)
+            assert ok and pickle.loads(value) == key
+    finally:
+        stop_dummy_servers(services)
@@ -0,0 +1,129 @@
+import time
+import requests
+from zerocache import ZerocacheClient, ZerocacheServer, ZerocacheMemoryNetwork
+
+
+def start_servers(network, ack, **options):
+    servers = [
+        ZerocacheServer('10.0.0.1', port=7301, region='local', network=network, probe_interval=0, anti_entropy_interval=0
+            , replication_ack=ack, **options)
+        , ZerocacheServer('10.0.0.2', port=7302, region='local', network=network, probe_interval=0, anti_entropy_interval=0
+            , replication_ack=ack)
+        , ZerocacheServer('10.0.0.3', port=7303, region='local', network=network, probe_interval=0, anti_entropy_interval=0
+            , replication_ack=ack)
+        , ZerocacheServer('10.0.1.1', port=7304, region='faraway', network=network, probe_interval=0, anti_entropy_interval=0
+            , replication_ack=ack)
+    ]
+    for server in servers:
+        server.start()
+    return servers
+
+def stop_servers(servers):
+    for server in servers:
+        server.stop()
+
+def session_for(network, zc):
+    session = requests.Session()
+    session.mount('http://', network.adapter(zc))
+    return session
+
+def put(session, key, value=b'value'):
+    t0 = time.perf_counter()
+    status = session.put(f'http://10.0.0.1:7301/local/{key}?expiry=60', data=value).status_code
+    return (status, time.perf_counter() - t0)
+
+def eventually(check, deadline=5):
+    deadline = time.time() + deadline
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_quorum():
+    network = ZerocacheMemoryNetwork(seed=1)
+    servers = start_servers(network, 'quorum')
+    zc = ZerocacheClient('local', network=network, probe_interval=0)
+    session = session_for(network, zc)
+    try:
+        print('two local peers, the write needs (2 + 1) // 2 = 1 of them, the other region is not counted')
+        network.partition(servers[0].svcname, servers[1].svcname)
+        network.partition('local', 'faraway')
+        assert put(session, 'one')[0] == 200
+        assert servers[2].lookup('local', 'one') == b'value'
+        network.heal()
+
+        print('without any local peer the quorum is missed, the write is kept on the node')
+        network.partition(servers[0].svcname, servers[1].svcname)
+        network.partition(servers[0].svcname, servers[2].svcname)
+        (status, elapsed) = put(session, 'none')
+        assert status == 504 and elapsed >= 0.5
+        assert servers[0].lookup('local', 'none') == b'value'
+
+        print('a 504 is the peers missing the quorum, not the node failing: its breaker stays closed')
+        node = [info for info in zc.services['local'] if info.port == 7301][0]
+        for _ in range(3):
+            assert zc.send(node, 'PUT', 'http://10.0.0.1:7301/local/none?expiry=60', data=b'value', timeout=2).status_code == 504
+        assert zc.breaker(node).info()['state'] == 'closed' and zc.breaker(node).info()['failures'] == 0
+        network.heal()
+    finally:
+        stop_servers(servers)
+
+def test_all():
+    network = ZerocacheMemoryNetwork(seed=1)
+    servers = start_servers(network, 'all')
+    zc = ZerocacheClient('local', network=network, probe_interval=0)
+    session = session_for(network, zc)
+    try:
+        print('every peer acknowledges, the other region included')
+        assert put(session, 'everywhere')[0] == 200
+        assert all(server.lookup('local', 'everywhere') == b'value' for server in servers)
+        network.partition(servers[0].svcname, 'faraway')
+        assert put(session, 'not_far')[0] == 504
+        network.heal()
+    finally:
+        stop_servers(servers)
+
+def test_local():
+    network = ZerocacheMemoryNetwork(seed=1)
+    servers = start_servers(network, 'local', replication_workers=1, replication_queue_size=3)
+    zc = ZerocacheClient('local', network=network, probe_interval=0)
+    session = session_for(network, zc)
+    try:
+        print('fire and forget, the write returns before any peer answers')
+        network.partition(servers[0].svcname, servers[1].svcname)
+        (status, elapsed) = put(session, 'async')
+        assert status == 200 and elapsed < 0.25
+        assert eventually(lambda: servers[2].lookup('local', 'async') == b'value')
+        assert servers[1].lookup('local', 'async') is None
+
+        print('the failures are counted per peer, and exposed as metrics')
+        assert eventually(lambda: servers[0].replicator.info()['sent'] == 3)
+        info = servers[0].replicator.info()
+        assert info['sent'] == 3 and info['failures'] == 1 and info['dropped'] == 0
+        assert set(info['peer_failures']) == {servers[1].svcname}
+        metrics = servers[0].metrics
+        assert metrics.counter('zerocache_replication_failures_total', (('peer', servers[1].svcname),)) == 1
+        assert metrics.counter('zerocache_replication_failures_total', (('peer', servers[2].svcname),)) == 0
+        (_, histograms) = metrics.snapshot()
+        assert histograms[('zerocache_replication_duration_seconds', (('peer', servers[1].svcname),))].count == 1
+        assert histograms[('zerocache_replication_duration_seconds', (('peer', servers[2].svcname),))].count == 1
+        text = session.get('http://10.0.0.1:7301/metrics').text
+        assert f'zerocache_replication_failures_total{{peer="{servers[1].svcname}"}} 1' in text
+
+        print('sends past the queue size are dropped, and counted as failures')
+        for server in servers[1:]:
+            network.partition(servers[0].svcname, server.svcname)
+        for index in range(3):
+            assert put(session, f'queued_{index}')[0] == 200
+        assert servers[0].replicator.info()['dropped'] > 0
+
+        print('stopping does not wait for the queue to drain')
+        t0 = time.perf_counter()
+        servers[0].replicator.stop()
+        assert time.perf_counter() - t0 < 0.25
+        assert servers[0].replicator.queue.qsize() <= 1
+        network.heal()
+    finally:
+        stop_servers(servers)
@@ -0,0 +1,108 @@
+import random
+import time
+from types import SimpleNamespace
+from zerocache import ZerocacheClient, ZerocacheServer, ZerocacheMemoryNetwork
+from zerocache.selection import ZerocacheLeastOutstanding, ZerocacheWeightedRoundRobin, ZerocachePowerOfTwo
+
+
+# MEMO: stands for the client, the strategies only read the in-flight counts and latency EWMAs of the nodes
+class Nodes:
+    def __init__(self, latencies):
+        self.services = [SimpleNamespace(name=name) for name in latencies]
+        self.latencies = latencies
+        self.inflight = {name: 0 for name in latencies}
+        self.picked = {name: 0 for name in latencies}
+
+    def inflight_requests(self, info):
+        return self.inflight[info.name]
+
+    def node_latency(self, info):
+        return self.latencies[info.name]
+
+    def pick(self, strategy):
+        order = strategy.order(self.services, self)
+        assert sorted(info.name for info in order) == sorted(self.latencies)
+        self.picked[order[0].name] += 1
+        return order[0].name
+
+
+def test_least_outstanding():
+    nodes = Nodes({'a': 0.04, 'b': 0.01, 'c': 0.02})
+    strategy = ZerocacheLeastOutstanding()
+    print('requests that never complete are spread evenly, ties go to the fastest node')
+    picks = []
+    for _ in range(300):
+        picks.append(nodes.pick(strategy))
+        nodes.inflight[picks[-1]] += 1
+    assert picks[:6] == ['b', 'c', 'a'] * 2
+    assert max(nodes.picked.values()) - min(nodes.picked.values()) <= 1
+
+    print('a node with fewer requests in flight wins over a faster one')
+    nodes.inflight = {'a': 0, 'b': 5, 'c': 5}
+    assert nodes.pick(strategy) == 'a'
+
+def test_weighted():
+    nodes = Nodes({'a': 0.01, 'b': 0.02, 'c': 0.04})
+    strategy = ZerocacheWeightedRoundRobin()
+    print('shares follow the inverse of the latencies, 4:2:1')
+    picks = [nodes.pick(strategy) for _ in range(700)]
+    assert nodes.picked == {'a': 400, 'b': 200, 'c': 100}
+
+    print('without long runs on the fastest node')
+    longest = max(len(run) for run in ''.join(picks).replace('b', ' ').replace('c', ' ').split())
+    assert longest <= 2
+
+    print('nodes that left are forgotten, the shares adapt to new latencies')
+    nodes.services = nodes.services[:2]
+    nodes.latencies = {'a': 0.02, 'b': 0.02}
+    nodes.picked = {'a': 0, 'b': 0}
+    for _ in range(100):
+        nodes.pick(strategy)
+    assert nodes.picked == {'a': 50, 'b': 50}
+    assert set(strategy.current) == {'a', 'b'}
+
+def test_p2c():
+    random.seed(1)
+    nodes = Nodes({'a': 0.01, 'b': 0.05, 'c': 0.05})
+    strategy = ZerocachePowerOfTwo()
+    print('the fast node wins whenever it is drawn, two times out of three, not every time')
+    for _ in range(3000):
+        nodes.pick(strategy)
+    assert 0.6 < nodes.picked['a'] / 3000 < 0.73
+    assert all(nodes.picked[name] > 400 for name in ('b', 'c'))
+
+    print('loaded with requests, it loses to the slower idle nodes')
+    nodes.inflight['a'] = 9
+    nodes.picked = {'a': 0, 'b': 0, 'c': 0}
+    for _ in range(300):
+        nodes.pick(strategy)
+    assert nodes.picked['a'] == 0
+
+    print('a single node is returned as it is')
+    assert [info.name for info in strategy.order(nodes.services[:1], nodes)] == ['a']
+
+def test_breaker_refusal():
+    network = ZerocacheMemoryNetwork(seed=1)
+    servers = [
+        ZerocacheServer('10.0.0.1', port=7801, region='local', network=network, probe_interval=0, anti_entropy_interval=0)
+        , ZerocacheServer('10.0.0.2', port=7802, region='local', network=network, probe_interval=0, anti_entropy_interval=0)
+    ]
+    for server in servers:
+        server.start()
+        server.store('local', 'key', b'value', 60)
+    zc = ZerocacheClient('local', network=network, probe_interval=0, breaker_threshold=1, breaker_backoff=0.3)
+    try:
+        print('with every breaker open, no request is sent until a backoff elapsed')
+        for info in zc.services['local']:
+            zc.breaker(info).failure()
+        assert zc.get('key') == (False, None)
+        assert all(zc.breaker(info).info()['state'] == 'open' for info in zc.services['local'])
+        assert zc.stats()['nodes'] == {}
+
+        print('then the trial goes through, and closes the breaker of its node')
+        time.sleep(0.35)
+        assert zc.get('key') == (True, b'value')
+        assert [zc.breaker(info).info()['state'] for info in zc.services['local']].count('closed') == 1
+    finally:
+        for server in servers:
+            server.stop()
@@ -0,0 +1,90 @@
+import time
+import requests
+from zerocache import ZerocacheClient, ZerocacheServer, ZerocacheMemoryNetwork
+from zerocache.store import ZerocacheStore, ZerocacheEntry
+
+
+def entry(value, expiry=60):
+    return ZerocacheEntry(value, time.monotonic() + expiry)
+
+
+def test_store_bytes():
+    store = ZerocacheStore(maxsize=4096, size_mode='bytes', shards=4)
+    print('the budget is in bytes of values, split over the shards')
+    for index in range(32):
+        assert store.put(f'key_{index}', entry(b'x' * 256))
+    info = store.info()
+    assert info['size_mode'] == 'bytes' and info['maxsize'] == 4096 and info['shards'] == 4
+    assert info['currsize'] == info['bytes'] <= 4096
+    assert info['bytes'] == 256 * info['entries']
+    assert all(shard.cache.currsize <= 1024 for shard in store.shards)
+    assert info['entries'] < 32 and info['evictions'] == 32 - info['entries']
+
+    print('the least recently used entries go first')
+    shard = store.shard('key_31')
+    assert store.get('key_31') is not None
+    for index in range(32, 64):
+        key = f'key_{index}'
+        if store.shard(key) is shard:
+            store.put(key, entry(b'x' * 256))
+    assert store.get('key_31') is None
+
+    print('a value larger than the budget of one shard (maxsize / shards) is refused')
+    try:
+        store.put('too_large', entry(b'x' * 1025))
+        assert False
+    except ValueError:
+        pass
+    assert store.get('too_large') is None
+    assert store.put('fits', entry(b'x' * 1024)) and store.get('fits') is not None
+    assert store.shard('fits').cache.currsize == 1024
+
+    print('expired entries free their bytes')
+    store = ZerocacheStore(maxsize=4096, size_mode='bytes', shards=4)
+    for index in range(4):
+        store.put(f'short_{index}', entry(b'x' * 100, expiry=0.1))
+    assert store.info()['bytes'] == 400
+    time.sleep(0.15)
+    assert all(store.get(f'short_{index}') is None for index in range(4))
+    assert store.info()['bytes'] == 0 and store.info()['expirations'] == 4
+
+def test_store_entries():
+    store = ZerocacheStore(maxsize=8, size_mode='entries', shards=2)
+    for index in range(16):
+        store.put(f'key_{index}', entry(b'x' * 1000))
+    info = store.info()
+    assert info['size_mode'] == 'entries' and info['currsize'] == info['entries'] <= 8
+    assert info['bytes'] == 1000 * info['entries']
+    try:
+        ZerocacheStore(maxsize=8, size_mode='pages')
+        assert False
+    except ValueError:
+        pass
+
+def test_server_bytes():
+    network = ZerocacheMemoryNetwork(seed=1)
+    server = ZerocacheServer('10.0.0.1', port=7501, region='local', network=network, probe_interval=0, anti_entropy_interval=0
+        , local_maxsize=8192, remote_maxsize=8192, size_mode='bytes', cache_shards=2)
+    server.start()
+    zc = ZerocacheClient('local', network=network, probe_interval=0, compression=None)
+    session = requests.Session()
+    session.mount('http://', network.adapter(zc))
+    try:
+        print('writes past the budget evict, values past a shard budget are not stored')
+        for index in range(16):
+            assert zc.put(f'key_{index}', b'x' * 1000, 60)
+        assert not server.store('local', 'too_large', b'x' * 4097, 60)
+        assert server.lookup('local', 'too_large') is None
+        info = session.get('http://10.0.0.1:7501/local_cache_info').json()
+        assert info['size_mode'] == 'bytes' and info['maxsize'] == 8192 and info['shards'] == 2
+        assert info['bytes'] == info['currsize'] == 1000 * info['entries'] <= 8192
+        assert info['evictions'] == 16 - info['entries']
+    finally:
+        server.stop()
+
+    print('byte budgets have to be given, the entry counts would leave a few bytes per shard')
+    try:
+        ZerocacheServer('10.0.0.1', port=7502, region='local', network=network, size_mode='bytes', local_maxsize=8192)
+        assert False
+    except ValueError:
+        pass
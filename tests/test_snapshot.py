@@ -0,0 +1,80 @@
+import subprocess
+import time
+import signal
+import os
+import shutil
+import tempfile
+from zerocache import ZerocacheClient
+import pickle
+import requests
+
+
+def start_dummy_server(port, *options):
+    return subprocess.Popen(['coverage', 'run', '--data-file=dummy_server.coverage', '--append', 'tests/dummy_server.py', str(port), 'local', *options], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def stop_dummy_servers(services):
+    print('')
+    print('terminating...')
+    for service in services:
+        print('- one down')
+        service.send_signal(signal.SIGTERM)
+        time.sleep(0.5)
+        service.send_signal(signal.SIGKILL)
+    print('terminating... all done')
+
+def wait_for(url, deadline=10):
+    deadline = time.time() + deadline
+    while time.time() < deadline:
+        try:
+            response = requests.get(url, timeout=0.5)
+            if response.status_code == 200:
+                return response
+        except:
+            pass
+        time.sleep(0.25)
+    return None
+
+
+def test_snapshot_and_bootstrap():
+    services = []
+    directory = tempfile.mkdtemp()
+    snapshot = os.path.join(directory, 'local.snapshot')
+    try:
+        ZerocacheClient.clear_instance('local')
+        zc: ZerocacheClient = ZerocacheClient.get_instance('local')
+        services.append(start_dummy_server(15051, f'--snapshot={snapshot}'))
+        deadline = time.time() + 10
+        while len(zc.services.get('local', [])) < 1 and time.time() < deadline:
+            time.sleep(0.25)
+
+        big = pickle.dumps(['zerocache'] * 2000)
+        assert zc.put('a', pickle.dumps('alpha'), 60)
+        assert zc.put('big', big, 60)
+        assert zc.put('short', pickle.dumps('gone soon'), 1)
+        assert requests.put('http://127.0.0.1:15051/faraway/r?expiry=60', data=b'remote').status_code == 200
+
+        print('saved on shutdown')
+        services[0].send_signal(signal.SIGTERM)
+        services[0].wait(timeout=10)
+        assert os.path.getsize(snapshot) > 0
+
+        print('restored on start, less what expired meanwhile')
+        time.sleep(1.5)
+        services[0] = start_dummy_server(15051, f'--snapshot={snapshot}')
+        assert wait_for('http://127.0.0.1:15051/ping') is not None
+        assert pickle.loads(requests.get('http://127.0.0.1:15051/local/a').content) == 'alpha'
+        assert requests.get('http://127.0.0.1:15051/local/big').content == big
+        assert requests.get('http://127.0.0.1:15051/local/short').status_code == 404
+        assert requests.get('http://127.0.0.1:15051/faraway/r').content == b'remote'
+
+        print('a new node copies the caches of a peer')
+        services.append(start_dummy_server(15052, '--bootstrap'))
+        found = wait_for('http://127.0.0.1:15052/local/a', deadline=15)
+        assert found is not None and pickle.loads(found.content) == 'alpha'
+        assert requests.get('http://127.0.0.1:15052/local/big').content == big
+        assert requests.get('http://127.0.0.1:15052/faraway/r').content == b'remote'
+        ttl = float(requests.get('http://127.0.0.1:15052/local/a').headers['X-Zerocache-TTL'])
+        assert 0 < ttl < 60
+    finally:
+        stop_dummy_servers(services)
+        shutil.rmtree(directory, ignore_errors=True)
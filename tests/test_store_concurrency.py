@@ -0,0 +1,85 @@
+import itertools
+import random
+import time
+from threading import Thread
+from zerocache.store import ZerocacheStore, ZerocacheEntry
+
+THREADS = 8
+OPERATIONS = 3000
+SHARED_KEYS = [f'shared_{index}' for index in range(16)]
+
+
+# MEMO: each thread works on keys of its own and on keys shared by all threads. Stamps come from one counter,
+#       so for every key the operation with the highest stamp is the one the store must end up with
+def worker(store, clock, seed, history, errors):
+    rng = random.Random(seed)
+    own_keys = [f'thread_{seed}_{index}' for index in range(32)]
+    try:
+        for _ in range(OPERATIONS):
+            key = rng.choice(own_keys if rng.random() < 0.5 else SHARED_KEYS)
+            action = rng.random()
+            stamp = float(next(clock))
+            if action < 0.4:
+                value = f'{key}:{stamp}'.encode()
+                store.put(key, ZerocacheEntry(value, time.monotonic() + 60, stamp=stamp))
+                history.append((key, stamp, value))
+            elif action < 0.5:
+                store.put(key, ZerocacheEntry(b'expiring', time.monotonic() + 0.05, stamp=stamp))
+                history.append((key, stamp, None))
+            elif action < 0.7:
+                store.bury(key, stamp, 300.0)
+                history.append((key, stamp, None))
+            else:
+                entry = store.get(key)
+                if entry is not None and entry.value != b'expiring' and not entry.value.startswith(f'{key}:'.encode()):
+                    errors.append((key, entry.value))
+    except Exception as e:
+        errors.append(e)
+
+def reader(store, stop, errors):
+    try:
+        while not stop:
+            for (key, entry) in store.items():
+                if entry.value != b'expiring' and not entry.value.startswith(f'{key}:'.encode()):
+                    errors.append((key, entry.value))
+            store.info()
+    except Exception as e:
+        errors.append(e)
+
+
+def test_store_concurrency():
+    store = ZerocacheStore(maxsize=100000, shards=8)
+    clock = itertools.count(1)
+    history = []
+    errors = []
+    stop = []
+    threads = [Thread(target=worker, args=(store, clock, seed, history, errors)) for seed in range(THREADS)]
+    readers = [Thread(target=reader, args=(store, stop, errors)) for _ in range(2)]
+    for thread in threads + readers:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stop.append(True)
+    for thread in readers:
+        thread.join()
+    assert errors == []
+
+    print('every key holds the value of its latest operation, on whichever shard it landed')
+    time.sleep(0.1)
+    latest = {}
+    for (key, stamp, value) in history:
+        if key not in latest or latest[key][0] < stamp:
+            latest[key] = (stamp, value)
+    assert len(latest) > len(SHARED_KEYS)
+    for (key, (stamp, value)) in latest.items():
+        entry = store.get(key)
+        if value is None:
+            assert entry is None, key
+        else:
+            assert entry is not None and entry.value == value and entry.stamp == stamp, key
+
+    print('the counters add up across the shards')
+    held = {key for (key, (_, value)) in latest.items() if value is not None}
+    assert {key for (key, _) in store.items()} == held
+    assert len(store) == len(held) == store.info()['entries']
+    assert len({id(store.shard(key)) for key in latest}) == len(store.shards)
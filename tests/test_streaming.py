@@ -0,0 +1,114 @@
+import json
+import lzma
+import os
+import time
+import requests
+from zerocache import ZerocacheClient, ZerocacheServer, ZerocacheMemoryNetwork, ZerocacheNearCache
+from zerocache.batch import HEADER, pack_records
+
+
+def start_servers(network):
+    servers = [
+        ZerocacheServer('10.0.0.1', port=7201, region='local', network=network, probe_interval=0, anti_entropy_interval=0
+            , local_maxsize=64 * 1024 * 1024, remote_maxsize=64 * 1024 * 1024, size_mode='bytes', cache_shards=1, max_value_size=4 * 1024 * 1024)
+        , ZerocacheServer('10.0.0.2', port=7202, region='local', network=network, probe_interval=0, anti_entropy_interval=0
+            , local_maxsize=64 * 1024 * 1024, remote_maxsize=64 * 1024 * 1024, size_mode='bytes', cache_shards=1, max_value_size=8 * 1024 * 1024)
+    ]
+    for server in servers:
+        server.start()
+    return servers
+
+def eventually(check, deadline=5):
+    deadline = time.time() + deadline
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_streaming():
+    network = ZerocacheMemoryNetwork(seed=1)
+    servers = start_servers(network)
+    zc = ZerocacheClient('local', network=network, probe_interval=0, compression=None)
+    try:
+        print('large values are stored once, and replicated from that buffer')
+        random_value = os.urandom(3 * 1024 * 1024)
+        text_value = b'zerocache ' * 300000
+        assert zc.put('random', random_value, 60)
+        assert zc.put('text', text_value, 60)
+        assert eventually(lambda: all(server.lookup('local', key) is not None for server in servers for key in ('random', 'text')))
+        assert servers[0].lookup('local', 'random') == random_value
+        assert all(server.lookup_entry('local', 'text').coding == 'deflate' for server in servers)
+
+        print('streamed gets hand out a file-like object, read as the caller goes')
+        (ok, reader) = zc.get('random', stream=True)
+        assert ok
+        with reader:
+            chunks = []
+            while True:
+                chunk = reader.read(64 * 1024)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        assert len(chunks) > 1 and b''.join(chunks) == random_value
+        (ok, reader) = zc.get('text', stream=True)
+        assert ok and b''.join(reader.stream(64 * 1024)) == text_value
+        assert zc.get('missing', stream=True) == (False, None)
+        assert zc.get('text') == (True, text_value)
+
+        print('values stored with a coding the HTTP library cannot decode are decompressed by the node')
+        servers[1].store('local', 'xz', lzma.compress(text_value), 60, coding='xz')
+        (ok, reader) = zc.get('xz', stream=True)
+        assert ok and reader.read() == text_value
+        assert zc.get('xz') == (True, text_value)
+
+        print('values over max_value_size are refused')
+        session = requests.Session()
+        session.mount('http://', network.adapter(zc))
+        too_large = os.urandom(4 * 1024 * 1024 + 1)
+        response = session.put('http://10.0.0.1:7201/local/too_large?expiry=60', data=too_large)
+        assert response.status_code == 413
+        assert all(server.lookup('local', 'too_large') is None for server in servers)
+
+        print('batches are refused past max_value_size per record, refused records are not replicated')
+        batch_url = 'http://10.0.0.1:7201/_batch/local'
+        body = pack_records([({'key': 'huge', 'expiry': 60}, os.urandom(9 * 1024 * 1024))])
+        assert session.put(batch_url, data=body).status_code == 413
+        body = pack_records([({'key': 'small', 'expiry': 60}, b'small'), ({'key': 'too_large', 'expiry': 60}, too_large)])
+        assert session.put(batch_url, data=body).status_code == 413
+        assert eventually(lambda: all(server.lookup('local', 'small') == b'small' for server in servers))
+        time.sleep(0.3)
+        assert all(server.lookup('local', key) is None for server in servers for key in ('huge', 'too_large'))
+
+        print('every other body is bounded by max_value_size too')
+        huge_keys = pack_records([({'key': 'k' * (5 * 1024 * 1024)}, None)])
+        assert session.post(batch_url, data=huge_keys).status_code == 413
+        assert session.delete(batch_url, data=huge_keys).status_code == 413
+        huge_json = b'{"tags": ["' + b't' * (5 * 1024 * 1024) + b'"]}'
+        assert session.post('http://10.0.0.1:7201/_invalidate/local', data=huge_json).status_code == 413
+        assert session.post('http://10.0.0.1:7201/_sync/local/tree', data=huge_json).status_code == 413
+        assert session.post('http://10.0.0.1:7201/_sync/local/versions', data=huge_json).status_code == 413
+
+        print('well framed manifests with the wrong fields are refused, not failed')
+        for manifest in ([{'key': 1}], [{'key': 'a', 'size': 'x'}], [{'key': 'a', 'stamp': 'x'}], [{'size': -1}], {'key': 'a'}, [1]):
+            head = json.dumps(manifest).encode()
+            body = HEADER.pack(len(head)) + head
+            for method in ('POST', 'PUT', 'DELETE'):
+                assert session.request(method, batch_url, data=body).status_code == 400, (method, manifest)
+        assert session.post('http://10.0.0.1:7201/_sync/local/tree', data=b'[1]').status_code == 400
+        assert session.post('http://10.0.0.1:7201/_sync/local/tree', data=b'{"level": "x", "indexes": 1}').status_code == 400
+        assert session.post('http://10.0.0.1:7201/_sync/local/versions', data=b'{"leaves": 5}').status_code == 400
+
+        print('refused writes are reported to the client, and kept out of its near cache')
+        zc.near_cache = ZerocacheNearCache(max_bytes=64 * 1024 * 1024)
+        huge = os.urandom(9 * 1024 * 1024)
+        assert not zc.put('huge', huge, 60)
+        assert zc.near_cache.get('huge') is None
+        assert not zc.put_many({'huge': huge}, 60)
+        assert zc.put('small', b'smaller', 60) and zc.near_cache.get('small') == b'smaller'
+        zc.near_cache = None
+        assert session.get('http://10.0.0.1:7201/ping').status_code == 200
+    finally:
+        for server in servers:
+            server.stop()